@@ -0,0 +1,18 @@
+"""缓存包"""
+
+from .keys import canonical_hash
+from .lru_cache import CacheEntry, LRUCache
+from .reasoning_cache import CachedReasoning, ReasoningCache, reasoning_cache
+from .response_cache import CachedResponse, ResponseCache, response_cache
+
+__all__ = [
+    "canonical_hash",
+    "CacheEntry",
+    "LRUCache",
+    "CachedReasoning",
+    "ReasoningCache",
+    "reasoning_cache",
+    "CachedResponse",
+    "ResponseCache",
+    "response_cache",
+]
@@ -0,0 +1,20 @@
+"""缓存键计算"""
+
+import hashlib
+import json
+from typing import Any
+
+
+def canonical_hash(*parts: Any) -> str:
+    """计算任意 JSON 兼容数据的规范化哈希
+
+    字典按键排序、去除多余空白后序列化，内容相同的请求总能得到相同的键。
+
+    Args:
+        parts: 参与计算的数据
+
+    Returns:
+        str: sha256 十六进制摘要
+    """
+    payload = json.dumps(parts, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
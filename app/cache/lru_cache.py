@@ -0,0 +1,144 @@
+"""带 TTL 和内存上限的 LRU 缓存基类"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Generic, Optional, TypeVar
+
+from app.utils.logger import logger
+from app.utils.metrics import Counter, Gauge
+
+
+class CacheEntry:
+    """缓存条目基类，子类需要在构造时计算 size"""
+
+    size: int = 0
+    expires_at: float = 0.0
+
+
+EntryT = TypeVar("EntryT", bound=CacheEntry)
+
+
+class LRUCache(Generic[EntryT]):
+    """进程内 LRU 缓存
+
+    条目按最近使用顺序保存在 OrderedDict 中，超过条目数或内存上限时从最久未使用的一端淘汰，
+    写入的开销与缓存大小无关。过期条目在访问时清理，或在淘汰时被优先移除。
+    子类通过 CONFIG_KEY 指定 system 配置中的字段名，并提供各自的指标对象。
+    """
+
+    # 默认设置
+    # max_entries: 最大条目数
+    # ttl_seconds: 条目有效期(秒)
+    # max_bytes: 估算内存上限(字节)
+    DEFAULT_SETTINGS = {
+        "max_entries": 1024,
+        "ttl_seconds": 600,
+        "max_bytes": 64 * 1024 * 1024,
+    }
+    CONFIG_KEY = ""
+
+    def __init__(self, requests: Counter, evictions: Counter, entries: Gauge, total_bytes: Gauge):
+        """初始化缓存
+
+        Args:
+            requests: 查询次数指标，按 model/result 区分
+            evictions: 淘汰次数指标，按 reason 区分
+            entries: 当前条目数指标
+            total_bytes: 当前占用字节数指标
+        """
+        self._entries: "OrderedDict[str, EntryT]" = OrderedDict()
+        self.total_bytes = 0
+        self.settings = dict(self.DEFAULT_SETTINGS)
+        self._requests_metric = requests
+        self._evictions_metric = evictions
+        self._entries_metric = entries
+        self._bytes_metric = total_bytes
+
+    def configure(self, system_config: Optional[dict] = None) -> None:
+        """根据系统配置更新缓存设置
+
+        Args:
+            system_config: 系统配置，读取其中 CONFIG_KEY 对应的字段
+        """
+        cache_config = (system_config or {}).get(self.CONFIG_KEY, {}) or {}
+        settings = dict(self.DEFAULT_SETTINGS)
+        for key in self.DEFAULT_SETTINGS:
+            if cache_config.get(key) is not None:
+                settings[key] = cache_config[key]
+        self.settings = settings
+        self._evict()
+
+    def get(self, key: str) -> Optional[EntryT]:
+        """查找缓存条目，命中时将其移到最近使用位置"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._remove(key, "ttl")
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, entry: EntryT) -> None:
+        """写入缓存条目，单个条目超过内存上限时不缓存"""
+        if entry.size > self.settings["max_bytes"]:
+            logger.debug(f"条目过大({entry.size} 字节)，不写入缓存")
+            return
+        if key in self._entries:
+            self._remove(key, None)
+        entry.expires_at = time.monotonic() + self.settings["ttl_seconds"]
+        self._entries[key] = entry
+        self.total_bytes += entry.size
+        self._evict()
+        self._update_gauges()
+
+    def record(self, model: str, result: str) -> None:
+        """记录一次查询结果(hit/miss/bypass)"""
+        self._requests_metric.inc(model=model, result=result)
+
+    def clear(self) -> None:
+        """清空缓存"""
+        self._entries.clear()
+        self.total_bytes = 0
+        self._update_gauges()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回缓存统计信息"""
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "hits": self._requests_metric.sum(result="hit"),
+            "misses": self._requests_metric.sum(result="miss"),
+            "evictions": {
+                reason: self._evictions_metric.get(reason=reason)
+                for reason in ("lru", "ttl", "memory")
+            },
+            **self.settings,
+        }
+
+    def _remove(self, key: str, reason: Optional[str]) -> None:
+        entry = self._entries.pop(key)
+        self.total_bytes -= entry.size
+        if reason:
+            self._evictions_metric.inc(reason=reason)
+        self._update_gauges()
+
+    def _evict(self) -> None:
+        """从最久未使用的一端淘汰条目，直到满足条目数和内存上限，已过期的条目计为 ttl"""
+        now = time.monotonic()
+        while self._entries and (
+            len(self._entries) > self.settings["max_entries"]
+            or self.total_bytes > self.settings["max_bytes"]
+        ):
+            key, entry = next(iter(self._entries.items()))
+            if entry.expires_at <= now:
+                reason = "ttl"
+            elif len(self._entries) > self.settings["max_entries"]:
+                reason = "lru"
+            else:
+                reason = "memory"
+            self._remove(key, reason)
+
+    def _update_gauges(self) -> None:
+        self._entries_metric.set(len(self._entries))
+        self._bytes_metric.set(self.total_bytes)
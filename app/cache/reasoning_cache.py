@@ -0,0 +1,126 @@
+"""推理阶段缓存
+
+推理模型的输出只取决于推理模型和对话内容，与最终使用哪个目标模型无关。
+多个组合模型共用同一个推理模型时，相同对话的推理结果可以直接复用，跳过最慢的推理阶段。
+缓存默认关闭，与响应缓存一样需要在 system.reasoning_cache.enabled 中显式开启。
+"""
+
+import sys
+from contextlib import aclosing
+from typing import Any, AsyncGenerator, Dict, List, Optional, Sequence
+
+from app.clients import DeepSeekClient
+from app.utils.logger import logger
+from app.utils.metrics import (
+    REASONING_CACHE_BYTES,
+    REASONING_CACHE_ENTRIES,
+    REASONING_CACHE_EVICTIONS,
+    REASONING_CACHE_REQUESTS,
+)
+
+from .keys import canonical_hash
+from .lru_cache import CacheEntry, LRUCache
+
+
+class CachedReasoning(CacheEntry):
+    """一次完整的推理过程，保留原有分片以便按 delta 重放
+
+    Args:
+        reasoning_parts: 推理内容分片
+    """
+
+    def __init__(self, reasoning_parts: Sequence[str]):
+        self.reasoning_parts = tuple(reasoning_parts)
+        self.expires_at = 0.0
+        self.size = sum(sys.getsizeof(part) for part in self.reasoning_parts) + sys.getsizeof(self)
+
+
+class ReasoningCache(LRUCache[CachedReasoning]):
+    """按推理模型和对话内容缓存推理结果，设置可通过 system.reasoning_cache 覆盖"""
+
+    CONFIG_KEY = "reasoning_cache"
+
+    def __init__(self):
+        """初始化推理阶段缓存，默认关闭"""
+        super().__init__(
+            REASONING_CACHE_REQUESTS,
+            REASONING_CACHE_EVICTIONS,
+            REASONING_CACHE_ENTRIES,
+            REASONING_CACHE_BYTES,
+        )
+        self.enabled = False
+
+    def configure(self, system_config: Optional[dict] = None) -> None:
+        """根据系统配置更新缓存设置和开关
+
+        Args:
+            system_config: 系统配置，读取其中的 reasoning_cache 字段
+        """
+        super().configure(system_config)
+        cache_config = (system_config or {}).get(self.CONFIG_KEY, {}) or {}
+        self.enabled = bool(cache_config.get("enabled", False))
+
+    @staticmethod
+    def make_key(
+        client: DeepSeekClient, messages: List[Dict[str, Any]], model: str, is_origin_reasoning: bool
+    ) -> str:
+        """计算推理缓存键
+
+        开启 save_deepseek_tokens 时推理会被截断，截断长度也参与计算，避免复用不同长度的推理。
+        """
+        max_tokens = None
+        if is_origin_reasoning and client.system_config.get("save_deepseek_tokens", False):
+            max_tokens = client.system_config.get("save_deepseek_tokens_max_tokens", 5)
+        return canonical_hash(model, is_origin_reasoning, max_tokens, messages)
+
+    async def stream_chat(
+        self,
+        client: DeepSeekClient,
+        messages: List[Dict[str, Any]],
+        model: str,
+        is_origin_reasoning: bool = True,
+    ) -> AsyncGenerator[tuple[str, str], None]:
+        """带缓存的推理流，输出格式与 DeepSeekClient.stream_chat 相同
+
+        命中时按原有分片重放推理内容，再输出一个空的 content 标记推理结束；
+        未命中时透传上游输出，推理完整结束(收到 content)后写入缓存。
+
+        Args:
+            client: 推理模型客户端
+            messages: 消息列表，必须是尚未被目标阶段修改的原始消息
+            model: 推理模型名称
+            is_origin_reasoning: 是否使用原生推理字段
+
+        Yields:
+            tuple[str, str]: (内容类型, 内容)
+        """
+        if not self.enabled:
+            async with aclosing(client.stream_chat(messages, model, is_origin_reasoning)) as stream:
+                async for item in stream:
+                    yield item
+            return
+
+        key = self.make_key(client, messages, model, is_origin_reasoning)
+        cached = self.get(key)
+        if cached is not None:
+            self.record(model, "hit")
+            logger.info(f"推理模型 {model} 命中推理缓存，跳过推理阶段")
+            for part in cached.reasoning_parts:
+                yield "reasoning", part
+            yield "content", ""
+            return
+
+        self.record(model, "miss")
+        reasoning_parts = []
+        async with aclosing(client.stream_chat(messages, model, is_origin_reasoning)) as stream:
+            async for content_type, content in stream:
+                if content_type == "reasoning":
+                    reasoning_parts.append(content)
+                elif content_type == "content" and reasoning_parts:
+                    # 调用方收到 content 后通常会立即停止迭代，必须在 yield 之前写入
+                    self.put(key, CachedReasoning(reasoning_parts))
+                yield content_type, content
+
+
+# 创建全局 ReasoningCache 实例
+reasoning_cache = ReasoningCache()
@@ -0,0 +1,167 @@
+"""聊天补全响应缓存，支持 LRU + TTL 淘汰和内存上限"""
+
+import sys
+import time
+from contextlib import aclosing
+from typing import Any, AsyncGenerator, Dict, List, Optional, Sequence
+
+from app.utils.chunk_encoder import DONE_FRAME, ChunkEncoder
+from app.utils.metrics import (
+    RESPONSE_CACHE_BYTES,
+    RESPONSE_CACHE_ENTRIES,
+    RESPONSE_CACHE_EVICTIONS,
+    RESPONSE_CACHE_REQUESTS,
+)
+from app.utils.stream_tasks import StreamRecorder
+
+from .keys import canonical_hash
+from .lru_cache import CacheEntry, LRUCache
+
+
+class CachedResponse(CacheEntry):
+    """一次完整生成的结果，可以重放为 SSE 帧或 JSON 响应
+
+    Args:
+        reasoning_model: 推理模型名称
+        target_model: 目标模型名称
+        reasoning_parts: 推理内容分片，重放时保持原有分片
+        content_parts: 回答内容分片
+        usage: token 用量
+    """
+
+    def __init__(
+        self,
+        reasoning_model: str,
+        target_model: str,
+        reasoning_parts: Sequence[str],
+        content_parts: Sequence[str],
+        usage: Optional[Dict[str, Any]] = None,
+    ):
+        self.reasoning_model = reasoning_model
+        self.target_model = target_model
+        self.reasoning_parts = tuple(reasoning_parts)
+        self.content_parts = tuple(content_parts)
+        self.usage = usage or {}
+        self.expires_at = 0.0
+        self.size = (
+            sum(sys.getsizeof(part) for part in self.reasoning_parts)
+            + sum(sys.getsizeof(part) for part in self.content_parts)
+            + sys.getsizeof(self)
+        )
+
+    @staticmethod
+    def _new_chat_id() -> str:
+        return f"chatcmpl-{hex(int(time.time() * 1000))[2:]}"
+
+    async def to_stream(self, include_usage: bool = False) -> AsyncGenerator[bytes, None]:
+        """重放为 SSE 字节流
+
+        Args:
+            include_usage: 是否在结束前输出用量帧
+        """
+        encoder = ChunkEncoder(
+            self._new_chat_id(), int(time.time()), self.reasoning_model, self.target_model
+        )
+        for part in self.reasoning_parts:
+            yield encoder.reasoning(part)
+        for part in self.content_parts:
+            yield encoder.answer(part)
+        yield encoder.finish()
+        if include_usage and self.usage:
+            yield encoder.usage(self.usage)
+        yield DONE_FRAME
+
+    def to_response(self) -> Dict[str, Any]:
+        """重放为 OpenAI 格式的完整响应"""
+        return {
+            "id": self._new_chat_id(),
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": self.target_model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {
+                        "role": "assistant",
+                        "content": "".join(self.content_parts),
+                        "reasoning_content": "".join(self.reasoning_parts),
+                    },
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": dict(self.usage),
+        }
+
+    @classmethod
+    def from_response(cls, reasoning_model: str, response: Dict[str, Any]) -> Optional["CachedResponse"]:
+        """从非流式响应构造缓存条目，响应不完整时返回 None"""
+        choices = response.get("choices") or []
+        if not choices:
+            return None
+        message = choices[0].get("message", {})
+        return cls(
+            reasoning_model,
+            response.get("model", ""),
+            [message.get("reasoning_content") or ""],
+            [message.get("content") or ""],
+            response.get("usage"),
+        )
+
+
+class ResponseCache(LRUCache[CachedResponse]):
+    """进程内响应缓存，设置可通过 model_configs.json 中 system.response_cache 覆盖"""
+
+    CONFIG_KEY = "response_cache"
+
+    def __init__(self):
+        """初始化响应缓存"""
+        super().__init__(
+            RESPONSE_CACHE_REQUESTS,
+            RESPONSE_CACHE_EVICTIONS,
+            RESPONSE_CACHE_ENTRIES,
+            RESPONSE_CACHE_BYTES,
+        )
+
+    @staticmethod
+    def make_key(model: str, messages: List[Dict[str, Any]], params: Sequence[Any]) -> str:
+        """根据模型名称、消息和采样参数计算缓存键"""
+        return canonical_hash(model, messages, list(params))
+
+    async def store_stream(
+        self,
+        key: str,
+        stream: AsyncGenerator[bytes, None],
+        recorder: StreamRecorder,
+        reasoning_model: str,
+        target_model: str,
+    ) -> AsyncGenerator[bytes, None]:
+        """透传流式输出，生成完整成功结束且推理未被截断时写入缓存
+
+        Args:
+            key: 缓存键
+            stream: 组合模型的流式输出
+            recorder: 与该流绑定的记录器
+            reasoning_model: 推理模型名称
+            target_model: 目标模型名称
+
+        Yields:
+            bytes: 原始 SSE 帧
+        """
+        async with aclosing(stream) as frames:
+            async for frame in frames:
+                yield frame
+        if recorder.cacheable:
+            self.put(
+                key,
+                CachedResponse(
+                    reasoning_model,
+                    target_model,
+                    recorder.reasoning_parts,
+                    recorder.content_parts,
+                    recorder.usage,
+                ),
+            )
+
+
+# 创建全局 ResponseCache 实例
+response_cache = ResponseCache()
@@ -1,5 +1,18 @@
-from .base_client import BaseClient
+from .base_client import BaseClient, UpstreamStatusError
 from .deepseek_client import DeepSeekClient
 from .claude_client import ClaudeClient
+from .circuit_breaker import CircuitBreaker, CircuitBreakerRegistry, CircuitOpenError, circuit_breakers
+from .client_registry import ClientRegistry, client_registry
+from .key_pool import ApiKey, KeyPool
+from .reasoner_pool import HedgePolicy, ReasonerEndpoint, ReasonerPool
+from .session_pool import SessionPool, session_pool
+from .target_pool import TargetEndpoint, TargetPool
+from .sse_parser import SSEDecoder, SSEEvent, iter_sse_events
 
-__all__ = ['BaseClient', 'DeepSeekClient', 'ClaudeClient']
+__all__ = ['BaseClient', 'UpstreamStatusError', 'DeepSeekClient', 'ClaudeClient',
+           'CircuitBreaker', 'CircuitBreakerRegistry', 'CircuitOpenError', 'circuit_breakers',
+           'ClientRegistry', 'client_registry',
+           'ApiKey', 'KeyPool',
+           'HedgePolicy', 'ReasonerEndpoint', 'ReasonerPool', 'SessionPool', 'session_pool',
+           'TargetEndpoint', 'TargetPool',
+           'SSEDecoder', 'SSEEvent', 'iter_sse_events']
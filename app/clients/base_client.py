@@ -1,12 +1,58 @@
 """基础客户端类,定义通用接口"""
 
+import asyncio
+import time
 from abc import ABC, abstractmethod
-from typing import AsyncGenerator, Optional
+from typing import AsyncGenerator, Dict, List, Optional, Union
 
 import aiohttp
 from aiohttp.client_exceptions import ClientError, ServerTimeoutError
+from yarl import URL
 
 from app.utils.logger import logger
+from app.utils.metrics import UPSTREAM_ERRORS, UPSTREAM_RESPONSE_SECONDS
+
+from .circuit_breaker import CircuitOpenError, circuit_breakers
+from .key_pool import KeyPool
+from .session_pool import session_pool
+
+
+class UpstreamStatusError(ClientError):
+    """上游返回非 2xx 状态码
+
+    Args:
+        status: HTTP 状态码
+        message: 错误信息
+    """
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def upstream_failure_reason(error: BaseException) -> Optional[str]:
+    """判断错误是否属于上游提供商自身的故障(可以换用其他提供商重试)
+
+    Args:
+        error: 请求上游时抛出的错误
+
+    Returns:
+        Optional[str]: 故障原因(状态码、timeout、connect 或 circuit_open)，请求本身的错误(如 400)返回 None
+    """
+    # 客户端可能把原始错误包装后重新抛出(raise ... from e)，沿 __cause__ 查找
+    while error is not None:
+        if isinstance(error, CircuitOpenError):
+            return "circuit_open"
+        if isinstance(error, UpstreamStatusError):
+            if error.status == 429 or error.status >= 500:
+                return str(error.status)
+            return None
+        if isinstance(error, asyncio.TimeoutError):
+            return "timeout"
+        if isinstance(error, aiohttp.ClientConnectionError):
+            return "connect"
+        error = error.__cause__
+    return None
 
 
 class BaseClient(ABC):
@@ -19,9 +65,13 @@ class BaseClient(ABC):
     # TODO: 默认时间的设置涉及到模型推理速度，需要根据实际情况进行调整
     DEFAULT_TIMEOUT = aiohttp.ClientTimeout(total=600, connect=10, sock_read=500)
 
+    # 单次读取的最大字节数。限制每次交给解析器的数据量，
+    # 下游读取过慢时，未解析的数据留在连接的读缓冲区中，由 TCP 流控反压上游
+    READ_CHUNK_SIZE = 16384
+
     def __init__(
         self,
-        api_key: str,
+        api_key: Union[str, List[str]],
         api_url: str,
         timeout: Optional[aiohttp.ClientTimeout] = None,
         proxy: Optional[str] = None,
@@ -29,15 +79,56 @@ class BaseClient(ABC):
         """初始化基础客户端
 
         Args:
-            api_key: API密钥
+            api_key: API密钥，配置多个密钥(列表)时按限流状态轮换使用
             api_url: API地址
             timeout: 请求超时设置,None则使用默认值
             proxy: 代理服务器地址，例如 "http://127.0.0.1:7890"
         """
-        self.api_key = api_key
         self.api_url = api_url
         self.timeout = timeout or self.DEFAULT_TIMEOUT
         self.proxy = proxy
+        self.proxy_url = self._normalize_proxy(proxy)
+        # 指标中使用的上游标签，只取主机名以控制标签数量
+        self.upstream = URL(api_url).host or api_url
+        self.key_pool = KeyPool(api_key, self.upstream)
+        # 子类用第一个密钥构造请求头，_make_request 中替换为实际选择的密钥
+        self.api_key = self.key_pool.keys[0].value
+
+    @staticmethod
+    def _normalize_proxy(proxy: Optional[str]) -> Optional[str]:
+        """处理代理地址格式
+
+        Args:
+            proxy: 原始代理地址
+
+        Returns:
+            Optional[str]: 带协议前缀的代理地址，未配置代理时为 None
+        """
+        if not proxy:
+            return None
+        # 如果代理地址不包含协议前缀，添加 http:// 前缀
+        if not proxy.startswith(('http://', 'https://', 'socks://', 'socks5://')):
+            return f"http://{proxy}"
+        return proxy
+
+    def _with_api_key(self, headers: Dict[str, str], api_key: str) -> Dict[str, str]:
+        """把请求头中的密钥替换为密钥池选择的密钥
+
+        Args:
+            headers: 子类使用 self.api_key 构造的请求头
+            api_key: 本次请求使用的密钥
+
+        Returns:
+            Dict[str, str]: 替换后的请求头
+        """
+        if api_key == self.api_key:
+            return headers
+        headers = dict(headers)
+        if "x-api-key" in headers:
+            headers["x-api-key"] = api_key
+        if "Authorization" in headers:
+            headers["Authorization"] = f"Bearer {api_key}"
+        return headers
 
     async def _make_request(
         self, headers: dict, data: dict, timeout: Optional[aiohttp.ClientTimeout] = None
@@ -53,57 +144,105 @@ class BaseClient(ABC):
             bytes: 原始响应数据
 
         Raises:
+            UpstreamStatusError: 上游返回非 2xx 状态码
+            CircuitOpenError: 所有密钥对应的熔断器都处于打开状态
             aiohttp.ClientError: 客户端错误
             ServerTimeoutError: 服务器超时
             Exception: 其他异常
         """
         request_timeout = timeout or self.timeout
+        # 已经按状态码记录过错误时为 True，避免在异常处理中重复计数
+        error_recorded = False
 
         try:
-            # 使用 connector 参数来优化连接池
-            connector = aiohttp.TCPConnector(limit=100, force_close=True)
-            
-            # 处理代理地址格式
-            proxy_url = None
-            if self.proxy:
-                # 如果代理地址不包含协议前缀，添加 http:// 前缀
-                if self.proxy and not self.proxy.startswith(('http://', 'https://', 'socks://', 'socks5://')):
-                    proxy_url = f"http://{self.proxy}"
-                else:
-                    proxy_url = self.proxy
-                logger.info(f"使用代理: {proxy_url}")
-            
-            async with aiohttp.ClientSession(connector=connector) as session:
-                async with session.post(
-                    self.api_url, 
-                    headers=headers, 
-                    json=data, 
-                    timeout=request_timeout,
-                    proxy=proxy_url
-                ) as response:
-                    # 检查响应状态
-                    if not response.ok:
-                        error_text = await response.text()
-                        error_msg = f"API 请求失败: 状态码 {response.status}, 错误信息: {error_text}"
-                        logger.error(error_msg)
-                        raise ClientError(error_msg)
-
-                    # 流式读取响应内容
-                    async for chunk in response.content.iter_any():
-                        if chunk:  # 过滤空chunks
-                            yield chunk
-
-        except ServerTimeoutError as e:
+            # 从进程级连接池获取共享会话，复用 keep-alive 连接
+            if self.proxy_url:
+                logger.debug(f"使用代理: {self.proxy_url}")
+            session = session_pool.get_session(self.api_url, self.proxy_url)
+
+            # 被限流(429)或熔断时换用其他密钥，每个密钥最多尝试一次
+            tried = set()
+            while True:
+                key = self.key_pool.acquire(exclude=tried)
+                tried.add(key.label)
+                breaker = circuit_breakers.get(self.api_url, self.upstream, key.digest, key.label)
+                if not breaker.allow():
+                    self.key_pool.release(key)
+                    if len(tried) < len(self.key_pool):
+                        continue
+                    UPSTREAM_ERRORS.inc(upstream=self.upstream, status="circuit_open")
+                    error_recorded = True
+                    raise CircuitOpenError(self.upstream, breaker.retry_after())
+
+                # 本次请求反映的上游健康状态，None 表示不计入熔断统计(如被取消或被限流)
+                healthy = None
+                try:
+                    request_started = time.perf_counter()
+                    async with session.post(
+                        self.api_url,
+                        headers=self._with_api_key(headers, key.value),
+                        json=data,
+                        timeout=request_timeout,
+                        proxy=self.proxy_url
+                    ) as response:
+                        UPSTREAM_RESPONSE_SECONDS.observe(
+                            time.perf_counter() - request_started, upstream=self.upstream
+                        )
+                        self.key_pool.update(key, response.status, response.headers)
+                        if (
+                            response.status == 429
+                            and len(tried) < len(self.key_pool)
+                            and self.key_pool.has_available(exclude=tried)
+                        ):
+                            UPSTREAM_ERRORS.inc(upstream=self.upstream, status="429")
+                            logger.warning(f"上游 {self.upstream} 的 {key.label} 被限流，换用其他密钥重试")
+                            continue
+
+                        # 检查响应状态
+                        if not response.ok:
+                            if response.status != 429:
+                                healthy = response.status < 500
+                            UPSTREAM_ERRORS.inc(upstream=self.upstream, status=str(response.status))
+                            error_recorded = True
+                            error_text = await response.text()
+                            error_msg = f"API 请求失败: 状态码 {response.status}, 错误信息: {error_text}"
+                            logger.error(error_msg)
+                            raise UpstreamStatusError(response.status, error_msg)
+
+                        # 收到响应后调用方提前关闭流也视为成功，读取过程中出现超时等故障时改为失败
+                        healthy = True
+                        async for chunk in response.content.iter_chunked(self.READ_CHUNK_SIZE):
+                            if chunk:  # 过滤空chunks
+                                yield chunk
+                        return
+                except Exception as e:
+                    if not isinstance(e, UpstreamStatusError) and upstream_failure_reason(e) is not None:
+                        healthy = False
+                    raise
+                finally:
+                    self.key_pool.release(key)
+                    if healthy is None:
+                        breaker.record_ignored()
+                    elif healthy:
+                        breaker.record_success()
+                    else:
+                        breaker.record_failure()
+
+        except (ServerTimeoutError, asyncio.TimeoutError) as e:
+            UPSTREAM_ERRORS.inc(upstream=self.upstream, status="timeout")
             error_msg = f"请求超时: {str(e)}"
             logger.error(error_msg)
             raise
 
         except ClientError as e:
+            if not error_recorded:
+                UPSTREAM_ERRORS.inc(upstream=self.upstream, status="client_error")
             error_msg = f"客户端错误: {str(e)}"
             logger.error(error_msg)
             raise
 
         except Exception as e:
+            UPSTREAM_ERRORS.inc(upstream=self.upstream, status="error")
             error_msg = f"请求处理异常: {str(e)}"
             logger.error(error_msg)
             raise
@@ -0,0 +1,226 @@
+"""上游熔断器，按 (上游地址, API 密钥摘要) 跟踪故障并快速失败
+
+熔断器按密钥的 sha256 摘要区分，使用不同密钥的客户端不会共享熔断器，调整密钥列表顺序也不会
+改变熔断状态；密钥标识(如 key0)只用于指标和日志。
+
+状态转换:
+- closed: 正常放行。连续失败次数或最近窗口内的错误率达到阈值时转为 open
+- open: 直接拒绝请求(CircuitOpenError)，不再等待连接或读取超时。open_seconds 后转为 half_open
+- half_open: 最多放行 half_open_probes 个探测请求，探测成功转为 closed，失败重新转为 open
+
+只有上游自身的故障(5xx、超时、连接错误)计为失败，429 由密钥池处理，其他 4xx 属于请求本身的错误。
+"""
+
+import time
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+
+from aiohttp.client_exceptions import ClientError
+
+from app.utils.logger import logger
+from app.utils.metrics import CIRCUIT_REJECTED, CIRCUIT_STATE, CIRCUIT_TRANSITIONS
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# 指标中的状态值
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(ClientError):
+    """熔断器处于打开状态，请求未发送到上游
+
+    Args:
+        upstream: 上游地址
+        retry_after: 距离允许探测的秒数
+    """
+
+    def __init__(self, upstream: str, retry_after: float):
+        super().__init__(f"上游 {upstream} 已熔断，{retry_after:.1f} 秒后重试")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """单个 (上游地址, API 密钥) 的熔断器
+
+    Args:
+        upstream: 上游主机名，用于指标和日志
+        key: 密钥标识(如 key0)，用于指标和日志
+        settings: 熔断设置，与 CircuitBreakerRegistry.settings 共享
+    """
+
+    def __init__(self, upstream: str, key: str, settings: Dict[str, Any]):
+        self.upstream = upstream
+        self.key = key
+        self.settings = settings
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        # 最近的请求结果，True 表示失败
+        self.outcomes: deque = deque(maxlen=settings["window"])
+        self.opened_at = 0.0
+        self.probes = 0
+        self.rejected = 0
+        CIRCUIT_STATE.set(_STATE_VALUES[CLOSED], upstream=upstream, key=key)
+
+    def _transition(self, state: str) -> None:
+        """切换状态并更新指标"""
+        if state == self.state:
+            return
+        logger.warning(f"上游 {self.upstream} 的 {self.key} 熔断器状态: {self.state} -> {state}")
+        self.state = state
+        self.probes = 0
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        else:
+            self.consecutive_failures = 0
+            self.outcomes = deque(maxlen=self.settings["window"])
+        CIRCUIT_STATE.set(_STATE_VALUES[state], upstream=self.upstream, key=self.key)
+        CIRCUIT_TRANSITIONS.inc(upstream=self.upstream, key=self.key, state=state)
+
+    def retry_after(self) -> float:
+        """打开状态下距离允许探测的秒数"""
+        return max(self.opened_at + self.settings["open_seconds"] - time.monotonic(), 0.0)
+
+    def allow(self) -> bool:
+        """是否放行一个请求，放行后必须调用 record_success、record_failure 或 record_ignored 之一
+
+        Returns:
+            bool: False 表示应快速失败
+        """
+        if not self.settings["enabled"]:
+            return True
+        if self.state == OPEN:
+            if self.retry_after() > 0:
+                self.rejected += 1
+                CIRCUIT_REJECTED.inc(upstream=self.upstream, key=self.key)
+                return False
+            self._transition(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self.probes >= self.settings["half_open_probes"]:
+                self.rejected += 1
+                CIRCUIT_REJECTED.inc(upstream=self.upstream, key=self.key)
+                return False
+            self.probes += 1
+        return True
+
+    def record_success(self) -> None:
+        """请求成功"""
+        if self.state == HALF_OPEN:
+            self._transition(CLOSED)
+            return
+        self.consecutive_failures = 0
+        self.outcomes.append(False)
+
+    def record_failure(self) -> None:
+        """请求因上游故障失败"""
+        if self.state == HALF_OPEN:
+            self._transition(OPEN)
+            return
+        if self.state == OPEN:
+            return
+        self.consecutive_failures += 1
+        self.outcomes.append(True)
+        if self.consecutive_failures >= self.settings["failure_threshold"]:
+            self._transition(OPEN)
+            return
+        if len(self.outcomes) >= self.settings["min_requests"]:
+            error_rate = sum(self.outcomes) / len(self.outcomes)
+            if error_rate >= self.settings["error_rate_threshold"]:
+                self._transition(OPEN)
+
+    def record_ignored(self) -> None:
+        """请求在得到结果前被取消，或失败原因与上游健康无关，不计入统计"""
+        if self.state == HALF_OPEN and self.probes > 0:
+            # 释放探测名额，允许下一个请求继续探测
+            self.probes -= 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """返回当前状态，用于管理接口"""
+        result = {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "error_rate": round(sum(self.outcomes) / len(self.outcomes), 4) if self.outcomes else 0.0,
+            "requests": len(self.outcomes),
+            "rejected": self.rejected,
+        }
+        if self.state == OPEN:
+            result["retry_after"] = round(self.retry_after(), 3)
+        return result
+
+
+class CircuitBreakerRegistry:
+    """进程级熔断器注册表，按 (上游地址, 密钥摘要) 维护熔断器"""
+
+    # 默认熔断设置，可通过 model_configs.json 中 system.circuit_breaker 覆盖
+    # enabled: 是否启用熔断
+    # failure_threshold: 连续失败多少次后打开
+    # error_rate_threshold: 最近窗口内错误率达到该值时打开
+    # window: 计算错误率的最近请求数
+    # min_requests: 按错误率打开前窗口内至少需要的请求数
+    # open_seconds: 打开后多久允许探测(秒)
+    # half_open_probes: 半开状态下同时放行的探测请求数
+    DEFAULT_SETTINGS = {
+        "enabled": True,
+        "failure_threshold": 5,
+        "error_rate_threshold": 0.5,
+        "window": 20,
+        "min_requests": 10,
+        "open_seconds": 30,
+        "half_open_probes": 1,
+    }
+
+    def __init__(self):
+        """初始化熔断器注册表"""
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+        self.settings = dict(self.DEFAULT_SETTINGS)
+
+    def configure(self, system_config: Optional[dict] = None) -> None:
+        """根据系统配置更新熔断设置，对已有的熔断器立即生效
+
+        Args:
+            system_config: 系统配置，读取其中的 circuit_breaker 字段
+        """
+        breaker_config = (system_config or {}).get("circuit_breaker", {}) or {}
+        for key, default in self.DEFAULT_SETTINGS.items():
+            value = breaker_config.get(key)
+            self.settings[key] = default if value is None else value
+        # 窗口大小变化时按新长度重建已有熔断器的结果窗口，保留最近的结果
+        window = self.settings["window"]
+        for breaker in self._breakers.values():
+            if breaker.outcomes.maxlen != window:
+                breaker.outcomes = deque(breaker.outcomes, maxlen=window)
+        logger.debug(f"熔断设置: {self.settings}")
+
+    def get(self, api_url: str, upstream: str, digest: str, key: str) -> CircuitBreaker:
+        """获取上游地址和密钥对应的熔断器，不存在时创建
+
+        Args:
+            api_url: 上游请求地址
+            upstream: 上游主机名，用于指标和日志
+            digest: 密钥摘要，决定使用哪个熔断器
+            key: 密钥标识，用于指标和日志
+
+        Returns:
+            CircuitBreaker: 熔断器
+        """
+        breaker = self._breakers.get((api_url, digest))
+        if breaker is None:
+            breaker = CircuitBreaker(upstream, key, self.settings)
+            self._breakers[(api_url, digest)] = breaker
+        return breaker
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """返回所有熔断器的状态
+
+        Returns:
+            Dict[str, Dict[str, Any]]: {上游地址: {密钥摘要: 状态}}，状态中的 key 为密钥标识
+        """
+        result: Dict[str, Dict[str, Any]] = {}
+        for (api_url, digest), breaker in self._breakers.items():
+            result.setdefault(api_url, {})[digest] = {"key": breaker.key, **breaker.snapshot()}
+        return result
+
+
+# 创建全局 CircuitBreakerRegistry 实例
+circuit_breakers = CircuitBreakerRegistry()
@@ -1,17 +1,19 @@
 """Claude API 客户端"""
 
 import json
-from typing import AsyncGenerator
+from contextlib import aclosing
+from typing import AsyncGenerator, List, Union
 
 from app.utils.logger import logger
 
 from .base_client import BaseClient
+from .sse_parser import iter_sse_events
 
 
 class ClaudeClient(BaseClient):
     def __init__(
         self,
-        api_key: str,
+        api_key: Union[str, List[str]],
         api_url: str = "https://api.anthropic.com/v1/messages",
         provider: str = "anthropic",
         proxy: str = None,
@@ -19,7 +21,7 @@ class ClaudeClient(BaseClient):
         """初始化 Claude 客户端
 
         Args:
-            api_key: Claude API密钥
+            api_key: Claude API密钥，可以是多个密钥的列表
             api_url: Claude API地址
             provider: API提供商，支持 anthropic、openrouter、oneapi
             proxy: 代理服务器地址
@@ -27,6 +29,30 @@ class ClaudeClient(BaseClient):
         super().__init__(api_key, api_url, proxy=proxy)
         self.provider = provider
 
+    @staticmethod
+    def _anthropic_usage(usage: dict) -> dict:
+        """将 Anthropic 的 input_tokens/output_tokens 转换为 OpenAI 字段名"""
+        result = {}
+        if usage.get("input_tokens") is not None:
+            # 命中提示缓存的输入 token 单独报告，同样计入输入
+            result["prompt_tokens"] = (
+                usage["input_tokens"]
+                + (usage.get("cache_creation_input_tokens") or 0)
+                + (usage.get("cache_read_input_tokens") or 0)
+            )
+        if usage.get("output_tokens") is not None:
+            result["completion_tokens"] = usage["output_tokens"]
+        return result
+
+    @staticmethod
+    def _openai_usage(usage: dict) -> dict:
+        """提取 OpenAI 格式 usage 中的输入和输出 token 数"""
+        return {
+            key: usage[key]
+            for key in ("prompt_tokens", "completion_tokens")
+            if usage.get(key) is not None
+        }
+
     async def stream_chat(
         self,
         messages: list,
@@ -46,8 +72,9 @@ class ClaudeClient(BaseClient):
 
         Yields:
             tuple[str, str]: (内容类型, 内容)
-                内容类型: "answer"
-                内容: 实际的文本内容
+                内容类型: "answer" 或 "usage"
+                内容: 实际的文本内容；"usage" 时为上游报告的用量，
+                    可能只包含 prompt_tokens、completion_tokens 中的一部分
         """
         if self.provider == "openrouter":
             # 转换模型名称为 OpenRouter 格式
@@ -126,40 +153,40 @@ class ClaudeClient(BaseClient):
         logger.debug(f"开始对话：{data}")
 
         if stream:
-            async for chunk in self._make_request(headers, data):
-                chunk_str = chunk.decode("utf-8")
-                if not chunk_str.strip():
-                    continue
-
-                for line in chunk_str.split("\n"):
-                    if line.startswith("data: "):
-                        json_str = line[6:]  # 去掉 'data: ' 前缀
-                        if json_str.strip() == "[DONE]":
-                            return
-
-                        try:
-                            data = json.loads(json_str)
-                            if self.provider in ("openrouter", "oneapi"):
-                                # OpenRouter/OneApi 格式
-                                content = (
-                                    data.get("choices", [{}])[0]
-                                    .get("delta", {})
-                                    .get("content", "")
-                                )
+            async with aclosing(iter_sse_events(self._make_request(headers, data))) as events:
+                async for event in events:
+                    if event.data.strip() == "[DONE]":
+                        return
+
+                    try:
+                        data = json.loads(event.data)
+                        if self.provider in ("openrouter", "oneapi"):
+                            # OpenRouter/OneApi 格式
+                            choices = data.get("choices") or [{}]
+                            content = choices[0].get("delta", {}).get("content", "")
+                            if content:
+                                yield "answer", content
+                            if data.get("usage"):
+                                yield "usage", self._openai_usage(data["usage"])
+                        elif self.provider == "anthropic":
+                            # Anthropic 格式
+                            event_type = data.get("type")
+                            if event_type == "content_block_delta":
+                                content = data.get("delta", {}).get("text", "")
                                 if content:
                                     yield "answer", content
-                            elif self.provider == "anthropic":
-                                # Anthropic 格式
-                                if data.get("type") == "content_block_delta":
-                                    content = data.get("delta", {}).get("text", "")
-                                    if content:
-                                        yield "answer", content
-                            else:
-                                raise ValueError(
-                                    f"不支持的Claude Provider: {self.provider}"
-                                )
-                        except json.JSONDecodeError:
-                            continue
+                            elif event_type == "message_start":
+                                usage = data.get("message", {}).get("usage") or {}
+                                if "input_tokens" in usage:
+                                    yield "usage", self._anthropic_usage(usage)
+                            elif event_type == "message_delta" and data.get("usage"):
+                                yield "usage", self._anthropic_usage(data["usage"])
+                        else:
+                            raise ValueError(
+                                f"不支持的Claude Provider: {self.provider}"
+                            )
+                    except json.JSONDecodeError:
+                        continue
         else:
             # 非流式输出
             async for chunk in self._make_request(headers, data):
@@ -173,10 +200,14 @@ class ClaudeClient(BaseClient):
                         )
                         if content:
                             yield "answer", content
+                        if response.get("usage"):
+                            yield "usage", self._openai_usage(response["usage"])
                     elif self.provider == "anthropic":
                         content = response.get("content", [{}])[0].get("text", "")
                         if content:
                             yield "answer", content
+                        if response.get("usage"):
+                            yield "usage", self._anthropic_usage(response["usage"])
                     else:
                         raise ValueError(f"不支持的Claude Provider: {self.provider}")
                 except json.JSONDecodeError:
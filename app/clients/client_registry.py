@@ -0,0 +1,135 @@
+"""进程级上游客户端注册表
+
+按 (客户端类型, 上游地址, 密钥, 代理, 超时) 共享客户端实例，引用同一个上游的组合模型和
+故障转移、负载均衡池使用同一个客户端: 密钥轮换和限流暂停状态一致，连接来自同一个会话池。
+
+注册表只持有客户端的弱引用。配置变化后不再被任何模型实例引用的客户端，在使用它的请求
+全部结束后自动释放；客户端本身不持有连接，释放时不需要关闭。
+"""
+
+import weakref
+from typing import Any, Dict, Hashable, List, Optional, Tuple, Union
+
+import aiohttp
+
+from .base_client import BaseClient
+from .claude_client import ClaudeClient
+from .deepseek_client import DeepSeekClient
+from .openai_compatible_client import OpenAICompatibleClient
+from .session_pool import session_pool
+
+
+class ClientRegistry:
+    """按上游地址、密钥、代理和超时共享的客户端实例"""
+
+    def __init__(self):
+        """初始化客户端注册表"""
+        self._clients: "weakref.WeakValueDictionary[Tuple[Hashable, ...], BaseClient]" = (
+            weakref.WeakValueDictionary()
+        )
+
+    def _get(
+        self,
+        client_class: type,
+        api_key: Union[str, List[str]],
+        api_url: str,
+        proxy: Optional[str],
+        timeout: Optional[aiohttp.ClientTimeout],
+        options: Tuple[Hashable, ...],
+        **kwargs: Any,
+    ) -> BaseClient:
+        """返回参数相同的已有客户端，不存在时创建"""
+        keys = (api_key,) if isinstance(api_key, str) else tuple(api_key)
+        timeout = timeout or client_class.DEFAULT_TIMEOUT
+        registry_key = (client_class, api_url, keys, proxy, timeout, options)
+        client = self._clients.get(registry_key)
+        if client is None:
+            client = client_class(api_key, api_url, proxy=proxy, **kwargs)
+            client.timeout = timeout
+            self._clients[registry_key] = client
+        return client
+
+    def reasoner(
+        self,
+        api_key: Union[str, List[str]],
+        api_url: str,
+        proxy: Optional[str] = None,
+        system_config: Optional[dict] = None,
+        timeout: Optional[aiohttp.ClientTimeout] = None,
+    ) -> DeepSeekClient:
+        """获取推理模型客户端
+
+        Args:
+            api_key: API密钥，可以是多个密钥的列表
+            api_url: API地址
+            proxy: 代理服务器地址
+            system_config: 系统配置，包含 save_deepseek_tokens 等设置
+            timeout: 请求超时设置，None 则使用默认值
+
+        Returns:
+            DeepSeekClient: 共享的推理模型客户端
+        """
+        system_config = system_config or {}
+        # save_deepseek_tokens 会改变推理流的内容，设置不同时不能共享客户端
+        options = (
+            system_config.get("save_deepseek_tokens", False),
+            system_config.get("save_deepseek_tokens_max_tokens", 5),
+        )
+        return self._get(
+            DeepSeekClient, api_key, api_url, proxy, timeout, options, system_config=system_config
+        )
+
+    def target(
+        self,
+        api_key: Union[str, List[str]],
+        api_url: str,
+        model_format: str,
+        proxy: Optional[str] = None,
+        timeout: Optional[aiohttp.ClientTimeout] = None,
+        stream_usage: bool = True,
+    ) -> BaseClient:
+        """获取目标模型客户端
+
+        Args:
+            api_key: API密钥，可以是多个密钥的列表
+            api_url: API地址
+            model_format: 目标模型格式，anthropic 使用 ClaudeClient，其余使用 OpenAI 兼容客户端
+            proxy: 代理服务器地址
+            timeout: 请求超时设置，None 则使用默认值
+            stream_usage: OpenAI 兼容上游是否支持 stream_options.include_usage
+
+        Returns:
+            BaseClient: 共享的目标模型客户端
+        """
+        if model_format == "anthropic":
+            return self._get(ClaudeClient, api_key, api_url, proxy, timeout, (), provider="anthropic")
+        return self._get(
+            OpenAICompatibleClient,
+            api_key,
+            api_url,
+            proxy,
+            timeout,
+            (stream_usage,),
+            stream_usage=stream_usage,
+        )
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """返回每个客户端正在进行的请求数和所用连接池的连接数
+
+        同一个上游主机和代理的客户端共用一个连接池，connections 是整个连接池的统计。
+        """
+        result = []
+        for client in list(self._clients.values()):
+            result.append({
+                "type": type(client).__name__,
+                "api_url": client.api_url,
+                "proxy": client.proxy_url,
+                "keys": len(client.key_pool),
+                "in_flight": client.key_pool.in_flight,
+                "connections": session_pool.connection_stats(client.api_url, client.proxy_url),
+            })
+        return result
+
+
+# 创建全局 ClientRegistry 实例
+client_registry = ClientRegistry()
@@ -2,17 +2,19 @@
 
 import os
 import json
-from typing import AsyncGenerator
+from contextlib import aclosing
+from typing import AsyncGenerator, Dict, List, Tuple, Union
 
 from app.utils.logger import logger
 
 from .base_client import BaseClient
+from .sse_parser import iter_sse_events
 
 
 class DeepSeekClient(BaseClient):
     def __init__(
         self,
-        api_key: str,
+        api_key: Union[str, List[str]],
         api_url: str = "https://api.siliconflow.cn/v1/chat/completions",
         proxy: str = None,
         system_config: dict = None,
@@ -20,7 +22,7 @@ class DeepSeekClient(BaseClient):
         """初始化 DeepSeek 客户端
 
         Args:
-            api_key: DeepSeek API密钥
+            api_key: DeepSeek API密钥，可以是多个密钥的列表
             api_url: DeepSeek API地址
             proxy: 代理服务器地址
             system_config: 系统配置，包含 save_deepseek_tokens 等设置
@@ -56,7 +58,7 @@ class DeepSeekClient(BaseClient):
         messages: list,
         model: str = "deepseek-ai/DeepSeek-R1",
         is_origin_reasoning: bool = True,
-    ) -> AsyncGenerator[tuple[str, str], None]:
+    ) -> AsyncGenerator[Tuple[str, Union[str, Dict[str, int]]], None]:
         """流式对话
 
         Args:
@@ -64,9 +66,9 @@ class DeepSeekClient(BaseClient):
             model: 模型名称
 
         Yields:
-            tuple[str, str]: (内容类型, 内容)
-                内容类型: "reasoning" 或 "content"
-                内容: 实际的文本内容
+            Tuple[str, Union[str, Dict[str, int]]]: (内容类型, 内容)
+                内容类型: "reasoning"、"content" 或 "usage"
+                内容: 实际的文本内容；"usage" 时为上游报告的用量 {"reasoning_tokens": n}
         """
         headers = {
             "Authorization": f"Bearer {self.api_key}",
@@ -95,79 +97,83 @@ class DeepSeekClient(BaseClient):
         accumulated_content = ""
         is_collecting_think = False
 
-        async for chunk in self._make_request(headers, data):
-            chunk_str = chunk.decode("utf-8")
-
-            try:
-                lines = chunk_str.splitlines()
-                for line in lines:
-                    if line.startswith("data: "):
-                        json_str = line[len("data: ") :]
-                        if json_str == "[DONE]":
-                            return
-
-                        data = json.loads(json_str)
-                        if (
-                            data
-                            and data.get("choices")
-                            and data["choices"][0].get("delta")
-                        ):
-                            delta = data["choices"][0]["delta"]
-
-                            if is_origin_reasoning:
-                                # 处理 reasoning_content
-                                if delta.get("reasoning_content"):
-                                    content = delta["reasoning_content"]
-                                    logger.debug(f"提取推理内容：{content}")
-                                    yield "reasoning", content
-
-                                if delta.get("reasoning_content") is None and delta.get(
-                                    "content"
-                                ):
-                                    content = delta["content"]
-                                    logger.info(
-                                        f"提取内容信息，推理阶段结束: {content}"
-                                    )
-                                    yield "content", content
-                            else:
-                                # 处理其他模型的输出
-                                if delta.get("content"):
-                                    content = delta["content"]
-                                    if content == "":  # 只跳过完全空的字符串
-                                        continue
-                                    logger.debug(f"非原生推理内容：{content}")
-                                    accumulated_content += content
-
-                                    # 检查累积的内容是否包含完整的 think 标签对
-                                    is_complete, processed_content = (
-                                        self._process_think_tag_content(
-                                            accumulated_content
-                                        )
+        async with aclosing(iter_sse_events(self._make_request(headers, data))) as events:
+            async for event in events:
+                if event.data == "[DONE]":
+                    return
+
+                try:
+                    data = json.loads(event.data)
+                    # 部分服务商在每个 chunk 中都携带累计用量，推理阶段提前结束时也能拿到
+                    if data and data.get("usage"):
+                        usage = data["usage"]
+                        # completion_tokens 还包含推理模型的回答 token，上游未单独报告推理 token 时
+                        # 不输出用量，由调用方使用本地计数
+                        details = usage.get("completion_tokens_details") or {}
+                        reasoning_tokens = details.get("reasoning_tokens")
+                        if reasoning_tokens is not None:
+                            yield "usage", {"reasoning_tokens": reasoning_tokens}
+                    if (
+                        data
+                        and data.get("choices")
+                        and data["choices"][0].get("delta")
+                    ):
+                        delta = data["choices"][0]["delta"]
+
+                        if is_origin_reasoning:
+                            # 处理 reasoning_content
+                            if delta.get("reasoning_content"):
+                                content = delta["reasoning_content"]
+                                logger.debug(f"提取推理内容：{content}")
+                                yield "reasoning", content
+
+                            if delta.get("reasoning_content") is None and delta.get(
+                                "content"
+                            ):
+                                content = delta["content"]
+                                logger.info(
+                                    f"提取内容信息，推理阶段结束: {content}"
+                                )
+                                yield "content", content
+                        else:
+                            # 处理其他模型的输出
+                            if delta.get("content"):
+                                content = delta["content"]
+                                if content == "":  # 只跳过完全空的字符串
+                                    continue
+                                logger.debug(f"非原生推理内容：{content}")
+                                accumulated_content += content
+
+                                # 检查累积的内容是否包含完整的 think 标签对
+                                is_complete, processed_content = (
+                                    self._process_think_tag_content(
+                                        accumulated_content
                                     )
+                                )
 
-                                    if "<think>" in content and not is_collecting_think:
-                                        # 开始收集推理内容
-                                        logger.debug(f"开始收集推理内容：{content}")
-                                        is_collecting_think = True
+                                if "<think>" in content and not is_collecting_think:
+                                    # 开始收集推理内容
+                                    logger.debug(f"开始收集推理内容：{content}")
+                                    is_collecting_think = True
+                                    yield "reasoning", content
+                                elif is_collecting_think:
+                                    if "</think>" in content:
+                                        # 推理内容结束
+                                        logger.debug(f"推理内容结束：{content}")
+                                        is_collecting_think = False
                                         yield "reasoning", content
-                                    elif is_collecting_think:
-                                        if "</think>" in content:
-                                            # 推理内容结束
-                                            logger.debug(f"推理内容结束：{content}")
-                                            is_collecting_think = False
-                                            yield "reasoning", content
-                                            # 输出空的 content 来触发 Claude 处理
-                                            yield "content", ""
-                                            # 重置累积内容
-                                            accumulated_content = ""
-                                        else:
-                                            # 继续收集推理内容
-                                            yield "reasoning", content
+                                        # 输出空的 content 来触发 Claude 处理
+                                        yield "content", ""
+                                        # 重置累积内容
+                                        accumulated_content = ""
                                     else:
-                                        # 普通内容
-                                        yield "content", content
+                                        # 继续收集推理内容
+                                        yield "reasoning", content
+                                else:
+                                    # 普通内容
+                                    yield "content", content
 
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON 解析错误: {e}")
-            except Exception as e:
-                logger.error(f"处理 chunk 时发生错误: {e}")
+                except json.JSONDecodeError as e:
+                    logger.error(f"JSON 解析错误: {e}")
+                except Exception as e:
+                    logger.error(f"处理 chunk 时发生错误: {e}")
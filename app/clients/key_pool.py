@@ -0,0 +1,224 @@
+"""上游 API 密钥池
+
+一个推理模型或目标模型配置可以提供多个 api_key(列表)。每次请求选择进行中请求最少、
+剩余配额最多的密钥，并根据上游响应头跟踪每个密钥的限流状态:
+- OpenAI 风格: x-ratelimit-remaining-requests/tokens、x-ratelimit-reset-requests/tokens
+- Anthropic 风格: anthropic-ratelimit-requests/tokens-remaining、anthropic-ratelimit-requests/tokens-reset
+- retry-after
+
+被限流(429)或配额耗尽的密钥暂停使用，直到限流窗口重置。
+"""
+
+import hashlib
+import math
+import re
+import time
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from typing import Collection, List, Mapping, Optional, Union
+
+from app.utils.logger import logger
+from app.utils.metrics import UPSTREAM_KEY_PARKED, UPSTREAM_KEY_REMAINING
+
+# Go 风格的时长，如 "1s"、"6m0s"、"20ms"、"1h2m3.5s"
+_DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+
+# 各类配额对应的 (剩余量, 重置时间) 响应头
+_RATE_LIMIT_HEADERS = {
+    "requests": (
+        ("x-ratelimit-remaining-requests", "x-ratelimit-reset-requests"),
+        ("anthropic-ratelimit-requests-remaining", "anthropic-ratelimit-requests-reset"),
+    ),
+    "tokens": (
+        ("x-ratelimit-remaining-tokens", "x-ratelimit-reset-tokens"),
+        ("anthropic-ratelimit-tokens-remaining", "anthropic-ratelimit-tokens-reset"),
+        ("anthropic-ratelimit-input-tokens-remaining", "anthropic-ratelimit-input-tokens-reset"),
+        ("anthropic-ratelimit-output-tokens-remaining", "anthropic-ratelimit-output-tokens-reset"),
+    ),
+}
+
+
+def parse_reset_seconds(value: Optional[str], now: Optional[float] = None) -> Optional[float]:
+    """解析限流重置时间，返回距离现在的秒数
+
+    支持秒数、Unix 时间戳、Go 风格时长("6m0s")、RFC 3339 时间和 HTTP 日期。
+
+    Args:
+        value: 响应头的值
+        now: 当前 Unix 时间，None 则使用 time.time()
+
+    Returns:
+        Optional[float]: 距离重置的秒数，无法解析时为 None
+    """
+    if not value:
+        return None
+    value = value.strip()
+    now = time.time() if now is None else now
+    try:
+        seconds = float(value)
+        # 足够大的数值视为 Unix 时间戳
+        return max(seconds - now, 0.0) if seconds > 1e9 else max(seconds, 0.0)
+    except ValueError:
+        pass
+
+    parts = _DURATION_PATTERN.findall(value)
+    if parts and "".join(number + unit for number, unit in parts) == value:
+        return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+    for parse in (datetime.fromisoformat, parsedate_to_datetime):
+        try:
+            return max(parse(value).timestamp() - now, 0.0)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+class ApiKey:
+    """密钥池中的一个密钥及其限流状态
+
+    Args:
+        value: 密钥
+        label: 指标和日志中使用的标识，不包含密钥本身
+    """
+
+    def __init__(self, value: str, label: str):
+        self.value = value
+        self.label = label
+        # 密钥的稳定标识(截断的 sha256)，不随密钥在列表中的位置变化，用于按密钥共享状态
+        self.digest = hashlib.sha256(value.encode("utf-8")).hexdigest()[:16]
+        self.in_flight = 0
+        # 上游最近一次报告的剩余配额，未报告时为 None
+        self.remaining_requests: Optional[int] = None
+        self.remaining_tokens: Optional[int] = None
+        # 暂停使用直到该时间(time.monotonic)
+        self.parked_until = 0.0
+
+    def available(self, now: float) -> bool:
+        """是否可以使用"""
+        return now >= self.parked_until
+
+
+class KeyPool:
+    """同一个上游的多个 API 密钥
+
+    Args:
+        api_key: 单个密钥或密钥列表
+        upstream: 上游主机名，用于指标和日志
+    """
+
+    # 收到 429 但上游未提供重置时间时的暂停时长(秒)
+    DEFAULT_PARK_SECONDS = 30.0
+    # 暂停时长上限(秒)，防止异常的响应头让密钥长时间不可用
+    MAX_PARK_SECONDS = 600.0
+
+    def __init__(self, api_key: Union[str, List[str]], upstream: str):
+        values = [api_key] if isinstance(api_key, str) else list(api_key)
+        if not values:
+            raise ValueError("api_key 不能为空")
+        self.upstream = upstream
+        self.keys = [ApiKey(value, f"key{index}") for index, value in enumerate(values)]
+        self._cursor = 0
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def in_flight(self) -> int:
+        """所有密钥正在进行的请求数"""
+        return sum(key.in_flight for key in self.keys)
+
+    def has_available(self, exclude: Collection[str] = ()) -> bool:
+        """是否还有未暂停的密钥
+
+        Args:
+            exclude: 不考虑的密钥标识，如本次请求已经尝试过的密钥
+        """
+        now = time.monotonic()
+        return any(key.available(now) for key in self.keys if key.label not in exclude)
+
+    def acquire(self, exclude: Collection[str] = ()) -> ApiKey:
+        """选择一个密钥，调用方在请求结束后必须调用 release
+
+        Args:
+            exclude: 不参与选择的密钥标识，全部被排除时忽略该参数
+
+        Returns:
+            ApiKey: 进行中请求最少、剩余请求配额最多的可用密钥；全部暂停时返回最早恢复的密钥
+        """
+        if len(self.keys) == 1:
+            key = self.keys[0]
+        else:
+            now = time.monotonic()
+            # 从轮转位置开始比较，条件相同时依次使用各个密钥
+            rotated = self.keys[self._cursor:] + self.keys[:self._cursor]
+            self._cursor = (self._cursor + 1) % len(self.keys)
+            candidates = [key for key in rotated if key.label not in exclude] or rotated
+            available = [key for key in candidates if key.available(now)]
+            if available:
+                key = min(
+                    available,
+                    key=lambda key: (
+                        key.in_flight,
+                        -(math.inf if key.remaining_requests is None else key.remaining_requests),
+                    ),
+                )
+            else:
+                key = min(candidates, key=lambda key: key.parked_until)
+                logger.warning(f"上游 {self.upstream} 的所有密钥都已被限流，使用最早恢复的 {key.label}")
+        key.in_flight += 1
+        return key
+
+    def release(self, key: ApiKey) -> None:
+        """请求结束"""
+        key.in_flight -= 1
+
+    def update(self, key: ApiKey, status: int, headers: Mapping[str, str]) -> None:
+        """根据响应状态码和响应头更新密钥的限流状态
+
+        Args:
+            key: 本次请求使用的密钥
+            status: HTTP 状态码
+            headers: 响应头(大小写不敏感)
+        """
+        now = time.time()
+        resets = {}
+        for kind, header_pairs in _RATE_LIMIT_HEADERS.items():
+            remaining = None
+            for remaining_header, reset_header in header_pairs:
+                value = headers.get(remaining_header)
+                if value is None:
+                    continue
+                try:
+                    value = int(float(value))
+                except ValueError:
+                    continue
+                if remaining is None or value < remaining:
+                    remaining = value
+                    resets[kind] = parse_reset_seconds(headers.get(reset_header), now)
+            if remaining is not None:
+                setattr(key, f"remaining_{kind}", remaining)
+                UPSTREAM_KEY_REMAINING.set(remaining, upstream=self.upstream, key=key.label, kind=kind)
+
+        if status == 429:
+            # retry-after 最准确，其次是耗尽的配额的重置时间
+            park = parse_reset_seconds(headers.get("retry-after"), now)
+            if park is None:
+                park = max((seconds for seconds in resets.values() if seconds is not None), default=None)
+            self._park(key, park if park is not None else self.DEFAULT_PARK_SECONDS, "429")
+            return
+
+        for kind in ("requests", "tokens"):
+            if getattr(key, f"remaining_{kind}") == 0 and resets.get(kind) is not None:
+                self._park(key, resets[kind], kind)
+                return
+
+    def _park(self, key: ApiKey, seconds: float, reason: str) -> None:
+        """暂停使用密钥"""
+        seconds = min(seconds, self.MAX_PARK_SECONDS)
+        # 窗口重置后剩余配额未知，等待下一次响应更新
+        key.remaining_requests = None
+        key.remaining_tokens = None
+        key.parked_until = max(key.parked_until, time.monotonic() + seconds)
+        UPSTREAM_KEY_PARKED.inc(upstream=self.upstream, key=key.label, reason=reason)
+        logger.warning(f"上游 {self.upstream} 的 {key.label} 被限流({reason})，暂停使用 {seconds:.1f} 秒")
@@ -1,19 +1,23 @@
 """OpenAI 兼容格式的客户端类,用于处理符合 OpenAI API 格式的服务"""
 
 import json
-from typing import AsyncGenerator, Optional, Union, Dict, Any, List
+from contextlib import aclosing
+from typing import AsyncGenerator, Optional, Tuple, Union, Dict, Any, List
 
 import aiohttp
 from aiohttp.client_exceptions import ClientError
 
 from app.clients.base_client import BaseClient
+from app.clients.sse_parser import iter_sse_events
 from app.utils.logger import logger
 
 
 class OpenAICompatibleClient(BaseClient):
     """OpenAI 兼容格式的客户端类
     
-    用于处理符合 OpenAI API 格式的服务,如 Gemini 等
+    用于处理符合 OpenAI API 格式的服务,如 Gemini 等。
+    需要用量时请求 stream_options.include_usage；上游不接受该参数时，在目标模型配置中设置
+    "stream_usage": false，用量改为全部使用本地计数。
     """
 
     # # 模型特定配置
@@ -28,20 +32,23 @@ class OpenAICompatibleClient(BaseClient):
 
     def __init__(
         self,
-        api_key: str,
+        api_key: Union[str, List[str]],
         api_url: str,
         timeout: Optional[aiohttp.ClientTimeout] = None,
         proxy: str = None,
+        stream_usage: bool = True,
     ):
         """初始化 OpenAI 兼容客户端
 
         Args:
-            api_key: API密钥
+            api_key: API密钥，可以是多个密钥的列表
             api_url: API地址
             timeout: 请求超时设置,None则使用默认值
             proxy: 代理服务器地址
+            stream_usage: 上游是否支持 stream_options.include_usage，不支持时只使用本地计数
         """
         super().__init__(api_key, api_url, timeout, proxy=proxy)
+        self.stream_usage = stream_usage
 
     def _get_headers(self) -> Dict[str, str]:
         """获取请求头
@@ -104,19 +111,21 @@ class OpenAICompatibleClient(BaseClient):
         except Exception as e:
             error_msg = f"Chat请求失败: {str(e)}"
             logger.error(error_msg)
-            raise ClientError(error_msg)
+            raise ClientError(error_msg) from e
 
     async def stream_chat(
-        self, messages: List[Dict[str, str]], model: str
-    ) -> AsyncGenerator[tuple[str, str], None]:
+        self, messages: List[Dict[str, str]], model: str, include_usage: bool = False
+    ) -> AsyncGenerator[Tuple[str, Union[str, Dict[str, Any]]], None]:
         """流式对话
 
         Args:
             messages: 消息列表
             model: 模型名称
+            include_usage: 是否需要上游报告用量，上游配置为不支持 stream_usage 时忽略
 
         Yields:
-            tuple[str, str]: (role, content) 消息元组
+            Tuple[str, Union[str, Dict[str, Any]]]: (role, content) 消息元组；
+                结束时输出 ("assistant", {"finish_reason": "stop"})，上游报告用量时输出 ("usage", {...})
 
         Raises:
             ClientError: 请求错误
@@ -129,59 +138,65 @@ class OpenAICompatibleClient(BaseClient):
             "messages": processed_messages,
             "stream": True,
         }
+        if include_usage and self.stream_usage:
+            # 要求上游在结束 chunk 之后额外发送一个携带用量的 chunk，严格校验参数的上游可以关闭
+            data["stream_options"] = {"include_usage": True}
 
         # # 使用模型配置
         # if model in self.MODEL_CONFIGS:
         #     data.update(self.MODEL_CONFIGS[model])
 
-        buffer = ""
         try:
-            async for chunk in self._make_request(headers, data):
-                buffer += chunk.decode("utf-8")
-                
-                # 处理 buffer 中的数据行
-                while "\n" in buffer:
-                    line, buffer = buffer.split("\n", 1)
-                    line = line.strip()
-                    
-                    # 跳过空行和 data: [DONE] 行
-                    if not line or line == "data: [DONE]":
+            async with aclosing(iter_sse_events(self._make_request(headers, data))) as events:
+                async for event in events:
+                    # 用量 chunk 在结束 chunk 之后发送，读到 data: [DONE] 才结束
+                    json_str = event.data.strip()
+                    if not json_str:
                         continue
-                    
+                    if json_str == "[DONE]":
+                        return
+
                     # 解析 SSE 数据
-                    if line.startswith("data: "):
-                        json_str = line[6:].strip()
-                        try:
-                            response = json.loads(json_str)
-                            logger.debug(f"收到响应数据: {json.dumps(response, ensure_ascii=False)}")
-                            
-                            if (
-                                "choices" in response
-                                and len(response["choices"]) > 0
-                            ):
-                                choice = response["choices"][0]
-                                
-                                # 先处理可能的内容，再检查结束标记
-                                if "delta" in choice and "content" in choice["delta"]:
-                                    content = choice["delta"]["content"]
-                                    if content:  # 只输出非空内容
-                                        logger.debug(f"收到内容: {content}")
-                                        yield "assistant", content
-                                
-                                # 检查是否是结束标记
-                                if "finish_reason" in choice and choice["finish_reason"] == "stop":
-                                    logger.debug("检测到结束标记: finish_reason=stop")
-                                    yield "assistant", {"finish_reason": "stop"}
-                                    return
-                                
-                                # 记录其他类型的响应
-                                if "delta" not in choice or "content" not in choice["delta"]:
-                                    logger.debug(f"收到不包含内容的响应: {json.dumps(choice, ensure_ascii=False)}")
-                        except json.JSONDecodeError as e:
-                            logger.error(f"JSON解析错误: {str(e)}, 原始数据: {json_str}")
-                            continue
+                    try:
+                        response = json.loads(json_str)
+                        logger.debug(f"收到响应数据: {json_str}")
+
+                        # 用量在 include_usage 的最后一个 chunk 中，部分服务商直接放在结束 chunk 中
+                        if response.get("usage"):
+                            usage = response["usage"]
+                            yield "usage", {
+                                key: usage[key]
+                                for key in ("prompt_tokens", "completion_tokens")
+                                if usage.get(key) is not None
+                            }
+
+                        if (
+                            "choices" in response
+                            and len(response["choices"]) > 0
+                        ):
+                            choice = response["choices"][0]
+
+                            # 先处理可能的内容，再检查结束标记
+                            if "delta" in choice and "content" in choice["delta"]:
+                                content = choice["delta"]["content"]
+                                if content:  # 只输出非空内容
+                                    logger.debug(f"收到内容: {content}")
+                                    yield "assistant", content
+
+                            # 检查是否是结束标记
+                            if "finish_reason" in choice and choice["finish_reason"] == "stop":
+                                logger.debug("检测到结束标记: finish_reason=stop")
+                                yield "assistant", {"finish_reason": "stop"}
+                                continue
+
+                            # 记录其他类型的响应
+                            if "delta" not in choice or "content" not in choice["delta"]:
+                                logger.debug(f"收到不包含内容的响应: {json.dumps(choice, ensure_ascii=False)}")
+                    except json.JSONDecodeError as e:
+                        logger.error(f"JSON解析错误: {str(e)}, 原始数据: {json_str}")
+                        continue
 
         except Exception as e:
             error_msg = f"Stream chat请求失败: {str(e)}"
             logger.error(error_msg)
-            raise ClientError(error_msg)
+            raise ClientError(error_msg) from e
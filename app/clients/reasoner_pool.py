@@ -0,0 +1,392 @@
+"""推理模型故障转移池
+
+组合模型的 reasoner_models 可以配置多个等价的推理模型:
+- 有序列表 ["deepseek-official", "ppio-r1"]: 按顺序尝试
+- 权重字典 {"deepseek-official": 3, "volcengine-r1": 1}: 每个请求按权重随机排序后依次尝试
+
+在输出第一条推理内容之前，遇到连接错误、429/5xx 或首 token 超时时转移到下一个推理模型；
+一旦开始输出推理内容，后续的错误不再转移，直接交给调用方处理。
+
+开启对冲(reasoner_hedge)后，当前推理模型超过对冲延迟仍未输出首个 token 时，
+同时向下一个推理模型发送相同的请求，先输出 token 的一方胜出，另一方被取消并释放连接。
+对冲延迟取近期首 token 耗时的分位数，对冲请求的比例受 max_rate 限制。
+"""
+
+import asyncio
+import random
+import time
+from collections import deque
+from typing import AsyncGenerator, List, Optional
+
+from app.utils.logger import logger
+from app.utils.metrics import (
+    REASONER_EXHAUSTED,
+    REASONER_FAILOVERS,
+    REASONER_HEDGES,
+    REASONER_SELECTED,
+)
+
+from .base_client import upstream_failure_reason
+from .deepseek_client import DeepSeekClient
+
+# 表示推理模型已经开始输出的事件类型
+_TOKEN_TYPES = ("reasoning", "content")
+
+
+class FirstTokenTimeout(asyncio.TimeoutError):
+    """推理模型在限定时间内没有输出首个推理 token"""
+
+
+class ReasonerEndpoint:
+    """故障转移池中的一个推理模型
+
+    Args:
+        name: 推理模型配置名称，用于日志和指标
+        client: 推理模型客户端
+        model: 请求上游时使用的模型 ID
+        is_origin_reasoning: 是否使用原生推理字段
+        weight: 权重，只在按权重选择时使用
+    """
+
+    def __init__(
+        self,
+        name: str,
+        client: DeepSeekClient,
+        model: str,
+        is_origin_reasoning: bool = True,
+        weight: float = 1.0,
+    ):
+        self.name = name
+        self.client = client
+        self.model = model
+        self.is_origin_reasoning = is_origin_reasoning
+        self.weight = weight
+
+
+class HedgePolicy:
+    """推理请求对冲策略
+
+    对冲延迟取最近 window 个首 token 耗时的 percentile 分位数，不低于 min_delay；
+    样本不足 MIN_SAMPLES 时使用 min_delay。
+    对冲比例用令牌桶限制: 每个请求存入 max_rate 个令牌，每次对冲消耗一个，最多积累 BURST 个。
+
+    Args:
+        percentile: 对冲延迟使用的分位数
+        min_delay: 最小对冲延迟(秒)
+        max_rate: 对冲请求占请求总数的最大比例
+        window: 保留的首 token 耗时样本数
+    """
+
+    MIN_SAMPLES = 20
+    BURST = 10.0
+
+    def __init__(
+        self,
+        percentile: float = 0.95,
+        min_delay: float = 1.0,
+        max_rate: float = 0.1,
+        window: int = 256,
+    ):
+        self.percentile = min(max(percentile, 0.0), 1.0)
+        self.min_delay = max(min_delay, 0.0)
+        self.max_rate = max(max_rate, 0.0)
+        self._samples = deque(maxlen=window)
+        # 初始允许一次对冲
+        self._tokens = min(1.0, self.BURST)
+
+    @classmethod
+    def from_config(cls, config: Optional[dict]) -> Optional["HedgePolicy"]:
+        """根据 reasoner_hedge 配置创建策略，未开启时返回 None"""
+        if not config or not config.get("enabled", False):
+            return None
+        return cls(
+            percentile=config.get("percentile", 0.95),
+            min_delay=config.get("min_delay", 1.0),
+            max_rate=config.get("max_rate", 0.1),
+            window=config.get("window", 256),
+        )
+
+    def observe(self, seconds: float) -> None:
+        """记录一次首 token 耗时"""
+        self._samples.append(seconds)
+
+    def delay(self) -> float:
+        """当前的对冲延迟(秒)"""
+        if len(self._samples) < self.MIN_SAMPLES:
+            return self.min_delay
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(self.percentile * len(ordered)))
+        return max(ordered[index], self.min_delay)
+
+    def on_request(self) -> None:
+        """每个请求存入 max_rate 个令牌"""
+        self._tokens = min(self._tokens + self.max_rate, self.BURST)
+
+    def try_acquire(self) -> bool:
+        """尝试获取一次对冲的额度"""
+        if self._tokens < 1.0:
+            return False
+        self._tokens -= 1.0
+        return True
+
+
+class _Attempt:
+    """对一个推理模型的一次请求，在后台任务中等待首个推理 token
+
+    每次请求收到首个 token 时都记录首 token 耗时，无论最终是否胜出；只记录胜出方会让样本偏快，
+    对冲延迟随之下降。主请求在收到首 token 前被取消时，记录到取消时的耗时作为首 token 耗时的下界。
+
+    Args:
+        pool: 所属的推理模型池
+        endpoint: 请求的推理模型
+        messages: 消息列表
+        primary: 是否是请求的第一个推理模型
+    """
+
+    def __init__(
+        self, pool: "ReasonerPool", endpoint: ReasonerEndpoint, messages: list, primary: bool = False
+    ):
+        self.endpoint = endpoint
+        self.stream = endpoint.client.stream_chat(messages, endpoint.model, endpoint.is_origin_reasoning)
+        self.pending: list = []
+        self.started_at = time.perf_counter()
+        self.hedge = pool.hedge
+        self.primary = primary
+        self.task = asyncio.create_task(pool._wait_first_token(self.stream, self.pending))
+        self.task.add_done_callback(self._observe)
+
+    def _observe(self, task: asyncio.Task) -> None:
+        """记录首 token 耗时，失败的请求不记录"""
+        if task.cancelled():
+            if self.primary:
+                self.hedge.observe(time.perf_counter() - self.started_at)
+        elif task.exception() is None:
+            self.hedge.observe(time.perf_counter() - self.started_at)
+
+    async def close(self) -> None:
+        """取消等待并关闭上游流，释放连接"""
+        if not self.task.done():
+            self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        await self.stream.aclose()
+
+
+class ReasonerPool:
+    """多个等价推理模型组成的故障转移池
+
+    接口与 DeepSeekClient.stream_chat 相同，可以直接替换组合模型中的推理客户端。
+
+    Args:
+        endpoints: 推理模型列表，按配置顺序排列
+        weighted: 是否按权重随机排序，False 时按列表顺序尝试
+        first_token_timeout: 等待首个推理 token 的最长时间(秒)，None 表示不限制
+        hedge: 对冲策略，None 表示不对冲
+    """
+
+    def __init__(
+        self,
+        endpoints: List[ReasonerEndpoint],
+        weighted: bool = False,
+        first_token_timeout: Optional[float] = None,
+        hedge: Optional[HedgePolicy] = None,
+    ):
+        if not endpoints:
+            raise ValueError("推理模型故障转移池不能为空")
+        self.endpoints = endpoints
+        self.weighted = weighted
+        self.first_token_timeout = first_token_timeout if first_token_timeout and first_token_timeout > 0 else None
+        self.hedge = hedge
+
+    @property
+    def system_config(self) -> dict:
+        """系统配置，所有推理模型共用，推理缓存据此计算缓存键"""
+        return self.endpoints[0].client.system_config
+
+    def candidates(self) -> List[ReasonerEndpoint]:
+        """本次请求依次尝试的推理模型"""
+        if not self.weighted:
+            return list(self.endpoints)
+        # 加权随机排序: 按 random() ** (1 / weight) 降序，权重越大越可能排在前面，
+        # 权重为 0 的推理模型只作为最后的备用
+        weighted = [endpoint for endpoint in self.endpoints if endpoint.weight > 0]
+        weighted.sort(key=lambda endpoint: random.random() ** (1.0 / endpoint.weight), reverse=True)
+        return weighted + [endpoint for endpoint in self.endpoints if endpoint.weight <= 0]
+
+    @staticmethod
+    def failover_reason(error: BaseException) -> Optional[str]:
+        """判断错误是否应当转移到下一个推理模型
+
+        Returns:
+            Optional[str]: 转移原因，None 表示不应转移
+        """
+        if isinstance(error, FirstTokenTimeout):
+            return "first_token_timeout"
+        return upstream_failure_reason(error)
+
+    async def _wait_first_token(self, stream: AsyncGenerator, pending: list) -> None:
+        """读取推理流直到首个推理 token，期间的事件放入 pending
+
+        Raises:
+            FirstTokenTimeout: 超过 first_token_timeout 仍未收到推理 token
+        """
+        try:
+            async with asyncio.timeout(self.first_token_timeout) as timeout:
+                async for item in stream:
+                    pending.append(item)
+                    if item[0] in _TOKEN_TYPES:
+                        return
+        except TimeoutError:
+            # 上游自身的超时同样是 TimeoutError，只转换首 token 超时
+            if timeout.expired():
+                raise FirstTokenTimeout(
+                    f"{self.first_token_timeout:g} 秒内未收到首个推理 token"
+                ) from None
+            raise
+
+    async def stream_chat(
+        self,
+        messages: list,
+        model: Optional[str] = None,
+        is_origin_reasoning: bool = True,
+    ) -> AsyncGenerator[tuple[str, str], None]:
+        """流式推理，首个推理 token 之前失败时转移到下一个推理模型
+
+        Args:
+            messages: 消息列表
+            model: 未使用，每个推理模型使用自己配置的模型 ID
+            is_origin_reasoning: 未使用，每个推理模型使用自己的配置
+
+        Yields:
+            tuple[str, str]: (内容类型, 内容)，与 DeepSeekClient.stream_chat 相同
+
+        Raises:
+            Exception: 所有推理模型都失败时抛出最后一个错误，或遇到不可转移的错误
+        """
+        candidates = self.candidates()
+        if self.hedge is not None and len(candidates) > 1:
+            async for item in self._hedged_stream_chat(messages, candidates):
+                yield item
+            return
+
+        for index, endpoint in enumerate(candidates):
+            stream = endpoint.client.stream_chat(messages, endpoint.model, endpoint.is_origin_reasoning)
+            # 首个 token 之前收到的事件(如用量)，选定推理模型后再输出
+            pending = []
+            try:
+                await self._wait_first_token(stream, pending)
+            except Exception as e:
+                await stream.aclose()
+                reason = self._record_failure(endpoint, e)
+                if index == len(candidates) - 1:
+                    self._record_exhausted(endpoint, e)
+                    raise
+                logger.warning(
+                    f"推理模型 {endpoint.name} 失败({reason})，转移到 {candidates[index + 1].name}: {e}"
+                )
+                continue
+            except BaseException:
+                # 等待首 token 时请求被取消(如下游断开)，立即关闭上游流，不等垃圾回收释放连接
+                await stream.aclose()
+                raise
+
+            REASONER_SELECTED.inc(reasoner=endpoint.name)
+            try:
+                for item in pending:
+                    yield item
+                async for item in stream:
+                    yield item
+            finally:
+                await stream.aclose()
+            return
+
+    def _record_failure(self, endpoint: ReasonerEndpoint, error: Exception) -> str:
+        """记录推理模型在首个 token 之前的失败
+
+        Returns:
+            str: 转移原因
+
+        Raises:
+            Exception: 错误不应转移时重新抛出
+        """
+        reason = self.failover_reason(error)
+        if reason is None:
+            raise error
+        REASONER_FAILOVERS.inc(reasoner=endpoint.name, reason=reason)
+        return reason
+
+    @staticmethod
+    def _record_exhausted(endpoint: ReasonerEndpoint, error: Exception) -> None:
+        """记录所有推理模型都失败"""
+        REASONER_EXHAUSTED.inc()
+        logger.error(f"所有推理模型都不可用，最后一个推理模型 {endpoint.name} 失败: {error}")
+
+    async def _hedged_stream_chat(
+        self, messages: list, candidates: List[ReasonerEndpoint]
+    ) -> AsyncGenerator[tuple[str, str], None]:
+        """带对冲的流式推理
+
+        当前推理模型超过对冲延迟仍未输出首个 token 且对冲额度充足时，向下一个推理模型发送相同请求，
+        先输出 token 的一方胜出。每个请求最多对冲一次；进行中的请求全部失败后按故障转移规则继续。
+        """
+        self.hedge.on_request()
+        # 已经发起请求的最后一个推理模型在 candidates 中的位置
+        index = 0
+        running: List[_Attempt] = [_Attempt(self, candidates[0], messages, primary=True)]
+        hedged = False
+        hedge_attempt: Optional[_Attempt] = None
+        winner: Optional[_Attempt] = None
+        try:
+            while winner is None:
+                can_hedge = not hedged and index + 1 < len(candidates)
+                done, _ = await asyncio.wait(
+                    [attempt.task for attempt in running],
+                    timeout=self.hedge.delay() if can_hedge else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    hedged = True
+                    backup = candidates[index + 1]
+                    if not self.hedge.try_acquire():
+                        REASONER_HEDGES.inc(reasoner=backup.name, result="rate_limited")
+                        continue
+                    index += 1
+                    REASONER_HEDGES.inc(reasoner=backup.name, result="sent")
+                    logger.info(f"推理模型首 token 超过对冲延迟，对冲请求 {backup.name}")
+                    hedge_attempt = _Attempt(self, backup, messages)
+                    running.append(hedge_attempt)
+                    continue
+
+                for attempt in [attempt for attempt in running if attempt.task in done]:
+                    running.remove(attempt)
+                    error = attempt.task.exception()
+                    if error is None:
+                        winner = attempt
+                        break
+                    await attempt.stream.aclose()
+                    reason = self._record_failure(attempt.endpoint, error)
+                    if running:
+                        logger.warning(f"推理模型 {attempt.endpoint.name} 失败({reason})，等待其他推理模型")
+                    elif index == len(candidates) - 1:
+                        self._record_exhausted(attempt.endpoint, error)
+                        raise error
+                    else:
+                        index += 1
+                        logger.warning(
+                            f"推理模型 {attempt.endpoint.name} 失败({reason})，转移到 {candidates[index].name}: {error}"
+                        )
+                        running.append(_Attempt(self, candidates[index], messages))
+        finally:
+            # 落败或仍在等待的请求全部取消，释放连接
+            for attempt in running:
+                await attempt.close()
+
+        if winner is hedge_attempt:
+            REASONER_HEDGES.inc(reasoner=winner.endpoint.name, result="won")
+        REASONER_SELECTED.inc(reasoner=winner.endpoint.name)
+        try:
+            for item in winner.pending:
+                yield item
+            async for item in winner.stream:
+                yield item
+        finally:
+            await winner.stream.aclose()
@@ -0,0 +1,139 @@
+"""进程级 aiohttp 会话池，按上游主机和代理复用长连接"""
+
+from typing import Dict, Optional, Tuple
+
+import aiohttp
+from yarl import URL
+
+from app.utils.logger import logger
+
+
+class SessionPool:
+    """按 (上游主机, 代理) 维护共享的 ClientSession
+
+    每个 ClientSession 持有独立的 TCPConnector 和 keep-alive 连接池，
+    避免每次请求都重新进行 DNS 解析、TCP 握手和 TLS 握手。
+    """
+
+    # 默认连接池设置，可通过 model_configs.json 中 system.connection_pool 覆盖
+    # limit: 单个会话的最大连接数，0 表示不限制
+    # limit_per_host: 单个主机的最大连接数，0 表示不限制
+    # keepalive_timeout: 空闲连接保活时间(秒)
+    # dns_cache_ttl: DNS 缓存时间(秒)
+    # 流式请求会长时间占用连接，连接数上限过低会让排队请求等到连接超时
+    DEFAULT_SETTINGS = {
+        "limit": 1000,
+        "limit_per_host": 0,
+        "keepalive_timeout": 60,
+        "dns_cache_ttl": 300,
+    }
+
+    def __init__(self):
+        """初始化会话池"""
+        self._sessions: Dict[Tuple[str, Optional[str]], aiohttp.ClientSession] = {}
+        self.settings = dict(self.DEFAULT_SETTINGS)
+
+    def configure(self, system_config: Optional[dict] = None) -> None:
+        """根据系统配置更新连接池设置
+
+        新设置只对之后新建的会话生效，已存在的会话保持原有连接池，
+        避免打断正在进行的流式请求。
+
+        Args:
+            system_config: 系统配置，读取其中的 connection_pool 字段
+        """
+        pool_config = (system_config or {}).get("connection_pool", {}) or {}
+        settings = dict(self.DEFAULT_SETTINGS)
+        for key in self.DEFAULT_SETTINGS:
+            if pool_config.get(key) is not None:
+                settings[key] = pool_config[key]
+        self.settings = settings
+        logger.debug(f"连接池设置: {self.settings}")
+
+    @staticmethod
+    def _origin(url: str) -> str:
+        """提取 URL 的 scheme://host:port 部分作为连接池键"""
+        parsed = URL(url)
+        return f"{parsed.scheme}://{parsed.host}:{parsed.port}"
+
+    def get_session(self, url: str, proxy: Optional[str] = None) -> aiohttp.ClientSession:
+        """获取指定上游和代理对应的共享会话，不存在时创建
+
+        Args:
+            url: 请求地址
+            proxy: 代理地址，不同代理使用独立的连接池
+
+        Returns:
+            aiohttp.ClientSession: 共享会话
+        """
+        key = (self._origin(url), proxy)
+        session = self._sessions.get(key)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.settings["limit"],
+                limit_per_host=self.settings["limit_per_host"],
+                keepalive_timeout=self.settings["keepalive_timeout"],
+                ttl_dns_cache=self.settings["dns_cache_ttl"],
+            )
+            session = aiohttp.ClientSession(connector=connector)
+            self._sessions[key] = session
+            logger.info(f"创建上游连接池: {key[0]}, 代理: {proxy or '无'}")
+        return session
+
+    @staticmethod
+    def _connector_stats(session: aiohttp.ClientSession) -> Optional[Dict[str, Optional[int]]]:
+        """返回会话的使用中和空闲连接数，会话已关闭时返回 None
+
+        连接数来自 aiohttp 连接器的私有属性，aiohttp 版本不提供这些属性时对应的值为 None。
+        """
+        connector = session.connector
+        if connector is None or session.closed:
+            return None
+        acquired = getattr(connector, "_acquired", None)
+        conns = getattr(connector, "_conns", None)
+        return {
+            "acquired": len(acquired) if acquired is not None else None,
+            "idle": sum(len(items) for items in conns.values()) if conns is not None else None,
+        }
+
+    def connection_stats(self, url: str, proxy: Optional[str] = None) -> Dict[str, Optional[int]]:
+        """返回指定上游和代理对应连接池的连接数，尚未创建时均为 0
+
+        Args:
+            url: 请求地址
+            proxy: 代理地址
+
+        Returns:
+            Dict[str, Optional[int]]: {"acquired": 使用中连接数, "idle": 空闲连接数}
+        """
+        session = self._sessions.get((self._origin(url), proxy))
+        stats = self._connector_stats(session) if session is not None else None
+        return stats or {"acquired": 0, "idle": 0}
+
+    def stats(self) -> Dict[str, Dict[str, Optional[int]]]:
+        """返回各连接池的连接数统计
+
+        Returns:
+            Dict[str, Dict[str, Optional[int]]]: {上游(代理): {"acquired": 使用中连接数, "idle": 空闲连接数}}
+        """
+        result = {}
+        for (origin, proxy), session in self._sessions.items():
+            stats = self._connector_stats(session)
+            if stats is None:
+                continue
+            name = f"{origin} (proxy={proxy})" if proxy else origin
+            result[name] = stats
+        return result
+
+    async def close(self) -> None:
+        """关闭所有会话，在应用退出时调用"""
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        for session in sessions:
+            if not session.closed:
+                await session.close()
+        logger.info(f"已关闭 {len(sessions)} 个上游连接池")
+
+
+# 创建全局 SessionPool 实例
+session_pool = SessionPool()
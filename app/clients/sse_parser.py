@@ -0,0 +1,160 @@
+"""增量式 SSE 解码器，所有客户端共享
+
+按字节流增量解析 Server-Sent Events，支持跨 TCP 分块的事件、多行 data 字段、
+event/id 字段和注释行。每个字节只会被扫描一次，解析成本与输入长度成线性关系。
+"""
+
+import re
+from typing import AsyncGenerator, AsyncIterable, List, NamedTuple, Optional
+
+# 行结束符: CRLF、LF 或单独的 CR
+_LINE_END = re.compile(rb"\r\n|\r|\n")
+
+
+class SSEEvent(NamedTuple):
+    """一个完整的 SSE 事件"""
+
+    event: str
+    data: str
+    id: Optional[str] = None
+
+
+class SSEDecoder:
+    """增量式 SSE 解码器
+
+    用法:
+        decoder = SSEDecoder()
+        for chunk in chunks:
+            for event in decoder.feed(chunk):
+                ...
+        for event in decoder.flush():
+            ...
+    """
+
+    def __init__(self):
+        """初始化解码器状态"""
+        self._buffer = bytearray()
+        # 下一次查找行结束符的起点，已扫描过的字节不会重复扫描
+        self._scan = 0
+        self._data: List[str] = []
+        self._event = ""
+        self._last_id: Optional[str] = None
+
+    def feed(self, chunk: bytes) -> List[SSEEvent]:
+        """输入一段字节数据，返回其中已完整的事件
+
+        Args:
+            chunk: 原始字节数据，可以在任意位置被截断
+
+        Returns:
+            List[SSEEvent]: 本次解析出的完整事件
+        """
+        buffer = self._buffer
+        buffer += chunk
+        events = []
+        start = 0
+        scan = self._scan
+        search = _LINE_END.search
+
+        while True:
+            match = search(buffer, scan)
+            if match is None:
+                break
+            # 末尾单独的 CR 可能是被截断的 CRLF，等待后续数据再判断
+            if match.end() == len(buffer) and match.group() == b"\r":
+                break
+            event = self._process_line(buffer[start:match.start()])
+            start = scan = match.end()
+            if event is not None:
+                events.append(event)
+
+        if start:
+            del buffer[:start]
+        # 剩余数据中最多只有末尾的 CR 需要重新检查
+        self._scan = max(len(buffer) - 1, 0)
+        return events
+
+    def flush(self) -> List[SSEEvent]:
+        """在流结束时调用，输出缓冲区中剩余的事件
+
+        部分上游在最后一个事件后不发送空行，这里宽松处理，仍然派发已收集的数据。
+
+        Returns:
+            List[SSEEvent]: 剩余的事件
+        """
+        events = []
+        if self._buffer:
+            line = bytes(self._buffer).rstrip(b"\r")
+            self._buffer.clear()
+            self._scan = 0
+            event = self._process_line(line)
+            if event is not None:
+                events.append(event)
+        event = self._process_line(b"")
+        if event is not None:
+            events.append(event)
+        return events
+
+    def _process_line(self, line) -> Optional[SSEEvent]:
+        """处理一行数据，遇到空行时派发事件
+
+        Args:
+            line: 不含行结束符的一行字节数据
+
+        Returns:
+            Optional[SSEEvent]: 派发的事件，没有则为 None
+        """
+        if not line:
+            if not self._data:
+                self._event = ""
+                return None
+            event = SSEEvent(self._event or "message", "\n".join(self._data), self._last_id)
+            self._data = []
+            self._event = ""
+            return event
+
+        # 以冒号开头的是注释行
+        if line[0] == 0x3A:
+            return None
+
+        colon = line.find(b":")
+        if colon == -1:
+            field, value = bytes(line), b""
+        else:
+            field = bytes(line[:colon])
+            value = line[colon + 1:]
+            if value[:1] == b" ":
+                value = value[1:]
+
+        if field == b"data":
+            self._data.append(value.decode("utf-8", errors="replace"))
+        elif field == b"event":
+            self._event = value.decode("utf-8", errors="replace")
+        elif field == b"id":
+            if b"\0" not in value:
+                self._last_id = value.decode("utf-8", errors="replace")
+        # retry 和未知字段直接忽略
+        return None
+
+
+async def iter_sse_events(chunks: AsyncIterable[bytes]) -> AsyncGenerator[SSEEvent, None]:
+    """将字节流转换为 SSE 事件流
+
+    Args:
+        chunks: 原始字节流，例如 BaseClient._make_request 的输出
+
+    Yields:
+        SSEEvent: 解析出的事件
+    """
+    decoder = SSEDecoder()
+    try:
+        async for chunk in chunks:
+            for event in decoder.feed(chunk):
+                yield event
+        for event in decoder.flush():
+            yield event
+    finally:
+        # 提前退出时立即关闭上游响应，释放连接
+        aclose = getattr(chunks, "aclose", None)
+        if aclose is not None:
+            await aclose()
@@ -0,0 +1,228 @@
+"""目标模型负载均衡池
+
+同一个目标模型可以通过多个提供商访问(如 Anthropic、OpenRouter、DMXapi)。组合模型的
+target_models 配置为列表时，每次请求按以下策略选择提供商:
+- p2c(默认): 随机取两个可用提供商，选择 首 token 耗时 EWMA × (进行中请求数 + 1) 较小的一个
+- least_outstanding: 选择进行中请求数最少的提供商，相同时按耗时 EWMA 选择
+
+连续失败或错误率 EWMA 过高的提供商会被暂时摘除，摘除时间按次数指数增长，
+到期后重新参与选择，成功一次即恢复。所有提供商都被摘除时选择最早到期的一个。
+"""
+
+import random
+import time
+from contextlib import aclosing
+from typing import AsyncGenerator, List, Optional
+
+from app.utils.logger import logger
+from app.utils.metrics import (
+    TARGET_EJECTIONS,
+    TARGET_HEALTHY,
+    TARGET_LATENCY_EWMA_SECONDS,
+    TARGET_OUTSTANDING,
+    TARGET_SELECTED,
+)
+
+from .base_client import BaseClient, upstream_failure_reason
+
+
+class TargetEndpoint:
+    """负载均衡池中的一个目标模型提供商，同时记录其延迟和健康状态
+
+    Args:
+        name: 目标模型配置名称，用于日志和指标
+        client: 目标模型客户端
+        model: 请求上游时使用的模型 ID
+    """
+
+    # 延迟和错误率 EWMA 的平滑系数
+    ALPHA = 0.3
+
+    def __init__(self, name: str, client: BaseClient, model: str):
+        self.name = name
+        self.client = client
+        self.model = model
+        # 首 token 耗时 EWMA(秒)，尚无样本时为 None
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.samples = 0
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        TARGET_HEALTHY.set(1, target=name)
+
+    def healthy(self, now: float) -> bool:
+        """是否可以参与选择，摘除到期后重新参与"""
+        return now >= self.ejected_until
+
+    def score(self, default_latency: float) -> float:
+        """负载分数，越小越优先"""
+        latency = self.latency if self.latency is not None else default_latency
+        return latency * (self.outstanding + 1)
+
+    def on_start(self) -> None:
+        self.outstanding += 1
+        TARGET_OUTSTANDING.set(self.outstanding, target=self.name)
+
+    def on_end(self) -> None:
+        self.outstanding -= 1
+        TARGET_OUTSTANDING.set(self.outstanding, target=self.name)
+
+    def on_first_token(self, latency: float) -> None:
+        """记录首 token 耗时"""
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.ALPHA * (latency - self.latency)
+        TARGET_LATENCY_EWMA_SECONDS.set(self.latency, target=self.name)
+
+    def on_success(self) -> None:
+        """请求成功，提供商恢复健康"""
+        self.samples += 1
+        self.error_rate -= self.ALPHA * self.error_rate
+        self.consecutive_failures = 0
+        self.ejections = 0
+        TARGET_HEALTHY.set(1, target=self.name)
+
+    def on_failure(self) -> None:
+        """请求因提供商故障失败"""
+        self.samples += 1
+        self.error_rate += self.ALPHA * (1.0 - self.error_rate)
+        self.consecutive_failures += 1
+
+
+class TargetPool:
+    """多个等价目标模型提供商组成的负载均衡池
+
+    接口与被包装的客户端的 stream_chat 相同，可以直接替换组合模型中的目标模型客户端。
+
+    Args:
+        endpoints: 提供商列表，所有提供商必须使用相同的模型格式
+        strategy: 选择策略，p2c 或 least_outstanding
+        max_failures: 连续失败多少次后摘除
+        error_threshold: 错误率 EWMA 超过该值时摘除
+        min_samples: 按错误率摘除前至少需要的请求数
+        eject_seconds: 首次摘除的时长(秒)，之后每次翻倍
+        max_eject_seconds: 摘除时长上限(秒)
+    """
+
+    STRATEGIES = ("p2c", "least_outstanding")
+
+    def __init__(
+        self,
+        endpoints: List[TargetEndpoint],
+        strategy: str = "p2c",
+        max_failures: int = 3,
+        error_threshold: float = 0.5,
+        min_samples: int = 10,
+        eject_seconds: float = 30.0,
+        max_eject_seconds: float = 300.0,
+    ):
+        if not endpoints:
+            raise ValueError("目标模型负载均衡池不能为空")
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"不支持的负载均衡策略: {strategy}")
+        self.endpoints = endpoints
+        self.strategy = strategy
+        self.max_failures = max_failures
+        self.error_threshold = error_threshold
+        self.min_samples = min_samples
+        self.eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+
+    @classmethod
+    def from_config(cls, endpoints: List[TargetEndpoint], config: Optional[dict]) -> "TargetPool":
+        """根据 target_balancer 配置创建负载均衡池"""
+        config = config or {}
+        return cls(
+            endpoints,
+            strategy=config.get("strategy", "p2c"),
+            max_failures=config.get("max_failures", 3),
+            error_threshold=config.get("error_threshold", 0.5),
+            min_samples=config.get("min_samples", 10),
+            eject_seconds=config.get("eject_seconds", 30.0),
+            max_eject_seconds=config.get("max_eject_seconds", 300.0),
+        )
+
+    @property
+    def provider(self) -> str:
+        """提供商名称，用于日志"""
+        return "pool(" + ", ".join(endpoint.name for endpoint in self.endpoints) + ")"
+
+    def select(self) -> TargetEndpoint:
+        """按策略选择一个提供商"""
+        now = time.monotonic()
+        healthy = [endpoint for endpoint in self.endpoints if endpoint.healthy(now)]
+        if not healthy:
+            # 全部被摘除时选择最早恢复的提供商，而不是直接拒绝请求
+            return min(self.endpoints, key=lambda endpoint: endpoint.ejected_until)
+        if len(healthy) == 1:
+            return healthy[0]
+
+        # 没有延迟样本的提供商按已知延迟的平均值估算，使新加入的提供商也能被选中
+        known = [endpoint.latency for endpoint in healthy if endpoint.latency is not None]
+        default_latency = sum(known) / len(known) if known else 1.0
+        if self.strategy == "least_outstanding":
+            return min(
+                healthy,
+                key=lambda endpoint: (endpoint.outstanding, endpoint.score(default_latency)),
+            )
+        first, second = random.sample(healthy, 2)
+        return first if first.score(default_latency) <= second.score(default_latency) else second
+
+    def _maybe_eject(self, endpoint: TargetEndpoint) -> None:
+        """连续失败或错误率过高时摘除提供商"""
+        if endpoint.consecutive_failures < self.max_failures and (
+            endpoint.samples < self.min_samples or endpoint.error_rate < self.error_threshold
+        ):
+            return
+        duration = min(self.eject_seconds * 2 ** endpoint.ejections, self.max_eject_seconds)
+        endpoint.ejections += 1
+        endpoint.ejected_until = time.monotonic() + duration
+        # 恢复后重新开始统计
+        endpoint.consecutive_failures = 0
+        endpoint.error_rate = 0.0
+        endpoint.samples = 0
+        TARGET_EJECTIONS.inc(target=endpoint.name)
+        TARGET_HEALTHY.set(0, target=endpoint.name)
+        logger.warning(f"目标模型提供商 {endpoint.name} 不可用，摘除 {duration:.0f} 秒")
+
+    async def stream_chat(self, messages: list, model: Optional[str] = None, **kwargs) -> AsyncGenerator:
+        """选择一个提供商并转发请求
+
+        Args:
+            messages: 消息列表
+            model: 未使用，每个提供商使用自己配置的模型 ID
+            **kwargs: 透传给提供商客户端 stream_chat 的其他参数
+
+        Yields:
+            与提供商客户端 stream_chat 相同的事件
+        """
+        endpoint = self.select()
+        TARGET_SELECTED.inc(target=endpoint.name)
+        endpoint.on_start()
+        started = time.perf_counter()
+        received = False
+        failed = False
+        try:
+            async with aclosing(
+                endpoint.client.stream_chat(messages=messages, model=endpoint.model, **kwargs)
+            ) as stream:
+                async for item in stream:
+                    if not received:
+                        received = True
+                        endpoint.on_first_token(time.perf_counter() - started)
+                    yield item
+        except Exception as e:
+            failed = True
+            # 请求本身的错误(如 400)不计入提供商的健康状态
+            if upstream_failure_reason(e) is not None:
+                endpoint.on_failure()
+                self._maybe_eject(endpoint)
+            raise
+        finally:
+            endpoint.on_end()
+            # 调用方收到结束标记后可能提前关闭流，已经收到输出即视为成功
+            if received and not failed:
+                endpoint.on_success()
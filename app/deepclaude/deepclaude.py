@@ -1,14 +1,24 @@
 """DeepClaude 服务，用于协调 DeepSeek 和 Claude API 的调用"""
 
 import asyncio
-import json
 import time
-from typing import AsyncGenerator
+from contextlib import aclosing
+from typing import AsyncGenerator, List, Optional, Union
 
-import tiktoken
-
-from app.clients import ClaudeClient, DeepSeekClient
+from app.cache import reasoning_cache
+from app.clients import ClaudeClient, DeepSeekClient, ReasonerPool, TargetPool
+from app.utils.chunk_encoder import ChunkEncoder
 from app.utils.logger import logger
+from app.utils.phase_timer import PhaseTimer
+from app.utils.reasoning_budget import ReasoningBudget
+from app.utils.stream_tasks import OutputQueue, StreamRecorder, StreamTaskGroup
+from app.utils.token_counter import (
+    TokenCounter,
+    count_tokens_async,
+    get_encoding_async,
+    messages_text,
+    resolve_usage,
+)
 
 
 class DeepClaude:
@@ -16,21 +26,23 @@ class DeepClaude:
 
     def __init__(
         self,
-        deepseek_api_key: str,
-        claude_api_key: str,
+        deepseek_api_key: Union[str, List[str]],
+        claude_api_key: Union[str, List[str]],
         deepseek_api_url: str = "https://api.deepseek.com/v1/chat/completions",
         claude_api_url: str = "https://api.anthropic.com/v1/messages",
         claude_provider: str = "anthropic",
         is_origin_reasoning: bool = True,
         reasoner_proxy: str = None,
         target_proxy: str = None,
-        system_config: dict = None
+        system_config: dict = None,
+        reasoner_client: Optional[Union[DeepSeekClient, ReasonerPool]] = None,
+        target_client: Optional[Union[ClaudeClient, TargetPool]] = None,
     ):
         """初始化 API 客户端
 
         Args:
-            deepseek_api_key: DeepSeek API密钥
-            claude_api_key: Claude API密钥
+            deepseek_api_key: DeepSeek API密钥，可以是多个密钥的列表
+            claude_api_key: Claude API密钥，可以是多个密钥的列表
             deepseek_api_url: DeepSeek API地址
             claude_api_url: Claude API地址
             claude_provider: Claude 提供商
@@ -38,15 +50,17 @@ class DeepClaude:
             reasoner_proxy: reasoner模型代理服务器地址
             target_proxy: target模型代理服务器地址
             system_config: 系统配置，包含 save_deepseek_tokens 等设置
+            reasoner_client: 共享的推理模型客户端或故障转移池，提供时不再按参数创建 DeepSeek 客户端
+            target_client: 共享的目标模型客户端或负载均衡池，提供时不再按参数创建 Claude 客户端
         """
         self.system_config = system_config or {}
-        self.deepseek_client = DeepSeekClient(
+        self.deepseek_client = reasoner_client or DeepSeekClient(
             deepseek_api_key, 
             deepseek_api_url, 
             proxy=reasoner_proxy,
             system_config=self.system_config
         )
-        self.claude_client = ClaudeClient(
+        self.claude_client = target_client or ClaudeClient(
             claude_api_key, claude_api_url, claude_provider, proxy=target_proxy
         )
         self.is_origin_reasoning = is_origin_reasoning
@@ -57,6 +71,10 @@ class DeepClaude:
         model_arg: tuple[float, float, float, float],
         deepseek_model: str = "deepseek-reasoner",
         claude_model: str = "claude-3-5-sonnet-20241022",
+        recorder: Optional[StreamRecorder] = None,
+        include_usage: bool = False,
+        timer: Optional[PhaseTimer] = None,
+        budget: Optional[ReasoningBudget] = None,
     ) -> AsyncGenerator[bytes, None]:
         """处理完整的流式输出过程
 
@@ -65,6 +83,10 @@ class DeepClaude:
             model_arg: 模型参数
             deepseek_model: DeepSeek 模型名称
             claude_model: Claude 模型名称
+            recorder: 可选的记录器，用于收集完整的推理和回答内容
+            include_usage: 是否在结束前输出用量帧(stream_options.include_usage)
+            timer: 请求阶段计时器，None 时只按推理模型和目标模型打标签
+            budget: 推理预算，超出后截断推理并使用部分推理继续请求目标模型
 
         Yields:
             字节流数据，格式如下：
@@ -86,49 +108,58 @@ class DeepClaude:
         # 生成唯一的会话ID和时间戳
         chat_id = f"chatcmpl-{hex(int(time.time() * 1000))[2:]}"
         created_time = int(time.time())
+        # 预渲染帧模板，逐 token 只需转义内容
+        encoder = ChunkEncoder(chat_id, created_time, deepseek_model, claude_model)
 
-        # 创建队列，用于收集输出数据
-        output_queue = asyncio.Queue()
+        # 创建有界队列，用于收集输出数据，客户端读取过慢时反压上游
+        output_queue = OutputQueue.from_config(self.system_config)
         # 队列，用于传递 DeepSeek 推理内容给 Claude
         claude_queue = asyncio.Queue()
 
         # 用于存储 DeepSeek 的推理累积内容
         reasoning_content = []
+        # 当前请求拥有的上游任务
+        tasks = StreamTaskGroup()
+        # 增量 token 计数，编码器首次加载在工作线程中进行
+        encoding = await get_encoding_async(claude_model)
+        reasoning_tokens = TokenCounter(encoding)
+        answer_tokens = TokenCounter(encoding)
+        # 上游报告的用量，优先于本地计数
+        upstream_usage = {}
+        # 阶段计时
+        timer = timer or PhaseTimer(reasoner=deepseek_model, target=claude_model)
+        budget = budget or ReasoningBudget()
 
         async def process_deepseek():
             logger.info(f"开始处理 DeepSeek 流，使用模型：{deepseek_model}")
+            timer.reasoner_request()
             try:
-                async for content_type, content in self.deepseek_client.stream_chat(
-                    messages, deepseek_model, self.is_origin_reasoning
-                ):
-                    if content_type == "reasoning":
-                        reasoning_content.append(content)
-                        response = {
-                            "id": chat_id,
-                            "object": "chat.completion.chunk",
-                            "created": created_time,
-                            "model": deepseek_model,
-                            "choices": [
-                                {
-                                    "index": 0,
-                                    "delta": {
-                                        "role": "assistant",
-                                        "reasoning_content": content,
-                                        "content": "",
-                                    },
-                                }
-                            ],
-                        }
-                        await output_queue.put(
-                            f"data: {json.dumps(response)}\n\n".encode("utf-8")
-                        )
-                    elif content_type == "content":
-                        # 当收到 content 类型时，将完整的推理内容发送到 claude_queue，并结束 DeepSeek 流处理
-                        logger.info(
-                            f"DeepSeek 推理完成，收集到的推理内容长度：{len(''.join(reasoning_content))}"
-                        )
-                        await claude_queue.put("".join(reasoning_content))
-                        break
+                async with aclosing(budget.limit(
+                    reasoning_cache.stream_chat(
+                        self.deepseek_client, messages, deepseek_model, self.is_origin_reasoning
+                    ),
+                    reasoning_tokens,
+                )) as stream:
+                    async for content_type, content in stream:
+                        if content_type == "reasoning":
+                            reasoning_content.append(content)
+                            reasoning_tokens.add(content)
+                            timer.reasoner_token()
+                            await output_queue.put(encoder.reasoning(content))
+                        elif content_type == "usage":
+                            upstream_usage.update(content)
+                        elif content_type == "content":
+                            break
+                if budget.truncated:
+                    await output_queue.put(encoder.reasoning_truncated(budget.truncated))
+                else:
+                    tasks.complete("reasoner")
+                # 推理正常结束、被预算截断或上游未输出回答内容就结束时，都把已有的推理交给目标模型
+                logger.info(
+                    f"DeepSeek 推理完成，收集到的推理内容长度：{len(''.join(reasoning_content))}"
+                )
+                timer.reasoning_end()
+                await claude_queue.put("".join(reasoning_content))
             except Exception as e:
                 logger.error(f"处理 DeepSeek 流时发生错误: {e}")
                 # 构造错误响应
@@ -160,9 +191,9 @@ class DeepClaude:
                     "model": deepseek_model,
                     "error": error_info
                 }
-                await output_queue.put(
-                    f"data: {json.dumps(error_response)}\n\n".encode("utf-8")
-                )
+                await output_queue.put(encoder.frame(error_response))
+                # 通知目标模型任务不再等待推理内容
+                await claude_queue.put(None)
                 # 发送结束标记
                 await output_queue.put(b"data: [DONE]\n\n")
                 # 标记任务结束
@@ -176,6 +207,10 @@ class DeepClaude:
             try:
                 logger.info("等待获取 DeepSeek 的推理内容...")
                 reasoning = await claude_queue.get()
+                if reasoning is None:
+                    # 推理阶段出错，错误已经输出，目标模型不再请求
+                    await output_queue.put(None)
+                    return
                 logger.debug(
                     f"获取到推理内容，内容长度：{len(reasoning) if reasoning else 0}"
                 )
@@ -187,7 +222,7 @@ class DeepClaude:
                 claude_messages = messages.copy()
                 combined_content = f"""
                 ******The above is user information*****
-The following is the reasoning process of another model:****\n{reasoning}\n\n ****
+The following is the reasoning process of another model:****\n{reasoning}{budget.prompt_note()}\n\n ****
 Based on this reasoning, combined with your knowledge, when the current reasoning conflicts with your knowledge, you are more confident that you can adopt your own knowledge, which is completely acceptable. Please provide the user with a complete answer directly. You do not need to repeat the request or make your own reasoning. Please be sure to reply completely:"""
 
                 # 提取 system message 并同时过滤掉 system messages
@@ -224,29 +259,39 @@ Based on this reasoning, combined with your knowledge, when the current reasonin
                 system_content = system_content.strip() if system_content else None
                 if system_content:
                     logger.debug(f"使用系统提示: {system_content[:100]}...")
+                prompt_tokens = await count_tokens_async(
+                    messages_text(claude_messages) + (system_content or ""), claude_model
+                )
 
-                async for content_type, content in self.claude_client.stream_chat(
+                timer.target_request()
+                async with aclosing(self.claude_client.stream_chat(
                     messages=claude_messages,
                     model_arg=model_arg,
                     model=claude_model,
                     system_prompt=system_content
-                ):
-                    if content_type == "answer":
-                        response = {
-                            "id": chat_id,
-                            "object": "chat.completion.chunk",
-                            "created": created_time,
-                            "model": claude_model,
-                            "choices": [
-                                {
-                                    "index": 0,
-                                    "delta": {"role": "assistant", "content": content},
-                                }
-                            ],
-                        }
-                        await output_queue.put(
-                            f"data: {json.dumps(response)}\n\n".encode("utf-8")
-                        )
+                )) as stream:
+                    async for content_type, content in stream:
+                        if content_type == "answer":
+                            answer_tokens.add(content)
+                            timer.target_token()
+                            if recorder is not None:
+                                recorder.content_parts.append(content)
+                            await output_queue.put(encoder.answer(content))
+                        elif content_type == "usage":
+                            upstream_usage.update(content)
+                tasks.complete("target")
+                # 与 OpenAI 兼容组合模型和缓存重放一致，回答结束后输出 finish_reason=stop 帧
+                await output_queue.put(encoder.finish())
+                usage = resolve_usage(
+                    upstream_usage, prompt_tokens, answer_tokens.count, reasoning_tokens.count
+                )
+                if include_usage:
+                    await output_queue.put(encoder.usage(usage))
+                if recorder is not None:
+                    recorder.reasoning_parts = reasoning_content
+                    recorder.usage = usage
+                    recorder.reasoning_truncated = budget.truncated
+                    recorder.completed = True
             except Exception as e:
                 logger.error(f"处理 Claude 流时发生错误: {e}")
                 # 构造错误响应
@@ -278,9 +323,7 @@ Based on this reasoning, combined with your knowledge, when the current reasonin
                     "model": claude_model,
                     "error": error_info
                 }
-                await output_queue.put(
-                    f"data: {json.dumps(error_response)}\n\n".encode("utf-8")
-                )
+                await output_queue.put(encoder.frame(error_response))
                 # 发送结束标记
                 await output_queue.put(b"data: [DONE]\n\n")
                 # 标记任务结束
@@ -290,21 +333,28 @@ Based on this reasoning, combined with your knowledge, when the current reasonin
             logger.info("Claude 任务处理完成，标记结束")
             await output_queue.put(None)
 
-        # 创建并发任务
-        asyncio.create_task(process_deepseek())
-        asyncio.create_task(process_claude())
+        # 创建并发任务，任务归属于当前请求
+        timer.start()
+        tasks.create_task("reasoner", process_deepseek(), deepseek_model, reasoning_tokens)
+        tasks.create_task("target", process_claude(), claude_model, answer_tokens)
 
-        # 等待两个任务完成，通过计数判断
-        finished_tasks = 0
-        while finished_tasks < 2:
-            item = await output_queue.get()
-            if item is None:
-                finished_tasks += 1
-            else:
-                yield item
-
-        # 发送结束标记
-        yield b"data: [DONE]\n\n"
+        try:
+            # 等待两个任务完成，通过计数判断
+            finished_tasks = 0
+            while finished_tasks < 2:
+                item = await output_queue.get()
+                if item is None:
+                    finished_tasks += 1
+                else:
+                    yield item
+
+            # 发送结束标记
+            yield b"data: [DONE]\n\n"
+        finally:
+            # 下游断开或生成器被关闭时，立即取消仍在运行的上游任务
+            tasks.cancel()
+            output_queue.close()
+            timer.finish(reasoning_tokens.count, answer_tokens.count)
 
     async def chat_completions_without_stream(
         self,
@@ -312,6 +362,9 @@ Based on this reasoning, combined with your knowledge, when the current reasonin
         model_arg: tuple[float, float, float, float],
         deepseek_model: str = "deepseek-reasoner",
         claude_model: str = "claude-3-5-sonnet-20241022",
+        timer: Optional[PhaseTimer] = None,
+        budget: Optional[ReasoningBudget] = None,
+        recorder: Optional[StreamRecorder] = None,
     ) -> dict:
         """处理非流式输出过程
 
@@ -320,26 +373,69 @@ Based on this reasoning, combined with your knowledge, when the current reasonin
             model_arg: 模型参数
             deepseek_model: DeepSeek 模型名称
             claude_model: Claude 模型名称
+            timer: 请求阶段计时器，None 时只按推理模型和目标模型打标签
+            budget: 推理预算，超出后截断推理并使用部分推理继续请求目标模型
+            recorder: 可选的记录器，推理和回答都成功时标记 completed
 
         Returns:
-            dict: OpenAI 格式的完整响应
+            dict: OpenAI 格式的完整响应，推理被截断时包含 reasoning_truncated 字段
         """
+        timer = timer or PhaseTimer(reasoner=deepseek_model, target=claude_model)
+        timer.start()
+        try:
+            result = await self._complete_without_stream(
+                messages, model_arg, deepseek_model, claude_model, timer, budget or ReasoningBudget(), recorder
+            )
+        except BaseException:
+            timer.finish()
+            raise
+        usage = result["usage"]
+        timer.finish(usage["reasoning_tokens"], usage["completion_tokens"])
+        return result
+
+    async def _complete_without_stream(
+        self,
+        messages: list,
+        model_arg: tuple[float, float, float, float],
+        deepseek_model: str,
+        claude_model: str,
+        timer: PhaseTimer,
+        budget: ReasoningBudget,
+        recorder: Optional[StreamRecorder],
+    ) -> dict:
+        """非流式输出的具体实现，参数同 chat_completions_without_stream"""
         chat_id = f"chatcmpl-{hex(int(time.time() * 1000))[2:]}"
         created_time = int(time.time())
         reasoning_content = []
+        # 上游报告的用量，优先于本地计数
+        upstream_usage = {}
+        reasoning_tokens = await TokenCounter.create(claude_model)
+        # 推理阶段出错时仍然请求目标模型，但结果不完整
+        reasoner_failed = False
 
         # 1. 获取 DeepSeek 的推理内容（仍然使用流式）
+        timer.reasoner_request()
         try:
-            async for content_type, content in self.deepseek_client.stream_chat(
-                messages, deepseek_model, self.is_origin_reasoning
-            ):
-                if content_type == "reasoning":
-                    reasoning_content.append(content)
-                elif content_type == "content":
-                    break
+            async with aclosing(budget.limit(
+                reasoning_cache.stream_chat(
+                    self.deepseek_client, messages, deepseek_model, self.is_origin_reasoning
+                ),
+                reasoning_tokens,
+            )) as stream:
+                async for content_type, content in stream:
+                    if content_type == "reasoning":
+                        reasoning_content.append(content)
+                        reasoning_tokens.add(content)
+                        timer.reasoner_token()
+                    elif content_type == "usage":
+                        upstream_usage.update(content)
+                    elif content_type == "content":
+                        break
+            timer.reasoning_end()
         except Exception as e:
             logger.error(f"获取 DeepSeek 推理内容时发生错误: {e}")
             reasoning_content = ["获取推理内容失败"]
+            reasoner_failed = True
 
         # 2. 构造 Claude 的输入消息
         reasoning = "".join(reasoning_content)
@@ -347,7 +443,7 @@ Based on this reasoning, combined with your knowledge, when the current reasonin
 
         combined_content = f"""
             ******The above is user information*****
-The following is the reasoning process of another model:****\n{reasoning}\n\n ****
+The following is the reasoning process of another model:****\n{reasoning}{budget.prompt_note()}\n\n ****
 Based on this reasoning, combined with your knowledge, when the current reasoning conflicts with your knowledge, you are more confident that you can adopt your own knowledge, which is completely acceptable. Please provide the user with a complete answer directly. You do not need to repeat the request or make your own reasoning. Please be sure to reply completely:"""
 
         # 提取 system message 并同时从原始 messages 中过滤掉 system messages
@@ -371,25 +467,25 @@ Based on this reasoning, combined with your knowledge, when the current reasonin
             )
             last_message["content"] = fixed_content
 
-        # 拼接所有 content 为一个字符串，计算 token
-        token_content = "\n".join(
-            [message.get("content", "") for message in claude_messages]
+        # 检查 system_prompt
+        system_content = system_content.strip() if system_content else None
+
+        # 计算输入 token，长文本在工作线程中编码
+        input_tokens = await count_tokens_async(
+            messages_text(claude_messages) + (system_content or ""), claude_model
         )
-        encoding = tiktoken.encoding_for_model("gpt-4o")
-        input_tokens = encoding.encode(token_content)
-        logger.debug(f"输入 Tokens: {len(input_tokens)}")
+        logger.debug(f"输入 Tokens: {input_tokens}")
 
         logger.debug("claude messages: " + str(claude_messages))
         # 3. 获取 Claude 的非流式响应
         try:
-            answer = ""
-            output_tokens = []  # 初始化 output_tokens
-            
-            # 检查 system_prompt
-            system_content = system_content.strip() if system_content else None
+            answer_parts = []
+            output_tokens = await TokenCounter.create(claude_model)
+
             if system_content:
                 logger.debug(f"使用系统提示: {system_content[:100]}...")
-            
+
+            timer.target_request()
             async for content_type, content in self.claude_client.stream_chat(
                 messages=claude_messages,
                 model_arg=model_arg,
@@ -398,12 +494,15 @@ Based on this reasoning, combined with your knowledge, when the current reasonin
                 system_prompt=system_content
             ):
                 if content_type == "answer":
-                    answer += content
-                    output_tokens = encoding.encode(answer)  # 更新 output_tokens
-                logger.debug(f"输出 Tokens: {len(output_tokens)}")
+                    answer_parts.append(content)
+                    output_tokens.add(content)
+                    timer.target_token()
+                elif content_type == "usage":
+                    upstream_usage.update(content)
+            logger.debug(f"输出 Tokens: {output_tokens.count}")
 
             # 4. 构造 OpenAI 格式的响应
-            return {
+            result = {
                 "id": chat_id,
                 "object": "chat.completion",
                 "created": created_time,
@@ -413,18 +512,25 @@ Based on this reasoning, combined with your knowledge, when the current reasonin
                         "index": 0,
                         "message": {
                             "role": "assistant",
-                            "content": answer,
+                            "content": "".join(answer_parts),
                             "reasoning_content": reasoning,
                         },
                         "finish_reason": "stop",
                     }
                 ],
-                "usage": {
-                    "prompt_tokens": len(input_tokens),
-                    "completion_tokens": len(output_tokens),
-                    "total_tokens": len(input_tokens + output_tokens),
-                },
+                "usage": resolve_usage(
+                    upstream_usage, input_tokens, output_tokens.count, reasoning_tokens.count
+                ),
             }
+            if budget.truncated:
+                result["reasoning_truncated"] = budget.truncated
+            if recorder is not None:
+                recorder.reasoning_parts = [reasoning]
+                recorder.content_parts = answer_parts
+                recorder.usage = result["usage"]
+                recorder.reasoning_truncated = budget.truncated
+                recorder.completed = not reasoner_failed
+            return result
         except Exception as e:
             logger.error(f"获取 Claude 响应时发生错误: {e}")
             # 直接抛出异常，不再继续处理
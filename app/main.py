@@ -3,15 +3,20 @@ import logging
 import json
 import aiohttp
 import time
+from contextlib import asynccontextmanager
 
 from fastapi import Depends, FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 
-from app.utils.auth import verify_api_key
+from app.cache import reasoning_cache, response_cache
+from app.clients import circuit_breakers, client_registry, session_pool
+from app.tenants import Tenant, TenantRejected, tenants, usage_store
+from app.utils.auth import verify_admin_key, verify_api_key
 from app.utils.logger import logger
-from app.manager import model_manager
+from app.utils.metrics import registry
+from app.manager import AdmissionRejected, admission, model_manager
 
 # 版本信息
 VERSION = "v1.0.1"
@@ -34,8 +39,19 @@ logger.setLevel(getattr(logging, log_level))
 # 静态文件目录
 static_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "frontend")
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时配置上游连接池和配置文件监视，退出时关闭所有连接"""
+    session_pool.configure(model_manager.config.get("system", {}))
+    usage_store.start()
+    model_manager.start()
+    yield
+    await model_manager.close()
+    await usage_store.close()
+    await session_pool.close()
+
 # 创建 FastAPI 应用
-app = FastAPI(title="DeepClaude API")
+app = FastAPI(title="DeepClaude API", lifespan=lifespan)
 
 # 配置 CORS
 app.add_middleware(
@@ -59,8 +75,8 @@ async def root():
     return {"message": "Welcome to DeepClaude API", "version": VERSION}
 
 
-@app.post("/v1/chat/completions", dependencies=[Depends(verify_api_key)])
-async def chat_completions(request: Request):
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request, tenant: Tenant = Depends(verify_api_key)):
     """处理聊天完成请求，使用 ModelManager 进行处理
 
     请求体格式应与 OpenAI API 保持一致，包含：
@@ -76,7 +92,15 @@ async def chat_completions(request: Request):
         # 获取请求体
         body = await request.json()
         # 使用 ModelManager 处理请求，ModelManager 将处理不同的模型组合
-        return await model_manager.process_request(body)
+        return await model_manager.process_request(body, request.headers, tenant)
+    except (AdmissionRejected, TenantRejected) as e:
+        # 过载或超出配额时在开始流式输出之前直接返回错误状态码，客户端按 Retry-After 重试
+        error_type = {403: "permission_error", 503: "overloaded_error"}.get(e.status, "rate_limit_error")
+        return JSONResponse(
+            status_code=e.status,
+            headers={"Retry-After": str(e.retry_after)} if e.retry_after is not None else None,
+            content={"error": {"message": str(e), "type": error_type, "code": e.reason}},
+        )
     except Exception as e:
         logger.error(f"处理请求时发生错误: {e}")
         # 返回错误信息，保持与上游API一致的格式
@@ -157,21 +181,77 @@ async def chat_completions(request: Request):
                 content={"error": str(e)}
             )
 
-@app.get("/v1/models", dependencies=[Depends(verify_api_key)])
-async def list_models():
+@app.get("/v1/models")
+async def list_models(tenant: Tenant = Depends(verify_api_key)):
     """获取可用模型列表
 
-    使用 ModelManager 获取从配置文件中读取的模型列表
+    使用 ModelManager 获取从配置文件中读取的模型列表，租户只能看到允许使用的模型
     返回格式遵循 OpenAI API 标准
     """
     try:
         models = model_manager.get_model_list()
+        if tenant.models is not None:
+            models = [model for model in models if model["id"] in tenant.models]
         return {"object": "list", "data": models}
     except Exception as e:
         logger.error(f"获取模型列表时发生错误: {e}")
         return {"error": str(e)}
 
 
+@app.get("/metrics", dependencies=[Depends(verify_admin_key)])
+async def metrics():
+    """Prometheus 指标
+
+    返回 Prometheus 文本格式的运行指标
+    """
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/v1/cache/stats", dependencies=[Depends(verify_admin_key)])
+async def cache_stats():
+    """响应缓存和推理阶段缓存统计
+
+    返回各缓存的条目数、内存占用以及命中、未命中和淘汰次数
+    """
+    return {"response": response_cache.stats(), "reasoning": reasoning_cache.stats()}
+
+
+@app.get("/v1/admission", dependencies=[Depends(verify_admin_key)])
+async def admission_stats():
+    """准入控制状态
+
+    返回全局和各组合模型的并发限制、正在处理和排队的请求数，限制通过配置接口修改后立即生效
+    """
+    return admission.stats()
+
+
+@app.get("/v1/tenants", dependencies=[Depends(verify_admin_key)])
+async def tenant_stats():
+    """租户配额和用量记录状态
+
+    返回每个租户的配额、剩余额度，以及用量记录的写入情况
+    """
+    return {"tenants": tenants.stats(), "usage_db": usage_store.stats()}
+
+
+@app.get("/v1/circuit_breakers", dependencies=[Depends(verify_admin_key)])
+async def circuit_breaker_stats():
+    """上游熔断器状态
+
+    返回每个上游地址和密钥的熔断器状态、连续失败次数、最近错误率和被拒绝的请求数
+    """
+    return {"settings": circuit_breakers.settings, "breakers": circuit_breakers.stats()}
+
+
+@app.get("/v1/clients", dependencies=[Depends(verify_admin_key)])
+async def client_stats():
+    """共享的上游客户端
+
+    返回每个客户端的上游地址、代理、密钥数、正在进行的请求数，以及所用连接池的使用中和空闲连接数
+    """
+    return {"clients": client_registry.stats()}
+
+
 @app.get("/config")
 async def config_page():
     """配置页面
@@ -188,21 +268,24 @@ async def config_page():
         logger.error(f"返回配置页面时发生错误: {e}")
         return {"error": str(e)}
 
-@app.get("/v1/config", dependencies=[Depends(verify_api_key)])
+@app.get("/v1/config", dependencies=[Depends(verify_admin_key)])
 async def get_config():
     """获取模型配置
 
-    返回当前的模型配置数据
+    返回当前的模型配置数据，响应头 X-DeepClaude-Config-Version 为配置版本
     """
     try:
         # 使用 ModelManager 获取配置
         config = model_manager.get_config()
-        return config
+        return JSONResponse(
+            content=config,
+            headers={"X-DeepClaude-Config-Version": str(model_manager.config_version)},
+        )
     except Exception as e:
         logger.error(f"获取配置时发生错误: {e}")
         return {"error": str(e)}
 
-@app.post("/v1/config", dependencies=[Depends(verify_api_key)])
+@app.post("/v1/config", dependencies=[Depends(verify_admin_key)])
 async def update_config(request: Request):
     """更新模型配置
 
@@ -213,14 +296,14 @@ async def update_config(request: Request):
         body = await request.json()
 
         # 使用 ModelManager 更新配置
-        model_manager.update_config(body)
+        await model_manager.update_config(body)
 
         return {"message": "配置已更新"}
     except Exception as e:
         logger.error(f"更新配置时发生错误: {e}")
         return {"error": str(e)}
 
-@app.get("/v1/config/export", dependencies=[Depends(verify_api_key)])
+@app.get("/v1/config/export", dependencies=[Depends(verify_admin_key)])
 async def export_config():
     """导出模型配置
 
@@ -245,7 +328,7 @@ async def export_config():
         logger.error(f"导出配置时发生错误: {e}")
         return {"error": str(e)}
 
-@app.post("/v1/config/import", dependencies=[Depends(verify_api_key)])
+@app.post("/v1/config/import", dependencies=[Depends(verify_admin_key)])
 async def import_config(request: Request):
     """导入模型配置
 
@@ -256,7 +339,7 @@ async def import_config(request: Request):
         body = await request.json()
 
         # 使用 ModelManager 导入配置
-        model_manager.import_config(body)
+        await model_manager.import_config(body)
 
         return {"message": "配置导入成功"}
     except ValueError as e:
@@ -1,5 +1,6 @@
 """模型管理器包"""
 
+from .admission import AdmissionRejected, admission
 from .model_manager import model_manager
 
-__all__ = ["model_manager"]
\ No newline at end of file
+__all__ = ["AdmissionRejected", "admission", "model_manager"]
\ No newline at end of file
@@ -0,0 +1,353 @@
+"""请求准入控制(并发限制和过载保护)
+
+每个请求依次获取所属租户、组合模型和全局的并发名额，名额用完时进入有界的等待队列。
+队列已满或等待超过 queue_timeout 时立即拒绝，而不是让所有请求一起变慢直到上游超时:
+- 租户或组合模型的限制触发时返回 429
+- 全局限制触发时返回 503
+
+两种响应都带有 Retry-After，根据名额的平均占用时长和队列长度估算。流式请求的名额在流结束后释放。
+
+全局名额按租户公平分配: 有名额空出时，优先分配给 正在使用的名额数/权重 最小的租户，
+同一租户内先到先得，避免单个租户的突发请求占满所有上游连接。
+"""
+
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import aclosing
+from typing import Any, AsyncGenerator, Deque, Dict, List, Optional, Tuple
+
+from app.utils.logger import logger
+from app.utils.metrics import ADMISSION_ACTIVE, ADMISSION_QUEUE_DEPTH, ADMISSION_REJECTED
+
+GLOBAL_SCOPE = "global"
+TENANT_SCOPE_PREFIX = "tenant:"
+
+
+class AdmissionRejected(Exception):
+    """请求未被准入
+
+    Args:
+        scope: 触发限制的范围，global、组合模型名称或 tenant:租户名称
+        reason: queue_full 或 queue_timeout
+        retry_after: 建议客户端等待的秒数
+    """
+
+    def __init__(self, scope: str, reason: str, retry_after: int):
+        self.scope = scope
+        self.reason = reason
+        self.retry_after = retry_after
+        # 单个租户或组合模型过载说明客户端请求过快，全局过载说明服务本身繁忙
+        self.status = 503 if scope == GLOBAL_SCOPE else 429
+        if scope == GLOBAL_SCOPE:
+            target = "服务"
+        elif scope.startswith(TENANT_SCOPE_PREFIX):
+            target = f"租户 {scope[len(TENANT_SCOPE_PREFIX):]}"
+        else:
+            target = f"模型 {scope}"
+        detail = "等待队列已满" if reason == "queue_full" else "排队超时"
+        super().__init__(f"{target}繁忙({detail})，请 {retry_after} 秒后重试")
+
+
+class _Limiter:
+    """一个范围内的并发名额和等待队列，按租户公平分配，同一租户内先进先出
+
+    Args:
+        scope: 范围名称，用于指标和日志
+    """
+
+    # 名额占用时长 EWMA 的平滑系数
+    ALPHA = 0.2
+    # Retry-After 的上限(秒)
+    MAX_RETRY_AFTER = 60
+
+    def __init__(self, scope: str):
+        self.scope = scope
+        self.max_concurrency = 0
+        self.max_queue = 0
+        self.active = 0
+        self.hold_seconds: Optional[float] = None
+        # 各租户的等待队列，元素为 (排队序号, future)
+        self._waiters: Dict[str, Deque[Tuple[int, asyncio.Future]]] = {}
+        self._queued = 0
+        self._sequence = 0
+        # 各租户正在使用的名额数和权重
+        self._active_by: Dict[str, int] = {}
+        self._weights: Dict[str, float] = {}
+
+    def configure(self, max_concurrency: int, max_queue: int) -> None:
+        """更新限制，提高名额时立即唤醒排队的请求
+
+        Args:
+            max_concurrency: 最大并发数，0 表示不限制
+            max_queue: 等待队列长度上限
+        """
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._wake()
+
+    def _has_capacity(self) -> bool:
+        return self.max_concurrency <= 0 or self.active < self.max_concurrency
+
+    def _update_metrics(self) -> None:
+        ADMISSION_ACTIVE.set(self.active, scope=self.scope)
+        ADMISSION_QUEUE_DEPTH.set(self._queued, scope=self.scope)
+
+    def retry_after(self) -> int:
+        """估算排在队尾的请求获得名额需要的秒数"""
+        if self.hold_seconds is None or self.max_concurrency <= 0:
+            return 1
+        estimate = self.hold_seconds * (self._queued + 1) / self.max_concurrency
+        return min(max(math.ceil(estimate), 1), self.MAX_RETRY_AFTER)
+
+    def _reject(self, reason: str) -> AdmissionRejected:
+        ADMISSION_REJECTED.inc(scope=self.scope, reason=reason)
+        logger.warning(f"准入控制拒绝请求: 范围 {self.scope}, 原因 {reason}")
+        return AdmissionRejected(self.scope, reason, self.retry_after())
+
+    def _grant(self, owner: str) -> None:
+        self.active += 1
+        self._active_by[owner] = self._active_by.get(owner, 0) + 1
+
+    async def acquire(self, deadline: float, owner: str = "", weight: float = 1.0) -> None:
+        """获取一个名额
+
+        Args:
+            deadline: 排队截止时间(loop.time())
+            owner: 请求所属租户
+            weight: 租户的公平分配权重
+
+        Raises:
+            AdmissionRejected: 队列已满或排队超时
+        """
+        self._weights[owner] = weight
+        if self._has_capacity() and not self._queued:
+            self._grant(owner)
+            self._update_metrics()
+            return
+        if self._queued >= self.max_queue:
+            raise self._reject("queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (self._sequence, waiter)
+        self._sequence += 1
+        self._waiters.setdefault(owner, deque()).append(entry)
+        self._queued += 1
+        self._update_metrics()
+        try:
+            async with asyncio.timeout_at(deadline):
+                await waiter
+        except TimeoutError:
+            # 超时的同时已经获得名额时照常使用
+            if waiter.done() and not waiter.cancelled():
+                return
+            raise self._reject("queue_timeout")
+        except asyncio.CancelledError:
+            # 客户端断开时归还已经分配的名额
+            if waiter.done() and not waiter.cancelled():
+                self.release(None, owner)
+            raise
+        finally:
+            queue = self._waiters.get(owner)
+            if queue is not None and entry in queue:
+                queue.remove(entry)
+                self._queued -= 1
+                if not queue:
+                    del self._waiters[owner]
+            self._update_metrics()
+
+    def release(self, held_seconds: Optional[float], owner: str = "") -> None:
+        """归还名额并唤醒排队的请求
+
+        Args:
+            held_seconds: 名额占用时长，用于估算 Retry-After，None 表示不计入
+            owner: 请求所属租户
+        """
+        self.active -= 1
+        remaining = self._active_by.get(owner, 0) - 1
+        if remaining > 0:
+            self._active_by[owner] = remaining
+        else:
+            self._active_by.pop(owner, None)
+        if held_seconds is not None:
+            if self.hold_seconds is None:
+                self.hold_seconds = held_seconds
+            else:
+                self.hold_seconds += self.ALPHA * (held_seconds - self.hold_seconds)
+        self._wake()
+
+    def _next_owner(self) -> str:
+        """选择 正在使用的名额数/权重 最小的租户，相同时选择最早排队的"""
+        return min(
+            self._waiters,
+            key=lambda owner: (
+                self._active_by.get(owner, 0) / self._weights.get(owner, 1.0),
+                self._waiters[owner][0][0],
+            ),
+        )
+
+    def _wake(self) -> None:
+        """把空闲名额分配给排队的请求"""
+        while self._queued and self._has_capacity():
+            owner = self._next_owner()
+            queue = self._waiters[owner]
+            _, waiter = queue.popleft()
+            self._queued -= 1
+            if not queue:
+                del self._waiters[owner]
+            if not waiter.done():
+                waiter.set_result(None)
+                self._grant(owner)
+        self._update_metrics()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回当前状态"""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "queued": self._queued,
+            "avg_hold_seconds": round(self.hold_seconds, 3) if self.hold_seconds is not None else None,
+        }
+
+
+class AdmissionTicket:
+    """一个已准入请求持有的名额，release 可以重复调用"""
+
+    def __init__(self, limiters: List[_Limiter], owner: str = ""):
+        self._limiters = limiters
+        self._owner = owner
+        self._acquired_at = time.perf_counter()
+        self._released = False
+
+    def release(self) -> None:
+        """归还所有名额"""
+        if self._released:
+            return
+        self._released = True
+        held_seconds = time.perf_counter() - self._acquired_at
+        for limiter in self._limiters:
+            limiter.release(held_seconds, self._owner)
+
+    async def hold(self, stream: AsyncGenerator[bytes, None]) -> AsyncGenerator[bytes, None]:
+        """在流式输出结束后归还名额
+
+        Args:
+            stream: 流式响应
+
+        Yields:
+            bytes: 原样输出的响应帧
+        """
+        try:
+            async with aclosing(stream):
+                async for frame in stream:
+                    yield frame
+        finally:
+            self.release()
+
+
+class AdmissionController:
+    """全局、按组合模型和按租户的准入控制"""
+
+    # 默认设置，可通过 model_configs.json 中 system.admission 覆盖
+    # max_concurrency: 全局最大并发请求数，0 表示不限制
+    # max_queue: 全局等待队列长度上限
+    # queue_timeout: 排队等待的最长时间(秒)
+    # 组合模型可以通过 admission.max_concurrency 和 admission.max_queue 单独限制
+    # 租户通过 system.tenants 中的 max_concurrency 和 max_queue 限制
+    DEFAULT_SETTINGS = {
+        "max_concurrency": 0,
+        "max_queue": 100,
+        "queue_timeout": 10,
+    }
+
+    def __init__(self):
+        """初始化准入控制"""
+        self.settings = dict(self.DEFAULT_SETTINGS)
+        self._global = _Limiter(GLOBAL_SCOPE)
+        self._models: Dict[str, _Limiter] = {}
+        self._tenants: Dict[str, _Limiter] = {}
+
+    def configure(self, config: Optional[dict] = None) -> None:
+        """根据完整配置更新全局、各组合模型和各租户的限制，立即生效
+
+        Args:
+            config: 完整配置，读取 system.admission、system.tenants 和 composite_models.*.admission
+        """
+        config = config or {}
+        admission_config = config.get("system", {}).get("admission", {}) or {}
+        for key, default in self.DEFAULT_SETTINGS.items():
+            value = admission_config.get(key)
+            self.settings[key] = default if value is None else value
+        self._global.configure(self.settings["max_concurrency"], self.settings["max_queue"])
+
+        composite_models = config.get("composite_models", {})
+        self._configure_limiters(
+            self._models,
+            {name: (model_config or {}).get("admission") or {} for name, model_config in composite_models.items()},
+            "",
+        )
+        self._configure_limiters(
+            self._tenants, config.get("system", {}).get("tenants") or {}, TENANT_SCOPE_PREFIX
+        )
+        logger.debug(f"准入控制设置: {self.stats()}")
+
+    def _configure_limiters(self, limiters: Dict[str, _Limiter], configs: Dict[str, dict], prefix: str) -> None:
+        """更新一组限制，已删除或不再限制的保留为不限制，避免影响正在排队的请求"""
+        for name in set(configs) | set(limiters):
+            limit_config = configs.get(name) or {}
+            limiter = limiters.get(name)
+            if limiter is None:
+                if not limit_config.get("max_concurrency"):
+                    continue
+                limiter = limiters[name] = _Limiter(prefix + name)
+            limiter.configure(
+                limit_config.get("max_concurrency", 0) or 0,
+                limit_config.get("max_queue", self.settings["max_queue"]),
+            )
+
+    async def acquire(self, model: str, tenant: str = "", weight: float = 1.0) -> AdmissionTicket:
+        """为请求获取租户、组合模型和全局名额
+
+        Args:
+            model: 组合模型名称
+            tenant: 租户名称
+            weight: 租户的公平分配权重
+
+        Returns:
+            AdmissionTicket: 请求结束后必须调用 release
+
+        Raises:
+            AdmissionRejected: 请求被拒绝
+        """
+        deadline = asyncio.get_running_loop().time() + self.settings["queue_timeout"]
+        # 始终按 租户 -> 组合模型 -> 全局 的顺序获取名额，避免互相等待
+        limiters = [
+            limiter
+            for limiter in (self._tenants.get(tenant), self._models.get(model), self._global)
+            if limiter is not None
+        ]
+        acquired = []
+        try:
+            for limiter in limiters:
+                await limiter.acquire(deadline, tenant, weight)
+                acquired.append(limiter)
+        except BaseException:
+            for limiter in acquired:
+                limiter.release(None, tenant)
+            raise
+        return AdmissionTicket(acquired, tenant)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回全局和各组合模型的并发和排队情况"""
+        return {
+            "queue_timeout": self.settings["queue_timeout"],
+            "global": self._global.stats(),
+            "models": {name: limiter.stats() for name, limiter in self._models.items()},
+            "tenants": {name: limiter.stats() for name, limiter in self._tenants.items()},
+        }
+
+
+# 创建全局 AdmissionController 实例
+admission = AdmissionController()
@@ -0,0 +1,165 @@
+"""模型配置文件的读写和变更监视
+
+所有磁盘读写都在工作线程中执行，不阻塞事件循环:
+- 保存时先写入同目录下的临时文件并 fsync，再用 os.replace 原子替换，进程崩溃时不会留下写了一半的文件。
+  docker-compose 以单个文件挂载配置时无法替换挂载点(EBUSY)，此时退回为原地覆盖写入。
+- 后台任务按 poll_interval 检查文件的修改时间、大小和 inode，文件被外部修改时读取并回调，
+  不依赖平台相关的文件系统事件，对挂载卷同样有效。自己保存的文件不会触发回调。
+"""
+
+import asyncio
+import errno
+import json
+import os
+import tempfile
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from app.utils.logger import logger
+
+# 文件的 (修改时间, 大小, inode)，用于判断文件是否被外部修改
+Signature = Optional[Tuple[int, int, int]]
+
+
+class ConfigFile:
+    """配置文件的读写和变更监视
+
+    Args:
+        path: 配置文件路径
+    """
+
+    # 默认设置，可通过 model_configs.json 中 system.config_watch 覆盖
+    # enabled: 是否监视配置文件并热加载外部修改
+    # poll_interval: 检查文件变化的间隔(秒)
+    DEFAULT_SETTINGS = {
+        "enabled": True,
+        "poll_interval": 2,
+    }
+
+    def __init__(self, path: str):
+        """初始化配置文件"""
+        self.path = path
+        self.settings = dict(self.DEFAULT_SETTINGS)
+        # 最近一次读取或保存后的文件签名
+        self._signature: Signature = None
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._on_change: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None
+
+    def configure(self, system_config: Optional[dict] = None) -> None:
+        """根据系统配置更新设置
+
+        Args:
+            system_config: 系统配置，读取其中的 config_watch 字段
+        """
+        watch_config = (system_config or {}).get("config_watch", {}) or {}
+        for key, default in self.DEFAULT_SETTINGS.items():
+            value = watch_config.get(key)
+            self.settings[key] = default if value is None else value
+
+    def _stat(self) -> Signature:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def load(self) -> Dict[str, Any]:
+        """读取并解析配置文件，同步执行，只在启动时或工作线程中调用
+
+        Raises:
+            OSError: 读取失败
+            ValueError: 文件不是有效的 JSON
+        """
+        signature = self._stat()
+        with open(self.path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        self._signature = signature
+        return config
+
+    async def save(self, config: Dict[str, Any]) -> None:
+        """在工作线程中原子写入配置，多次保存按调用顺序执行
+
+        Args:
+            config: 完整配置
+        """
+        # 序列化在事件循环中执行，之后对 config 的修改不会影响写入的内容
+        data = json.dumps(config, ensure_ascii=False, indent=4)
+        async with self._lock:
+            self._signature = await asyncio.to_thread(self._write, data)
+
+    def _write(self, data: str) -> Signature:
+        """写入临时文件后原子替换，在工作线程中执行"""
+        directory = os.path.dirname(self.path) or "."
+        fd, temp_path = tempfile.mkstemp(prefix=".model_configs.", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                os.replace(temp_path, self.path)
+            except OSError as e:
+                # 单文件挂载点无法被替换，只能原地覆盖
+                if e.errno not in (errno.EBUSY, errno.EXDEV):
+                    raise
+                logger.debug(f"无法替换配置文件({e})，改为原地写入")
+                with open(self.path, "w", encoding="utf-8") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+        return self._stat()
+
+    def start(self, on_change: Callable[[Dict[str, Any]], Awaitable[None]]) -> None:
+        """启动后台监视任务，在应用启动时调用
+
+        Args:
+            on_change: 文件被外部修改并成功解析后调用，参数为新配置
+        """
+        self._on_change = on_change
+        if self.settings["enabled"] and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """停止后台监视任务，在应用退出时调用"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.settings["poll_interval"])
+            if not self.settings["enabled"]:
+                continue
+            try:
+                await self.check()
+            except Exception as e:
+                logger.error(f"检查配置文件变化失败: {e}")
+
+    async def check(self) -> bool:
+        """检查文件是否被外部修改，修改时读取并回调
+
+        Returns:
+            bool: 是否读取到了新配置
+        """
+        async with self._lock:
+            signature = await asyncio.to_thread(self._stat)
+            if signature is None or signature == self._signature:
+                return False
+            try:
+                config = await asyncio.to_thread(self.load)
+            except (OSError, ValueError) as e:
+                # 编辑器可能还没有写完，记录签名，等待下一次修改
+                self._signature = signature
+                logger.warning(f"配置文件已修改但无法解析，保留当前配置: {e}")
+                return False
+        logger.info("检测到配置文件被修改，重新加载")
+        if self._on_change is not None:
+            await self._on_change(config)
+        return True
@@ -1,14 +1,36 @@
 """模型管理器，负责处理模型选择、参数验证和请求处理"""
 
 import os
-import json
-from typing import Dict, Any, Tuple, List, AsyncGenerator, Optional
-
-from fastapi.responses import StreamingResponse
-
+import time
+from typing import Dict, Any, Tuple, List, AsyncGenerator, Mapping, Optional
+
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+
+from app.cache import CachedResponse, reasoning_cache, response_cache
+from app.clients import (
+    HedgePolicy,
+    ReasonerEndpoint,
+    ReasonerPool,
+    TargetEndpoint,
+    TargetPool,
+    circuit_breakers,
+    client_registry,
+    session_pool,
+)
 from app.deepclaude.deepclaude import DeepClaude
 from app.openai_composite import OpenAICompatibleComposite
+from app.tenants import Tenant, tenants, usage_store
 from app.utils.logger import logger
+from app.utils.phase_timer import PhaseTimer
+from app.utils.reasoning_budget import ReasoningBudget
+from app.utils.stream_tasks import StreamRecorder
+from app.utils.token_counter import count_tokens_async, messages_text
+
+from .admission import admission
+from .config_file import ConfigFile
+from .routing import Route, RoutingTable
+from .single_flight import single_flight
 
 
 class ModelManager:
@@ -18,22 +40,38 @@ class ModelManager:
         """初始化模型管理器"""
         # 配置文件路径
         self.config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "model_manager", "model_configs.json")
+        self.config_file = ConfigFile(self.config_path)
         # 加载模型配置
         self.config = self._load_config()
-        # 模型实例缓存
-        self.model_instances = {}
+        # 配置版本，每次应用新配置时加 1
+        self.config_version = 1
         # 是否原生支持推理字段
         self.is_origin_reasoning = os.getenv("IS_ORIGIN_REASONING", "True").lower() == "true"
+        # 组合模型路由表，配置变化时整体替换
+        self.routing = self._compile_routes(None)
+        self._configure_components(self.config)
+
+    def _configure_components(self, config: Dict[str, Any]) -> None:
+        """把新配置应用到连接池、缓存、熔断、租户、用量记录和准入控制"""
+        system_config = config.get("system", {})
+        # 连接池设置对之后新建的上游会话生效
+        session_pool.configure(system_config)
+        response_cache.configure(system_config)
+        reasoning_cache.configure(system_config)
+        circuit_breakers.configure(system_config)
+        tenants.configure(system_config)
+        usage_store.configure(system_config)
+        self.config_file.configure(system_config)
+        admission.configure(config)
 
     def _load_config(self) -> Dict[str, Any]:
-        """加载模型配置文件
+        """加载模型配置文件，只在启动时调用
 
         Returns:
             Dict[str, Any]: 配置信息
         """
         try:
-            with open(self.config_path, "r", encoding="utf-8") as f:
-                config = json.load(f)
+            config = self.config_file.load()
             logger.info(f"成功加载模型配置，包含 {len(config.get('composite_models', {}))} 个组合模型")
             return config
         except Exception as e:
@@ -63,6 +101,9 @@ class ModelManager:
 
         return model_config
 
+    # 组合模型中引用推理模型和目标模型的字段
+    _MODEL_KINDS = {"reasoner_models": "推理模型", "target_models": "目标模型"}
+
     def get_model_details(self, model_name: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
         """获取模型详细配置
 
@@ -70,41 +111,170 @@ class ModelManager:
             model_name: 模型名称
 
         Returns:
-            Tuple[Dict[str, Any], Dict[str, Any]]: (推理模型配置, 目标模型配置)
+            Tuple[Dict[str, Any], Dict[str, Any]]: (推理模型配置, 目标模型配置)，
+                配置了多个推理模型或目标模型时返回第一个可用的
 
         Raises:
             ValueError: 模型不存在或无效
         """
-        # 获取组合模型配置
-        composite_config = self.get_composite_model_config(model_name)
-        
-        # 获取推理模型配置
-        reasoner_model_name = composite_config.get("reasoner_models")
-        reasoner_models = self.config.get("reasoner_models", {})
-        if reasoner_model_name not in reasoner_models:
-            raise ValueError(f"推理模型 '{reasoner_model_name}' 不存在")
-        
-        reasoner_config = reasoner_models[reasoner_model_name]
-        if not reasoner_config.get("is_valid", False):
-            raise ValueError(f"推理模型 '{reasoner_model_name}' 当前不可用")
-        
-        # 获取目标模型配置
-        target_model_name = composite_config.get("target_models")
-        target_models = self.config.get("target_models", {})
-        if target_model_name not in target_models:
-            raise ValueError(f"目标模型 '{target_model_name}' 不存在")
-        
-        target_config = target_models[target_model_name]
-        if not target_config.get("is_valid", False):
-            raise ValueError(f"目标模型 '{target_model_name}' 当前不可用")
-        
+        _, reasoner_config, _ = self.get_model_configs(model_name, "reasoner_models")[0]
+        _, target_config, _ = self.get_model_configs(model_name, "target_models")[0]
         return reasoner_config, target_config
 
-    def _get_model_instance(self, model_name: str) -> Any:
-        """获取或创建模型实例
+    @classmethod
+    def parse_model_refs(cls, reference: Any, field: str = "reasoner_models") -> List[Tuple[str, float]]:
+        """解析组合模型的 reasoner_models 或 target_models 引用
+
+        Args:
+            reference: 字符串表示单个模型；列表表示多个等价模型，推理模型按顺序故障转移，
+                目标模型负载均衡；reasoner_models 还可以是模型名称到权重的字典
+            field: 引用字段名称
+
+        Returns:
+            List[Tuple[str, float]]: [(模型名称, 权重)]
+
+        Raises:
+            ValueError: 引用格式无效
+        """
+        if isinstance(reference, str):
+            return [(reference, 1.0)]
+        if isinstance(reference, list) and reference and all(isinstance(name, str) for name in reference):
+            return [(name, 1.0) for name in reference]
+        if field == "reasoner_models":
+            if isinstance(reference, dict) and reference:
+                return [(name, float(weight)) for name, weight in reference.items()]
+            raise ValueError(f"{field} 必须是推理模型名称、名称列表或名称到权重的字典: {reference!r}")
+        raise ValueError(f"{field} 必须是{cls._MODEL_KINDS[field]}名称或名称列表: {reference!r}")
+
+    def get_model_configs(self, model_name: str, field: str) -> List[Tuple[str, Dict[str, Any], float]]:
+        """获取组合模型引用的所有可用推理模型或目标模型
 
         Args:
             model_name: 模型名称
+            field: reasoner_models 或 target_models
+
+        Returns:
+            List[Tuple[str, Dict[str, Any], float]]: [(模型名称, 模型配置, 权重)]，按配置顺序排列
+
+        Raises:
+            ValueError: 模型不存在，或引用的模型都不可用
+        """
+        composite_config = self.get_composite_model_config(model_name)
+        kind = self._MODEL_KINDS[field]
+        models = self.config.get(field, {})
+        references = self.parse_model_refs(composite_config.get(field), field)
+
+        result = []
+        for name, weight in references:
+            if name not in models:
+                raise ValueError(f"{kind} '{name}' 不存在")
+            if models[name].get("is_valid", False):
+                result.append((name, models[name], weight))
+
+        if not result:
+            names = ", ".join(name for name, _ in references)
+            raise ValueError(f"{kind} '{names}' 当前不可用")
+        return result
+
+    def _build_reasoner_pool(
+        self,
+        model_name: str,
+        reasoners: List[Tuple[str, Dict[str, Any], float]],
+        proxy: Optional[str],
+        system_config: Dict[str, Any],
+    ) -> ReasonerPool:
+        """为配置了多个推理模型的组合模型创建故障转移池
+
+        Args:
+            model_name: 组合模型名称
+            reasoners: get_model_configs(model_name, "reasoner_models") 的返回值
+            proxy: 全局代理地址
+            system_config: 系统配置
+
+        Returns:
+            ReasonerPool: 推理模型故障转移池
+        """
+        composite_config = self.get_composite_model_config(model_name)
+        # 组合模型未单独配置时使用系统配置
+        failover_config = composite_config.get("reasoner_failover")
+        if failover_config is None:
+            failover_config = system_config.get("reasoner_failover") or {}
+        hedge_config = composite_config.get("reasoner_hedge")
+        if hedge_config is None:
+            hedge_config = system_config.get("reasoner_hedge")
+
+        endpoints = [
+            ReasonerEndpoint(
+                name,
+                client_registry.reasoner(
+                    reasoner_config["api_key"],
+                    f"{reasoner_config['api_base_url']}/{reasoner_config['api_request_address']}",
+                    proxy=proxy if reasoner_config.get("proxy_open", True) else None,
+                    system_config=system_config,
+                ),
+                reasoner_config["model_id"],
+                reasoner_config.get("is_origin_reasoning", self.is_origin_reasoning),
+                weight,
+            )
+            for name, reasoner_config, weight in reasoners
+        ]
+        logger.info(f"模型 {model_name} 使用推理模型故障转移池: {[endpoint.name for endpoint in endpoints]}")
+        return ReasonerPool(
+            endpoints,
+            weighted=isinstance(composite_config.get("reasoner_models"), dict),
+            first_token_timeout=failover_config.get("first_token_timeout"),
+            hedge=HedgePolicy.from_config(hedge_config),
+        )
+
+    def _build_target_pool(
+        self,
+        model_name: str,
+        targets: List[Tuple[str, Dict[str, Any], float]],
+        proxy: Optional[str],
+        system_config: Dict[str, Any],
+    ) -> TargetPool:
+        """为配置了多个目标模型提供商的组合模型创建负载均衡池
+
+        Args:
+            model_name: 组合模型名称
+            targets: get_model_configs(model_name, "target_models") 的返回值
+            proxy: 全局代理地址
+            system_config: 系统配置
+
+        Returns:
+            TargetPool: 目标模型负载均衡池
+        """
+        composite_config = self.get_composite_model_config(model_name)
+        # 组合模型未单独配置时使用系统配置
+        balancer_config = composite_config.get("target_balancer")
+        if balancer_config is None:
+            balancer_config = system_config.get("target_balancer")
+
+        if len({target_config.get("model_format", "") for _, target_config, _ in targets}) > 1:
+            raise ValueError(f"模型 '{model_name}' 引用的目标模型必须使用相同的 model_format")
+
+        endpoints = []
+        for name, target_config, _ in targets:
+            client = client_registry.target(
+                target_config["api_key"],
+                f"{target_config['api_base_url']}/{target_config['api_request_address']}",
+                target_config.get("model_format", ""),
+                proxy=proxy if target_config.get("proxy_open", True) else None,
+                stream_usage=target_config.get("stream_usage", True),
+            )
+            endpoints.append(TargetEndpoint(name, client, target_config["model_id"]))
+        logger.info(f"模型 {model_name} 使用目标模型负载均衡池: {[endpoint.name for endpoint in endpoints]}")
+        return TargetPool.from_config(endpoints, balancer_config)
+
+    def _create_model_instance(
+        self, model_name: str, reasoner_config: Dict[str, Any], target_config: Dict[str, Any]
+    ) -> Any:
+        """创建模型实例
+
+        Args:
+            model_name: 模型名称
+            reasoner_config: 第一个可用的推理模型配置
+            target_config: 第一个可用的目标模型配置
 
         Returns:
             Any: 模型实例
@@ -112,13 +282,6 @@ class ModelManager:
         Raises:
             ValueError: 模型不存在或无效
         """
-        # 如果已经有缓存的实例，直接返回
-        if model_name in self.model_instances:
-            return self.model_instances[model_name]
-        
-        # 获取模型详细配置
-        reasoner_config, target_config = self.get_model_details(model_name)
-        
         # 获取代理配置
         proxy_config = self.config.get("proxy", {})
         proxy = None
@@ -132,6 +295,31 @@ class ModelManager:
         
         # 获取系统配置
         system_config = self.config.get("system", {})
+
+        # 配置了多个推理模型时使用故障转移池，否则使用共享的客户端
+        reasoners = self.get_model_configs(model_name, "reasoner_models")
+        if len(reasoners) > 1:
+            reasoner_client = self._build_reasoner_pool(model_name, reasoners, proxy, system_config)
+        else:
+            reasoner_client = client_registry.reasoner(
+                reasoner_config["api_key"],
+                f"{reasoner_config['api_base_url']}/{reasoner_config['api_request_address']}",
+                proxy=reasoner_proxy,
+                system_config=system_config,
+            )
+
+        # 配置了多个目标模型提供商时使用负载均衡池，否则使用共享的客户端
+        targets = self.get_model_configs(model_name, "target_models")
+        if len(targets) > 1:
+            target_client = self._build_target_pool(model_name, targets, proxy, system_config)
+        else:
+            target_client = client_registry.target(
+                target_config["api_key"],
+                f"{target_config['api_base_url']}/{target_config['api_request_address']}",
+                target_config.get("model_format", ""),
+                proxy=target_proxy,
+                stream_usage=target_config.get("stream_usage", True),
+            )
         
         # 创建模型实例
         if target_config.get("model_format", "") == "anthropic":
@@ -146,6 +334,8 @@ class ModelManager:
                 reasoner_proxy=reasoner_proxy,
                 target_proxy=target_proxy,
                 system_config=system_config,
+                reasoner_client=reasoner_client,
+                target_client=target_client,
             )
         else:
             # 创建 OpenAICompatibleComposite 实例
@@ -158,10 +348,10 @@ class ModelManager:
                 reasoner_proxy=reasoner_proxy,
                 target_proxy=target_proxy,
                 system_config=system_config,
+                reasoner_client=reasoner_client,
+                target_client=target_client,
             )
-        
-        # 缓存实例
-        self.model_instances[model_name] = instance
+
         return instance
 
     def validate_and_prepare_params(self, body: Dict[str, Any]) -> Tuple[List[Dict[str, str]], str, Tuple[float, float, float, float, bool]]:
@@ -234,71 +424,212 @@ class ModelManager:
                 })
         return models
 
-    async def process_request(self, body: Dict[str, Any]) -> Any:
+    async def process_request(
+        self,
+        body: Dict[str, Any],
+        headers: Optional[Mapping[str, str]] = None,
+        tenant: Optional[Tenant] = None,
+    ) -> Any:
         """处理聊天完成请求
 
         Args:
             body: 请求体
+            headers: 请求头，用于读取 Cache-Control 等控制信息
+            tenant: 发起请求的租户，None 表示管理员
 
         Returns:
-            Any: 响应对象，可能是 StreamingResponse 或 Dict
+            Any: 响应对象，可能是 StreamingResponse、JSONResponse 或 Dict
 
         Raises:
             ValueError: 参数验证或处理失败时抛出
+            AdmissionRejected: 服务、组合模型或租户过载，请求被拒绝
+            TenantRejected: 租户无权使用该模型或超出速率限制
         """
+        # 收到请求的时间，用于统计排队耗时
+        received_at = time.perf_counter()
+
         # 验证和准备参数
         messages, model, model_args = self.validate_and_prepare_params(body)
         temperature, top_p, presence_penalty, frequency_penalty, stream = model_args
 
+        # 租户的模型权限和速率限制
+        tenant = tenant or tenants.admin
+        tenant.admit(model)
+
         # 模型参数，不包含 stream
         model_params = (temperature, top_p, presence_penalty, frequency_penalty)
+        # stream_options.include_usage: 流式响应结束前输出用量帧
+        stream_options = body.get("stream_options") or {}
+        include_usage = bool(stream and stream_options.get("include_usage", False))
+
+        # 组合模型的路由在加载配置时已经解析
+        route = self.routing.get(model)
+        model_instance = route.instance
+
+        # 相同请求合并，合并键同样需要在修改 messages 之前计算
+        flight_key = None
+        if route.single_flight:
+            # 是否输出用量帧会改变流的内容，也参与计算合并键；
+            # 只有领头请求的用量会被记录，因此只合并同一租户的请求，保证每个租户的用量完整
+            flight_key = response_cache.make_key(
+                model, messages, (*model_params, include_usage, tenant.name)
+            )
 
-        # 获取模型详细配置
-        reasoner_config, target_config = self.get_model_details(model)
+        # 响应缓存，按组合模型开启，必须在模型实例修改 messages 之前计算缓存键
+        cache_key = None
+        response_headers = {}
+        if route.response_cache:
+            cache_key, cached, cache_status = self._lookup_response_cache(
+                model, messages, model_params, headers
+            )
+            response_headers["X-DeepClaude-Cache"] = cache_status.upper()
+            if cached is not None:
+                logger.info(f"模型 {model} 命中响应缓存")
+                # 命中缓存不请求上游，不计入租户的 token 限额，但仍记录用量并标记为缓存
+                if usage_store.enabled:
+                    prompt_tokens = await count_tokens_async(messages_text(messages), route.target_model)
+                    usage_store.record(
+                        tenant.name,
+                        model,
+                        prompt_tokens,
+                        cached.usage.get("reasoning_tokens", 0),
+                        cached.usage.get("completion_tokens", 0),
+                        time.perf_counter() - received_at,
+                        cached=True,
+                    )
+                if stream:
+                    return StreamingResponse(
+                        cached.to_stream(include_usage),
+                        media_type="text/event-stream",
+                        headers=response_headers,
+                    )
+                return JSONResponse(content=cached.to_response(), headers=response_headers)
+
+        # 推理预算记录每个请求的截断状态，每个请求单独创建
+        budget = ReasoningBudget(*route.reasoning_budget, composite=model)
+        if budget.enabled:
+            response_headers["X-DeepClaude-Reasoning-Budget"] = budget.describe()
+
+        # 提示词 token 数，只在需要按 token 限流或记录用量时计算，同样需要在修改 messages 之前计算
+        prompt_tokens = 0
+        if tenant.counts_tokens or usage_store.enabled:
+            prompt_tokens = await count_tokens_async(messages_text(messages), route.target_model)
+
+        def record_usage(reasoning_tokens: int, answer_tokens: int, duration: float) -> None:
+            tenant.charge_tokens("completion", reasoning_tokens + answer_tokens)
+            usage_store.record(tenant.name, model, prompt_tokens, reasoning_tokens, answer_tokens, duration)
+
+        # 处理请求，DeepClaude 与 OpenAI 兼容组合模型的目标模型参数名不同
+        request_kwargs = {
+            "messages": messages,
+            "model_arg": model_params,
+            "deepseek_model": route.reasoner_model,
+            "timer": PhaseTimer(
+                model,
+                route.reasoner_model,
+                route.target_model,
+                received_at,
+                on_finish=record_usage,
+            ),
+            "budget": budget,
+        }
+        if route.is_anthropic:
+            # 使用 DeepClaude
+            request_kwargs["claude_model"] = route.target_model
+        else:
+            # 使用 OpenAI 兼容组合模型
+            request_kwargs["target_model"] = route.target_model
 
-        # 获取模型实例
-        model_instance = self._get_model_instance(model)
+        # 准入控制，命中缓存的请求不占用名额，流式请求的名额在流结束后释放
+        ticket = await admission.acquire(model, tenant.name, tenant.weight)
+        # 获得名额后才扣除提示词 token，因排队已满或排队超时被拒绝的请求不消耗租户的 token 额度
+        tenant.charge_tokens("prompt", prompt_tokens)
 
-        # 处理请求
-        if target_config.get("model_format", "") == "anthropic":
-            # 使用 DeepClaude
-            if stream:
-                return StreamingResponse(
-                    model_instance.chat_completions_with_stream(
-                        messages=messages,
-                        model_arg=model_params,
-                        deepseek_model=reasoner_config["model_id"],
-                        claude_model=target_config["model_id"],
-                    ),
-                    media_type="text/event-stream",
+        if stream:
+
+            def start_stream() -> AsyncGenerator[bytes, None]:
+                recorder = StreamRecorder() if cache_key else None
+                response_stream = model_instance.chat_completions_with_stream(
+                    **request_kwargs, recorder=recorder, include_usage=include_usage
                 )
+                if recorder is not None:
+                    response_stream = response_cache.store_stream(
+                        cache_key,
+                        response_stream,
+                        recorder,
+                        route.reasoner_model,
+                        route.target_model,
+                    )
+                return response_stream
+
+            if flight_key:
+                response_stream = single_flight.stream(flight_key, start_stream, model)
             else:
-                return await model_instance.chat_completions_without_stream(
-                    messages=messages,
-                    model_arg=model_params,
-                    deepseek_model=reasoner_config["model_id"],
-                    claude_model=target_config["model_id"],
-                )
-        else:
-            # 使用 OpenAI 兼容组合模型
-            if stream:
-                return StreamingResponse(
-                    model_instance.chat_completions_with_stream(
-                        messages=messages,
-                        model_arg=model_params,
-                        deepseek_model=reasoner_config["model_id"],
-                        target_model=target_config["model_id"],
+                response_stream = start_stream()
+            # 客户端断开时流可能不会被关闭，响应结束后的后台任务保证名额被归还
+            return StreamingResponse(
+                ticket.hold(response_stream),
+                media_type="text/event-stream",
+                headers=response_headers,
+                background=BackgroundTask(ticket.release),
+            )
+
+        # 只有推理和回答都成功结束、推理未被截断的结果才写入缓存
+        recorder = StreamRecorder() if cache_key else None
+        try:
+            if flight_key:
+                result = await single_flight.call(
+                    flight_key,
+                    lambda: model_instance.chat_completions_without_stream(
+                        **request_kwargs, recorder=recorder
                     ),
-                    media_type="text/event-stream",
+                    model,
                 )
             else:
-                return await model_instance.chat_completions_without_stream(
-                    messages=messages,
-                    model_arg=model_params,
-                    deepseek_model=reasoner_config["model_id"],
-                    target_model=target_config["model_id"],
+                result = await model_instance.chat_completions_without_stream(
+                    **request_kwargs, recorder=recorder
                 )
+        finally:
+            ticket.release()
+        if result.get("reasoning_truncated"):
+            # 流式响应的响应头在推理开始前已经发出，截断只能通过 reasoning_truncated 帧标记
+            response_headers["X-DeepClaude-Reasoning-Truncated"] = result["reasoning_truncated"]
+        if not response_headers:
+            return result
+        # 合并请求的跟随者不执行生成，其记录器不会完成，由领头请求写入缓存
+        if recorder is not None and recorder.cacheable:
+            entry = CachedResponse.from_response(route.reasoner_model, result)
+            if entry is not None:
+                response_cache.put(cache_key, entry)
+        return JSONResponse(content=result, headers=response_headers)
+
+    def _lookup_response_cache(
+        self,
+        model: str,
+        messages: List[Dict[str, Any]],
+        model_params: Tuple[float, float, float, float],
+        headers: Optional[Mapping[str, str]],
+    ) -> Tuple[Optional[str], Optional[CachedResponse], str]:
+        """查询响应缓存
+
+        请求头 Cache-Control: no-store 完全绕过缓存；no-cache 不读取缓存，但会写入新结果。
 
+        Returns:
+            Tuple[Optional[str], Optional[CachedResponse], str]:
+                (缓存键，不写入缓存时为 None; 命中的条目; 查询结果 hit/miss/bypass)
+        """
+        cache_control = (headers or {}).get("cache-control", "").lower()
+        cache_key = None if "no-store" in cache_control else response_cache.make_key(
+            model, messages, model_params
+        )
+        cached = None
+        if "no-store" in cache_control or "no-cache" in cache_control:
+            status = "bypass"
+        else:
+            cached = response_cache.get(cache_key)
+            status = "hit" if cached else "miss"
+        response_cache.record(model, status)
+        return cache_key, cached, status
 
     def get_config(self) -> Dict[str, Any]:
         """获取当前配置
@@ -306,12 +637,106 @@ class ModelManager:
         Returns:
             Dict[str, Any]: 当前配置
         """
-        # 每次都从文件重新加载最新配置
-        self.config = self._load_config()
+        # 内存中的配置在保存和热加载时更新，读取时不访问磁盘
         return self.config
 
-    def update_config(self, config: Dict[str, Any]) -> None:
-        """更新配置
+    # 创建模型实例时读取的组合模型字段和系统配置字段，其余字段在每个请求中读取，修改后不需要重建实例
+    _INSTANCE_COMPOSITE_KEYS = (
+        "is_valid", "reasoner_models", "target_models", "reasoner_failover", "reasoner_hedge", "target_balancer",
+    )
+    _INSTANCE_SYSTEM_KEYS = (
+        "save_deepseek_tokens", "save_deepseek_tokens_max_tokens", "stream_queue_size",
+        "reasoner_failover", "reasoner_hedge", "target_balancer",
+    )
+
+    @classmethod
+    def _instance_spec(cls, config: Dict[str, Any], model_name: str) -> Any:
+        """提取创建组合模型实例时用到的所有配置，两份配置的结果相等时实例可以继续使用"""
+        composite_config = config.get("composite_models", {}).get(model_name)
+        if composite_config is None:
+            return None
+        references = {}
+        for field in cls._MODEL_KINDS:
+            try:
+                refs = cls.parse_model_refs(composite_config.get(field), field)
+            except ValueError:
+                return None
+            models = config.get(field, {})
+            references[field] = [(name, models.get(name)) for name, _ in refs]
+        system_config = config.get("system", {})
+        return (
+            {key: composite_config.get(key) for key in cls._INSTANCE_COMPOSITE_KEYS},
+            references,
+            config.get("proxy"),
+            {key: system_config.get(key) for key in cls._INSTANCE_SYSTEM_KEYS},
+        )
+
+    def _compile_route(self, model_name: str, previous: Optional[RoutingTable]) -> Route:
+        """按当前配置解析一个组合模型的路由
+
+        创建实例用到的配置与旧路由相同时复用旧实例，保留故障转移和负载均衡的统计状态。
+
+        Raises:
+            ValueError: 模型无效，或引用的模型不存在、不可用
+        """
+        reasoner_config, target_config = self.get_model_details(model_name)
+        composite_config = self.get_composite_model_config(model_name)
+        system_config = self.config.get("system", {})
+
+        instance_spec = self._instance_spec(self.config, model_name)
+        old_route = previous.previous(model_name) if previous is not None else None
+        if old_route is not None and old_route.instance_spec == instance_spec:
+            instance = old_route.instance
+        else:
+            instance = self._create_model_instance(model_name, reasoner_config, target_config)
+            if old_route is not None:
+                logger.info(f"模型 {model_name} 的配置已变化，已按新配置重建实例")
+
+        budget = ReasoningBudget.from_config(model_name, composite_config, system_config)
+        return Route(
+            name=model_name,
+            instance=instance,
+            reasoner_model=reasoner_config["model_id"],
+            target_model=target_config["model_id"],
+            target_format=target_config.get("model_format", ""),
+            instance_spec=instance_spec,
+            # 相同请求合并需要显式开启，组合模型未单独配置时使用系统配置
+            single_flight=bool(composite_config.get("single_flight", system_config.get("single_flight", False))),
+            response_cache=bool(composite_config.get("response_cache", False)),
+            reasoning_budget=(budget.max_seconds, budget.max_tokens),
+        )
+
+    def _compile_routes(self, previous: Optional[RoutingTable]) -> RoutingTable:
+        """按当前配置生成新的路由表，不可用的组合模型记录原因，请求时返回相同的错误
+
+        正在处理的请求持有旧实例的引用，会在旧实例上正常完成；上游连接来自共享的连接池，
+        丢弃旧实例不会关闭连接。
+
+        Args:
+            previous: 旧路由表，用于复用配置未变化的实例
+        """
+        routes, errors = {}, {}
+        for model_name in self.config.get("composite_models", {}):
+            try:
+                routes[model_name] = self._compile_route(model_name, previous)
+            except ValueError as e:
+                errors[model_name] = str(e)
+            except Exception as e:
+                logger.error(f"解析模型 {model_name} 的路由失败: {e}")
+                errors[model_name] = f"模型 '{model_name}' 配置无效: {e}"
+        if errors:
+            logger.debug(f"不可用的组合模型: {errors}")
+        return RoutingTable(routes, errors, self.config_version)
+
+    def _apply_config(self, config: Dict[str, Any]) -> None:
+        """在内存中应用新配置并增加版本号，路由表生成后一次性替换"""
+        self.config = config
+        self.config_version += 1
+        self.routing = self._compile_routes(self.routing)
+        self._configure_components(config)
+
+    async def update_config(self, config: Dict[str, Any]) -> None:
+        """更新配置，立即生效，之后在工作线程中原子写入配置文件
         
         Args:
             config: 新配置
@@ -322,16 +747,45 @@ class ModelManager:
         # 验证配置
         if not isinstance(config, dict):
             raise ValueError("配置必须是字典")
-        
-        # 更新配置
-        self.config = config
-        
-        # 清空模型实例缓存，以便重新创建
-        self.model_instances = {}
-        
+
+        self._apply_config(config)
+
         # 保存配置到文件
-        with open(self.config_path, "w", encoding="utf-8") as f:
-            json.dump(config, f, ensure_ascii=False, indent=4)
+        await self.config_file.save(config)
+
+    async def reload_config(self, config: Dict[str, Any]) -> None:
+        """应用从配置文件热加载的配置，验证失败时保留当前配置
+
+        Args:
+            config: 配置文件中的新配置
+        """
+        if config == self.config:
+            return
+        is_valid, error_msg = self.validate_config(config)
+        if not is_valid:
+            logger.error(f"配置文件验证失败，保留当前配置: {error_msg}")
+            return
+        self._apply_config(config)
+        logger.info(f"配置文件已热加载，当前配置版本 {self.config_version}")
+
+    def start(self) -> None:
+        """启动配置文件监视，在应用启动时调用"""
+        self.config_file.start(self.reload_config)
+
+    async def close(self) -> None:
+        """停止配置文件监视，在应用退出时调用"""
+        await self.config_file.close()
+
+    @staticmethod
+    def _valid_api_key(api_key: Any) -> bool:
+        """api_key 可以是单个密钥，也可以是多个密钥的列表"""
+        if isinstance(api_key, str):
+            return True
+        return (
+            isinstance(api_key, list)
+            and len(api_key) > 0
+            and all(isinstance(key, str) and key for key in api_key)
+        )
 
     def validate_config(self, config: Dict[str, Any]) -> Tuple[bool, str]:
         """验证配置文件的完整性和有效性
@@ -359,6 +813,8 @@ class ModelManager:
                 for field in required_reasoner_fields:
                     if field not in model_config:
                         return False, f"推理模型 {model_name} 缺少必要字段: {field}"
+                if not self._valid_api_key(model_config["api_key"]):
+                    return False, f"推理模型 {model_name} 的 api_key 必须是字符串或非空的字符串列表"
             
             # 验证目标模型配置
             target_models = config.get("target_models", {})
@@ -370,6 +826,8 @@ class ModelManager:
                 for field in required_target_fields:
                     if field not in model_config:
                         return False, f"目标模型 {model_name} 缺少必要字段: {field}"
+                if not self._valid_api_key(model_config["api_key"]):
+                    return False, f"目标模型 {model_name} 的 api_key 必须是字符串或非空的字符串列表"
             
             # 验证组合模型配置
             composite_models = config.get("composite_models", {})
@@ -386,11 +844,25 @@ class ModelManager:
                 reasoner_ref = model_config.get("reasoner_models")
                 target_ref = model_config.get("target_models")
                 
-                if reasoner_ref not in reasoner_models:
-                    return False, f"组合模型 {model_name} 引用的推理模型 {reasoner_ref} 不存在"
+                try:
+                    reasoner_refs = self.parse_model_refs(reasoner_ref, "reasoner_models")
+                except (TypeError, ValueError) as e:
+                    return False, f"组合模型 {model_name} 的推理模型配置无效: {e}"
+                for reasoner_name, _ in reasoner_refs:
+                    if reasoner_name not in reasoner_models:
+                        return False, f"组合模型 {model_name} 引用的推理模型 {reasoner_name} 不存在"
                 
-                if target_ref not in target_models:
-                    return False, f"组合模型 {model_name} 引用的目标模型 {target_ref} 不存在"
+                try:
+                    target_refs = self.parse_model_refs(target_ref, "target_models")
+                except ValueError as e:
+                    return False, f"组合模型 {model_name} 的目标模型配置无效: {e}"
+                for target_name, _ in target_refs:
+                    if target_name not in target_models:
+                        return False, f"组合模型 {model_name} 引用的目标模型 {target_name} 不存在"
+                # 负载均衡池中的提供商必须使用相同的模型格式
+                model_formats = {target_models[name].get("model_format", "") for name, _ in target_refs}
+                if len(model_formats) > 1:
+                    return False, f"组合模型 {model_name} 引用的目标模型必须使用相同的 model_format"
             
             # 验证代理配置
             proxy_config = config.get("proxy", {})
@@ -401,6 +873,24 @@ class ModelManager:
             system_config = config.get("system", {})
             if not isinstance(system_config, dict):
                 return False, "system 配置必须是字典类型"
+
+            # 验证租户配置，租户密钥不能与管理员密钥或其他租户重复
+            tenants_config = system_config.get("tenants") or {}
+            if not isinstance(tenants_config, dict):
+                return False, "system.tenants 必须是字典类型"
+            used_keys = {system_config.get("api_key")}
+            for tenant_name, tenant_config in tenants_config.items():
+                if not isinstance(tenant_config, dict):
+                    return False, f"租户 {tenant_name} 的配置必须是字典类型"
+                tenant_key = tenant_config.get("api_key")
+                if not isinstance(tenant_key, str) or not tenant_key:
+                    return False, f"租户 {tenant_name} 缺少 api_key"
+                if tenant_key in used_keys:
+                    return False, f"租户 {tenant_name} 的 api_key 与其他密钥重复"
+                used_keys.add(tenant_key)
+                allowed_models = tenant_config.get("models")
+                if allowed_models is not None and not isinstance(allowed_models, list):
+                    return False, f"租户 {tenant_name} 的 models 必须是列表"
             
             return True, ""
             
@@ -413,9 +903,6 @@ class ModelManager:
         Returns:
             Dict[str, Any]: 当前配置的完整副本
         """
-        # 重新加载最新配置
-        self.config = self._load_config()
-        
         # 返回配置的深拷贝，避免外部修改影响内部状态
         import copy
         exported_config = copy.deepcopy(self.config)
@@ -430,7 +917,7 @@ class ModelManager:
         
         return exported_config
 
-    def import_config(self, config: Dict[str, Any]) -> None:
+    async def import_config(self, config: Dict[str, Any]) -> None:
         """导入配置文件
         
         Args:
@@ -451,7 +938,7 @@ class ModelManager:
             raise ValueError(f"配置验证失败: {error_msg}")
         
         # 导入配置
-        self.update_config(clean_config)
+        await self.update_config(clean_config)
         
         logger.info("配置导入成功")
 
@@ -0,0 +1,73 @@
+"""组合模型路由表
+
+配置加载或修改时，每个组合模型被预先解析为一个 Route: 模型实例(包含已创建的上游客户端、
+拼接好的上游地址和代理)、推理和目标模型 ID、请求级的开关都已确定，处理请求时只需要一次字典查找。
+路由表创建后不再修改，配置变化时整体替换为新表，正在处理的请求继续使用取到的旧路由。
+"""
+
+from types import MappingProxyType
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+
+class Route(NamedTuple):
+    """一个组合模型解析后的路由"""
+
+    # 组合模型名称
+    name: str
+    # DeepClaude 或 OpenAICompatibleComposite 实例
+    instance: Any
+    # 请求推理模型时使用的模型 ID
+    reasoner_model: str
+    # 请求目标模型时使用的模型 ID
+    target_model: str
+    # 目标模型格式，anthropic 或 openai
+    target_format: str
+    # 创建实例时用到的配置，新配置中相同时直接复用实例
+    instance_spec: Any
+    # 是否合并相同请求
+    single_flight: bool
+    # 是否开启响应缓存
+    response_cache: bool
+    # 推理预算 (max_seconds, max_tokens)，每个请求据此创建 ReasoningBudget
+    reasoning_budget: Tuple[Optional[float], Optional[int]]
+
+    @property
+    def is_anthropic(self) -> bool:
+        """目标模型是否使用 Anthropic 格式"""
+        return self.target_format == "anthropic"
+
+
+class RoutingTable:
+    """组合模型名称到路由的只读映射
+
+    Args:
+        routes: 可用的组合模型路由
+        errors: 不可用的组合模型及其原因
+        version: 生成路由表的配置版本
+    """
+
+    def __init__(self, routes: Dict[str, Route], errors: Dict[str, str], version: int):
+        self._routes = MappingProxyType(dict(routes))
+        self._errors = MappingProxyType(dict(errors))
+        self.version = version
+
+    def get(self, model: str) -> Route:
+        """查找组合模型的路由
+
+        Args:
+            model: 组合模型名称
+
+        Returns:
+            Route: 路由
+
+        Raises:
+            ValueError: 模型不存在或不可用
+        """
+        route = self._routes.get(model)
+        if route is None:
+            raise ValueError(self._errors.get(model, f"模型 '{model}' 不存在"))
+        return route
+
+    def previous(self, model: str) -> Optional[Route]:
+        """返回组合模型在本表中的路由，不存在时返回 None，用于重建路由表时复用实例"""
+        return self._routes.get(model)
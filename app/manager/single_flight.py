@@ -0,0 +1,193 @@
+"""相同请求的合并执行(single-flight)
+
+同一组合模型上内容完全相同的并发请求只驱动一次上游调用：第一个请求启动生成，
+之后到达的相同请求作为订阅者接入同一条流，并从头完整重放。每个订阅者拥有独立的会话ID，
+某个订阅者断开不会取消仍有其他订阅者的共享生成，最后一个订阅者断开时取消共享生成。
+
+合并默认关闭，需要在 system.single_flight 或组合模型的 single_flight 中显式开启。
+"""
+
+import asyncio
+import copy
+import re
+import time
+import uuid
+from contextlib import aclosing
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Optional
+
+from app.utils.logger import logger
+from app.utils.metrics import SINGLE_FLIGHT_ACTIVE, SINGLE_FLIGHT_REQUESTS
+
+# chat.completion.chunk 帧以 data: {"id":"chatcmpl-..." 开头，错误帧可能带空格
+_ID_PATTERN = re.compile(rb'data: \{"id":\s*("[^"]*")')
+
+
+def _new_chat_id() -> str:
+    """生成订阅者自己的会话ID"""
+    return f"chatcmpl-{hex(int(time.time() * 1000))[2:]}{uuid.uuid4().hex[:8]}"
+
+
+class _Flight:
+    """一次共享的流式生成"""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.frames: List[bytes] = []
+        self.done = False
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        # 生成方的会话ID(含引号)，从第一帧中解析
+        self.chat_id: Optional[bytes] = None
+        self._changed = asyncio.Event()
+
+    def append(self, frame: bytes) -> None:
+        """追加一帧并唤醒等待的订阅者"""
+        if self.chat_id is None:
+            match = _ID_PATTERN.match(frame)
+            if match:
+                self.chat_id = match.group(1)
+        self.frames.append(frame)
+        self._notify()
+
+    def finish(self) -> None:
+        """标记生成结束"""
+        self.done = True
+        self._notify()
+
+    def _notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait(self) -> None:
+        """等待新帧或生成结束"""
+        await self._changed.wait()
+
+
+class SingleFlight:
+    """按请求键合并并发的相同请求"""
+
+    def __init__(self):
+        """初始化合并器"""
+        self._flights: Dict[str, _Flight] = {}
+        self._calls: Dict[str, asyncio.Task] = {}
+        # 每个共享的非流式请求当前的等待者数
+        self._waiters: Dict[asyncio.Task, int] = {}
+
+    def stream(
+        self, key: str, start: Callable[[], AsyncGenerator[bytes, None]], model: str = ""
+    ) -> AsyncGenerator[bytes, None]:
+        """订阅一个共享的流式生成，不存在时调用 start 创建
+
+        Args:
+            key: 请求键
+            start: 创建上游流式输出的函数，只有第一个请求会调用
+            model: 组合模型名称，用于指标
+
+        Returns:
+            AsyncGenerator[bytes, None]: 当前订阅者的 SSE 字节流
+        """
+        flight = self._flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _Flight(key)
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(self._drive(flight, start()))
+            SINGLE_FLIGHT_ACTIVE.inc()
+        else:
+            logger.info(f"合并相同请求，当前共享订阅者数: {flight.subscribers + 1}")
+        SINGLE_FLIGHT_REQUESTS.inc(model=model, role="leader" if leader else "follower")
+        return self._subscribe(flight, rewrite_id=not leader)
+
+    async def call(
+        self, key: str, start: Callable[[], Awaitable[Dict[str, Any]]], model: str = ""
+    ) -> Dict[str, Any]:
+        """合并非流式请求，所有订阅者共享同一个结果
+
+        Args:
+            key: 请求键
+            start: 创建上游请求协程的函数，只有第一个请求会调用
+            model: 组合模型名称，用于指标
+
+        Returns:
+            Dict[str, Any]: 响应结果，后到的订阅者得到带独立会话ID的副本
+        """
+        task = self._calls.get(key)
+        leader = task is None
+        if leader:
+            task = asyncio.create_task(start())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget_call(key, done))
+        SINGLE_FLIGHT_REQUESTS.inc(model=model, role="leader" if leader else "follower")
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            # shield 保证某个订阅者被取消时共享的请求继续执行
+            result = await asyncio.shield(task)
+        finally:
+            remaining = self._waiters[task] - 1
+            if remaining:
+                self._waiters[task] = remaining
+            else:
+                del self._waiters[task]
+                if not task.done():
+                    # 最后一个订阅者断开，取消共享请求并释放上游连接
+                    logger.info("所有订阅者均已断开，取消共享请求")
+                    task.cancel()
+                    self._forget_call(key, task)
+        if leader:
+            return result
+        result = copy.deepcopy(result)
+        result["id"] = _new_chat_id()
+        return result
+
+    def _forget_call(self, key: str, task: asyncio.Task) -> None:
+        """移除已结束或已取消的共享请求，同一个键上的新请求不受影响"""
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+    async def _drive(self, flight: _Flight, stream: AsyncGenerator[bytes, None]) -> None:
+        """在后台驱动上游流，把每一帧追加到共享缓冲区"""
+        try:
+            async with aclosing(stream) as frames:
+                async for frame in frames:
+                    flight.append(frame)
+        except asyncio.CancelledError:
+            logger.info("所有订阅者均已断开，取消共享生成")
+        except Exception as e:
+            logger.error(f"共享生成发生错误: {e}")
+        finally:
+            flight.finish()
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+                SINGLE_FLIGHT_ACTIVE.dec()
+
+    async def _subscribe(self, flight: _Flight, rewrite_id: bool) -> AsyncGenerator[bytes, None]:
+        """从头重放共享缓冲区，并持续输出新帧
+
+        订阅者计数在生成器开始执行时增加，与 finally 中的减少配对，创建后从未被迭代的生成器不会占用计数。
+        """
+        own_id = f'"{_new_chat_id()}"'.encode("utf-8") if rewrite_id else None
+        index = 0
+        flight.subscribers += 1
+        try:
+            while True:
+                while index < len(flight.frames):
+                    frame = flight.frames[index]
+                    index += 1
+                    if own_id is not None and flight.chat_id is not None:
+                        frame = frame.replace(flight.chat_id, own_id, 1)
+                    yield frame
+                if flight.done:
+                    break
+                await flight.wait()
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done and flight.task is not None:
+                # 最后一个订阅者断开，取消共享生成并释放上游连接
+                flight.task.cancel()
+                if self._flights.get(flight.key) is flight:
+                    del self._flights[flight.key]
+                    SINGLE_FLIGHT_ACTIVE.dec()
+
+
+# 创建全局 SingleFlight 实例
+single_flight = SingleFlight()
@@ -2,12 +2,26 @@
 
 import asyncio
 import json
+import logging
 import time
-from typing import AsyncGenerator, Dict, Any, List
+from contextlib import aclosing
+from typing import AsyncGenerator, Dict, Any, List, Optional, Union
 
-from app.clients import DeepSeekClient
+from app.cache import reasoning_cache
+from app.clients import DeepSeekClient, ReasonerPool, TargetPool
 from app.clients.openai_compatible_client import OpenAICompatibleClient
+from app.utils.chunk_encoder import ChunkEncoder
 from app.utils.logger import logger
+from app.utils.phase_timer import PhaseTimer
+from app.utils.reasoning_budget import ReasoningBudget
+from app.utils.stream_tasks import OutputQueue, StreamRecorder, StreamTaskGroup
+from app.utils.token_counter import (
+    TokenCounter,
+    count_tokens_async,
+    get_encoding_async,
+    messages_text,
+    resolve_usage,
+)
 
 
 class OpenAICompatibleComposite:
@@ -15,35 +29,41 @@ class OpenAICompatibleComposite:
 
     def __init__(
         self,
-        deepseek_api_key: str,
-        openai_api_key: str,
+        deepseek_api_key: Union[str, List[str]],
+        openai_api_key: Union[str, List[str]],
         deepseek_api_url: str = "https://api.deepseek.com/v1/chat/completions",
         openai_api_url: str = "",  # 将由具体实现提供
         is_origin_reasoning: bool = True,
         reasoner_proxy: str = None,
         target_proxy: str = None,
-        system_config: dict = None
+        system_config: dict = None,
+        reasoner_client: Optional[Union[DeepSeekClient, ReasonerPool]] = None,
+        target_client: Optional[Union[OpenAICompatibleClient, TargetPool]] = None,
     ):
         """初始化 API 客户端
 
         Args:
-            deepseek_api_key: DeepSeek API密钥
-            openai_api_key: OpenAI 兼容服务的 API密钥
+            deepseek_api_key: DeepSeek API密钥，可以是多个密钥的列表
+            openai_api_key: OpenAI 兼容服务的 API密钥，可以是多个密钥的列表
             deepseek_api_url: DeepSeek API地址
             openai_api_url: OpenAI 兼容服务的 API地址
             is_origin_reasoning: 是否使用原始推理过程
             reasoner_proxy: reasoner模型代理服务器地址
             target_proxy: target模型代理服务器地址
             system_config: 系统配置，包含 save_deepseek_tokens 等设置
+            reasoner_client: 共享的推理模型客户端或故障转移池，提供时不再按参数创建 DeepSeek 客户端
+            target_client: 共享的目标模型客户端或负载均衡池，提供时不再按参数创建 OpenAI 兼容客户端
         """
         self.system_config = system_config or {}
-        self.deepseek_client = DeepSeekClient(
+        self.deepseek_client = reasoner_client or DeepSeekClient(
             deepseek_api_key, 
             deepseek_api_url, 
             proxy=reasoner_proxy,
             system_config=self.system_config
         )
-        self.openai_client = OpenAICompatibleClient(openai_api_key, openai_api_url, proxy=target_proxy)
+        self.openai_client = target_client or OpenAICompatibleClient(
+            openai_api_key, openai_api_url, proxy=target_proxy
+        )
         self.is_origin_reasoning = is_origin_reasoning
 
     async def chat_completions_with_stream(
@@ -52,6 +72,10 @@ class OpenAICompatibleComposite:
         model_arg: tuple[float, float, float, float],
         deepseek_model: str = "deepseek-reasoner",
         target_model: str = "",
+        recorder: Optional[StreamRecorder] = None,
+        include_usage: bool = False,
+        timer: Optional[PhaseTimer] = None,
+        budget: Optional[ReasoningBudget] = None,
     ) -> AsyncGenerator[bytes, None]:
         """处理完整的流式输出过程
 
@@ -60,6 +84,10 @@ class OpenAICompatibleComposite:
             model_arg: 模型参数 (temperature, top_p, presence_penalty, frequency_penalty)
             deepseek_model: DeepSeek 模型名称
             target_model: 目标 OpenAI 兼容模型名称
+            recorder: 可选的记录器，用于收集完整的推理和回答内容
+            include_usage: 是否在结束前输出用量帧(stream_options.include_usage)
+            timer: 请求阶段计时器，None 时只按推理模型和目标模型打标签
+            budget: 推理预算，超出后截断推理并使用部分推理继续请求目标模型
 
         Yields:
             字节流数据，格式如下：
@@ -81,49 +109,58 @@ class OpenAICompatibleComposite:
         # 生成唯一的会话ID和时间戳
         chat_id = f"chatcmpl-{hex(int(time.time() * 1000))[2:]}"
         created_time = int(time.time())
+        # 预渲染帧模板，逐 token 只需转义内容
+        encoder = ChunkEncoder(chat_id, created_time, deepseek_model, target_model)
 
-        # 创建队列，用于收集输出数据
-        output_queue = asyncio.Queue()
+        # 创建有界队列，用于收集输出数据，客户端读取过慢时反压上游
+        output_queue = OutputQueue.from_config(self.system_config)
         # 队列，用于传递 DeepSeek 推理内容
         reasoning_queue = asyncio.Queue()
 
         # 用于存储 DeepSeek 的推理累积内容
         reasoning_content = []
+        # 当前请求拥有的上游任务
+        tasks = StreamTaskGroup()
+        # 增量 token 计数，编码器首次加载在工作线程中进行
+        encoding = await get_encoding_async(target_model)
+        reasoning_tokens = TokenCounter(encoding)
+        answer_tokens = TokenCounter(encoding)
+        # 上游报告的用量，优先于本地计数
+        upstream_usage = {}
+        # 阶段计时
+        timer = timer or PhaseTimer(reasoner=deepseek_model, target=target_model)
+        budget = budget or ReasoningBudget()
 
         async def process_deepseek():
             logger.info(f"开始处理 DeepSeek 流，使用模型：{deepseek_model}")
+            timer.reasoner_request()
             try:
-                async for content_type, content in self.deepseek_client.stream_chat(
-                    messages, deepseek_model, self.is_origin_reasoning
-                ):
-                    if content_type == "reasoning":
-                        reasoning_content.append(content)
-                        response = {
-                            "id": chat_id,
-                            "object": "chat.completion.chunk",
-                            "created": created_time,
-                            "model": deepseek_model,
-                            "choices": [
-                                {
-                                    "index": 0,
-                                    "delta": {
-                                        "role": "assistant",
-                                        "reasoning_content": content,
-                                        "content": "",
-                                    },
-                                }
-                            ],
-                        }
-                        await output_queue.put(
-                            f"data: {json.dumps(response)}\n\n".encode("utf-8")
-                        )
-                    elif content_type == "content":
-                        # 当收到 content 类型时，将完整的推理内容发送到 reasoning_queue
-                        logger.info(
-                            f"DeepSeek 推理完成，收集到的推理内容长度：{len(''.join(reasoning_content))}"
-                        )
-                        await reasoning_queue.put("".join(reasoning_content))
-                        break
+                async with aclosing(budget.limit(
+                    reasoning_cache.stream_chat(
+                        self.deepseek_client, messages, deepseek_model, self.is_origin_reasoning
+                    ),
+                    reasoning_tokens,
+                )) as stream:
+                    async for content_type, content in stream:
+                        if content_type == "reasoning":
+                            reasoning_content.append(content)
+                            reasoning_tokens.add(content)
+                            timer.reasoner_token()
+                            await output_queue.put(encoder.reasoning(content))
+                        elif content_type == "usage":
+                            upstream_usage.update(content)
+                        elif content_type == "content":
+                            break
+                if budget.truncated:
+                    await output_queue.put(encoder.reasoning_truncated(budget.truncated))
+                else:
+                    tasks.complete("reasoner")
+                # 推理正常结束、被预算截断或上游未输出回答内容就结束时，都把已有的推理交给目标模型
+                logger.info(
+                    f"DeepSeek 推理完成，收集到的推理内容长度：{len(''.join(reasoning_content))}"
+                )
+                timer.reasoning_end()
+                await reasoning_queue.put("".join(reasoning_content))
             except Exception as e:
                 logger.error(f"处理 DeepSeek 流时发生错误: {e}")
                 # 构造错误响应
@@ -155,9 +192,9 @@ class OpenAICompatibleComposite:
                     "model": deepseek_model,
                     "error": error_info
                 }
-                await output_queue.put(
-                    f"data: {json.dumps(error_response)}\n\n".encode("utf-8")
-                )
+                await output_queue.put(encoder.frame(error_response))
+                # 通知目标模型任务不再等待推理内容
+                await reasoning_queue.put(None)
                 # 发送结束标记
                 await output_queue.put(b"data: [DONE]\n\n")
                 # 标记任务结束
@@ -171,6 +208,10 @@ class OpenAICompatibleComposite:
             try:
                 logger.info("等待获取 DeepSeek 的推理内容...")
                 reasoning = await reasoning_queue.get()
+                if reasoning is None:
+                    # 推理阶段出错，错误已经输出，目标模型不再请求
+                    await output_queue.put(None)
+                    return
                 logger.debug(
                     f"获取到推理内容，内容长度：{len(reasoning) if reasoning else 0}"
                 )
@@ -182,7 +223,7 @@ class OpenAICompatibleComposite:
                 openai_messages = messages.copy()
                 combined_content = f"""
                 ******The above is user information*****
-The following is the reasoning process of another model:****\n{reasoning}\n\n ****
+The following is the reasoning process of another model:****\n{reasoning}{budget.prompt_note()}\n\n ****
 Based on this reasoning, combined with your knowledge, when the current reasoning conflicts with your knowledge, you are more confident that you can adopt your own knowledge, which is completely acceptable. Please provide the user with a complete answer directly. 
 ***Notice, Here is your settings: SELF_TALK: off REASONING: off THINKING: off PLANNING: off THINKING_BUDGET: < 100 tokens ***:"""
 
@@ -201,50 +242,45 @@ Based on this reasoning, combined with your knowledge, when the current reasonin
                 last_message["content"] = fixed_content
 
                 logger.info(f"开始处理 OpenAI 兼容流，使用模型: {target_model}")
+                prompt_tokens = await count_tokens_async(messages_text(openai_messages), target_model)
 
-                async for role, content in self.openai_client.stream_chat(
+                timer.target_request()
+                # 只有需要返回用量(用量帧、非流式响应或缓存)时才请求上游报告用量，否则使用本地计数
+                async with aclosing(self.openai_client.stream_chat(
                     messages=openai_messages,
                     model=target_model,
-                ):
-                    # 检查是否是结束标记
-                    if isinstance(content, dict) and content.get("finish_reason") == "stop":
-                        logger.debug("收到 finish_reason=stop，准备发送结束响应")
-                        # 发送结束响应
-                        end_response = {
-                            "id": chat_id,
-                            "object": "chat.completion.chunk",
-                            "created": created_time,
-                            "model": target_model,
-                            "choices": [
-                                {
-                                    "delta": {},
-                                    "finish_reason": "stop",
-                                    "index": 0
-                                }
-                            ]
-                        }
-                        await output_queue.put(
-                            f"data: {json.dumps(end_response)}\n\n".encode("utf-8")
-                        )
-                        logger.debug("结束响应已发送到队列")
-                        break
+                    include_usage=include_usage or recorder is not None,
+                )) as stream:
+                    async for role, content in stream:
+                        if role == "usage":
+                            upstream_usage.update(content)
+                            continue
+                        # 检查是否是结束标记
+                        if isinstance(content, dict) and content.get("finish_reason") == "stop":
+                            logger.debug("收到 finish_reason=stop，准备发送结束响应")
+                            # 发送结束响应
+                            await output_queue.put(encoder.finish())
+                            logger.debug("结束响应已发送到队列")
+                            # 继续读取结束 chunk 之后的用量 chunk
+                            continue
                     
-                    # 正常内容响应
-                    response = {
-                        "id": chat_id,
-                        "object": "chat.completion.chunk",
-                        "created": created_time,
-                        "model": target_model,
-                        "choices": [
-                            {
-                                "index": 0,
-                                "delta": {"role": role, "content": content},
-                            }
-                        ],
-                    }
-                    await output_queue.put(
-                        f"data: {json.dumps(response)}\n\n".encode("utf-8")
-                    )
+                        # 正常内容响应
+                        answer_tokens.add(content)
+                        timer.target_token()
+                        if recorder is not None:
+                            recorder.content_parts.append(content)
+                        await output_queue.put(encoder.answer(content))
+                tasks.complete("target")
+                usage = resolve_usage(
+                    upstream_usage, prompt_tokens, answer_tokens.count, reasoning_tokens.count
+                )
+                if include_usage:
+                    await output_queue.put(encoder.usage(usage))
+                if recorder is not None:
+                    recorder.reasoning_parts = reasoning_content
+                    recorder.usage = usage
+                    recorder.reasoning_truncated = budget.truncated
+                    recorder.completed = True
             except Exception as e:
                 logger.error(f"处理 OpenAI 兼容流时发生错误: {e}")
                 # 构造错误响应
@@ -276,9 +312,7 @@ Based on this reasoning, combined with your knowledge, when the current reasonin
                     "model": target_model,
                     "error": error_info
                 }
-                await output_queue.put(
-                    f"data: {json.dumps(error_response)}\n\n".encode("utf-8")
-                )
+                await output_queue.put(encoder.frame(error_response))
                 # 发送结束标记
                 await output_queue.put(b"data: [DONE]\n\n")
                 # 标记任务结束
@@ -288,24 +322,32 @@ Based on this reasoning, combined with your knowledge, when the current reasonin
             logger.info("OpenAI 兼容任务处理完成，标记结束")
             await output_queue.put(None)
 
-        # 创建并发任务
-        asyncio.create_task(process_deepseek())
-        asyncio.create_task(process_openai())
+        # 创建并发任务，任务归属于当前请求
+        timer.start()
+        tasks.create_task("reasoner", process_deepseek(), deepseek_model, reasoning_tokens)
+        tasks.create_task("target", process_openai(), target_model, answer_tokens)
 
-        # 等待两个任务完成
-        finished_tasks = 0
-        while finished_tasks < 2:
-            item = await output_queue.get()
-            if item is None:
-                finished_tasks += 1
-                logger.debug(f"任务完成计数: {finished_tasks}/2")
-                continue
-            logger.debug(f"主循环输出数据: {item.decode('utf-8')[:100] if len(item) > 100 else item.decode('utf-8')}")
-            yield item
+        try:
+            # 等待两个任务完成
+            finished_tasks = 0
+            while finished_tasks < 2:
+                item = await output_queue.get()
+                if item is None:
+                    finished_tasks += 1
+                    logger.debug(f"任务完成计数: {finished_tasks}/2")
+                    continue
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"主循环输出数据: {item[:100].decode('utf-8', errors='replace')}")
+                yield item
 
-        # 发送结束标记
-        logger.debug("所有任务完成，发送结束标记")
-        yield b"data: [DONE]\n\n"
+            # 发送结束标记
+            logger.debug("所有任务完成，发送结束标记")
+            yield b"data: [DONE]\n\n"
+        finally:
+            # 下游断开或生成器被关闭时，立即取消仍在运行的上游任务
+            tasks.cancel()
+            output_queue.close()
+            timer.finish(reasoning_tokens.count, answer_tokens.count)
 
     async def chat_completions_without_stream(
         self,
@@ -313,6 +355,9 @@ Based on this reasoning, combined with your knowledge, when the current reasonin
         model_arg: tuple[float, float, float, float],
         deepseek_model: str = "deepseek-reasoner",
         target_model: str = "",
+        timer: Optional[PhaseTimer] = None,
+        budget: Optional[ReasoningBudget] = None,
+        recorder: Optional[StreamRecorder] = None,
     ) -> Dict[str, Any]:
         """处理非流式输出请求
 
@@ -321,9 +366,12 @@ Based on this reasoning, combined with your knowledge, when the current reasonin
             model_arg: 模型参数
             deepseek_model: DeepSeek 模型名称
             target_model: 目标 OpenAI 兼容模型名称
+            timer: 请求阶段计时器
+            budget: 推理预算，超出后截断推理并使用部分推理继续请求目标模型
+            recorder: 可选的记录器，推理和回答都成功时标记 completed，上游错误帧不会被当作正常结果
 
         Returns:
-            Dict[str, Any]: 完整的响应数据
+            Dict[str, Any]: 完整的响应数据，推理被截断时包含 reasoning_truncated 字段
         """
         full_response = {
             "id": f"chatcmpl-{hex(int(time.time() * 1000))[2:]}",
@@ -336,25 +384,35 @@ Based on this reasoning, combined with your knowledge, when the current reasonin
 
         content_parts = []
         reasoning_parts = []
+        # 通过记录器获取流式过程中统计的 token 用量和是否成功结束
+        recorder = recorder or StreamRecorder()
+        budget = budget or ReasoningBudget()
         try:
-            async for chunk in self.chat_completions_with_stream(
-                messages, model_arg, deepseek_model, target_model
-            ):
-                if chunk != b"data: [DONE]\n\n":
-                    try:
-                        response_data = json.loads(chunk.decode("utf-8")[6:])
-                        if (
-                            "choices" in response_data
-                            and len(response_data["choices"]) > 0
-                            and "delta" in response_data["choices"][0]
-                        ):
-                            delta = response_data["choices"][0]["delta"]
-                            if "content" in delta and delta["content"]:
-                                content_parts.append(delta["content"])
-                            if "reasoning_content" in delta and delta["reasoning_content"]:
-                                reasoning_parts.append(delta["reasoning_content"])
-                    except json.JSONDecodeError:
-                        continue
+            async with aclosing(self.chat_completions_with_stream(
+                messages,
+                model_arg,
+                deepseek_model,
+                target_model,
+                recorder=recorder,
+                timer=timer,
+                budget=budget,
+            )) as stream:
+                async for chunk in stream:
+                    if chunk != b"data: [DONE]\n\n":
+                        try:
+                            response_data = json.loads(chunk.decode("utf-8")[6:])
+                            if (
+                                "choices" in response_data
+                                and len(response_data["choices"]) > 0
+                                and "delta" in response_data["choices"][0]
+                            ):
+                                delta = response_data["choices"][0]["delta"]
+                                if "content" in delta and delta["content"]:
+                                    content_parts.append(delta["content"])
+                                if "reasoning_content" in delta and delta["reasoning_content"]:
+                                    reasoning_parts.append(delta["reasoning_content"])
+                        except json.JSONDecodeError:
+                            continue
 
             full_response["choices"] = [
                 {
@@ -367,6 +425,9 @@ Based on this reasoning, combined with your knowledge, when the current reasonin
                     "finish_reason": "stop",
                 }
             ]
+            full_response["usage"] = recorder.usage
+            if budget.truncated:
+                full_response["reasoning_truncated"] = budget.truncated
 
             return full_response
         except Exception as e:
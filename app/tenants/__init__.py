@@ -0,0 +1,15 @@
+"""多租户 API 密钥、配额和用量记录"""
+
+from .tenant import ADMIN_TENANT, Tenant, TenantRegistry, TenantRejected, TokenBucket, tenants
+from .usage_store import UsageStore, usage_store
+
+__all__ = [
+    "ADMIN_TENANT",
+    "Tenant",
+    "TenantRegistry",
+    "TenantRejected",
+    "TokenBucket",
+    "tenants",
+    "UsageStore",
+    "usage_store",
+]
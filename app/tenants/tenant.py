@@ -0,0 +1,261 @@
+"""多租户 API 密钥和配额
+
+system.api_key 是管理员密钥，不受配额限制，也是唯一可以访问配置和监控接口的密钥。
+system.tenants 中的每个租户拥有自己的 API 密钥和以下限制(0 或不配置表示不限制):
+- max_concurrency / max_queue: 并发请求数和排队长度，由准入控制执行
+- rpm: 每分钟请求数
+- tpm: 每分钟 token 数，请求获得准入名额后预扣提示词 token，结束后扣除输出 token
+- models: 允许使用的组合模型列表
+- weight: 全局名额不足时按权重公平分配
+
+rpm 和 tpm 使用内存中的令牌桶，桶容量为一分钟的额度，允许短时突发。
+
+密钥索引是以密钥 SHA-256 摘要为键的字典，只在配置变化时重建。验证时计算一次摘要并查字典，
+不读取配置也不比较明文；字典按摘要的哈希查找，耗时与密钥和已配置密钥有多少相同前缀无关。
+"""
+
+import hashlib
+import math
+import time
+from typing import Any, Dict, List, Optional
+
+from app.utils.logger import logger
+from app.utils.metrics import TENANT_REQUESTS, TENANT_TOKENS
+
+ADMIN_TENANT = "admin"
+
+
+def hash_api_key(api_key: str) -> bytes:
+    """计算 API 密钥的摘要，索引中只保存摘要"""
+    return hashlib.sha256(api_key.encode("utf-8")).digest()
+
+
+class TenantRejected(Exception):
+    """租户超出配额或无权访问请求的模型
+
+    Args:
+        tenant: 租户名称
+        status: HTTP 状态码
+        reason: rate_limited、token_limited 或 model_not_allowed
+        message: 错误信息
+        retry_after: 建议客户端等待的秒数，None 表示重试无意义
+    """
+
+    def __init__(self, tenant: str, status: int, reason: str, message: str, retry_after: Optional[int] = None):
+        super().__init__(message)
+        self.tenant = tenant
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """令牌桶，容量为一分钟的额度
+
+    Args:
+        per_minute: 每分钟补充的令牌数
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = per_minute
+        self._updated_at = time.monotonic()
+
+    def resize(self, per_minute: float) -> None:
+        """修改额度，保留当前已消耗的部分"""
+        self._refill()
+        self.tokens = min(self.tokens, per_minute)
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def available(self) -> float:
+        """当前剩余令牌数，预扣超出时可能为负数"""
+        self._refill()
+        return self.tokens
+
+    def try_take(self, amount: float = 1.0) -> bool:
+        """令牌足够时扣除"""
+        self._refill()
+        if self.tokens < amount:
+            return False
+        self.tokens -= amount
+        return True
+
+    def charge(self, amount: float) -> None:
+        """无条件扣除，余额可以为负，之后的请求需要等待补足"""
+        self._refill()
+        self.tokens -= amount
+
+    def wait_seconds(self, amount: float = 1.0) -> int:
+        """令牌补足到 amount 需要的秒数"""
+        self._refill()
+        if self.rate <= 0:
+            return 60
+        return max(math.ceil((amount - self.tokens) / self.rate), 1)
+
+
+class Tenant:
+    """一个租户的配额和状态
+
+    Args:
+        name: 租户名称
+        settings: 租户配置
+        admin: 是否为管理员
+    """
+
+    def __init__(self, name: str, settings: Optional[Dict[str, Any]] = None, admin: bool = False):
+        self.name = name
+        self.admin = admin
+        self.request_bucket: Optional[TokenBucket] = None
+        self.token_bucket: Optional[TokenBucket] = None
+        self.configure(settings or {})
+
+    def configure(self, settings: Dict[str, Any]) -> None:
+        """更新配额，已有令牌桶的消耗状态保留"""
+        api_key = settings.get("api_key")
+        self.key_hash: Optional[bytes] = hash_api_key(api_key) if api_key else None
+        self.max_concurrency = settings.get("max_concurrency", 0) or 0
+        self.max_queue = settings.get("max_queue")
+        self.weight = float(settings.get("weight", 1) or 1)
+        self.models: Optional[List[str]] = settings.get("models") or None
+        self.request_bucket = self._bucket(self.request_bucket, settings.get("rpm", 0) or 0)
+        self.token_bucket = self._bucket(self.token_bucket, settings.get("tpm", 0) or 0)
+
+    @staticmethod
+    def _bucket(bucket: Optional[TokenBucket], per_minute: float) -> Optional[TokenBucket]:
+        if per_minute <= 0:
+            return None
+        if bucket is None:
+            return TokenBucket(per_minute)
+        bucket.resize(per_minute)
+        return bucket
+
+    @property
+    def counts_tokens(self) -> bool:
+        """是否需要计算 token 数"""
+        return self.token_bucket is not None
+
+    def admit(self, model: str) -> None:
+        """检查模型权限和速率限制，通过时扣除一次请求
+
+        Args:
+            model: 组合模型名称
+
+        Raises:
+            TenantRejected: 无权访问模型或超出速率限制
+        """
+        if self.models is not None and model not in self.models:
+            TENANT_REQUESTS.inc(tenant=self.name, result="model_not_allowed")
+            raise TenantRejected(
+                self.name, 403, "model_not_allowed", f"租户 {self.name} 无权使用模型 {model}"
+            )
+        if self.token_bucket is not None and self.token_bucket.available() <= 0:
+            TENANT_REQUESTS.inc(tenant=self.name, result="token_limited")
+            retry_after = self.token_bucket.wait_seconds()
+            raise TenantRejected(
+                self.name, 429, "token_limited",
+                f"租户 {self.name} 超出每分钟 token 限制，请 {retry_after} 秒后重试", retry_after,
+            )
+        if self.request_bucket is not None and not self.request_bucket.try_take():
+            TENANT_REQUESTS.inc(tenant=self.name, result="rate_limited")
+            retry_after = self.request_bucket.wait_seconds()
+            raise TenantRejected(
+                self.name, 429, "rate_limited",
+                f"租户 {self.name} 超出每分钟请求数限制，请 {retry_after} 秒后重试", retry_after,
+            )
+        TENANT_REQUESTS.inc(tenant=self.name, result="accepted")
+
+    def charge_tokens(self, kind: str, amount: int) -> None:
+        """记录 token 用量
+
+        Args:
+            kind: prompt 或 completion
+            amount: token 数
+        """
+        if amount <= 0:
+            return
+        TENANT_TOKENS.inc(amount, tenant=self.name, kind=kind)
+        if self.token_bucket is not None:
+            self.token_bucket.charge(amount)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回配额和剩余额度"""
+        result: Dict[str, Any] = {
+            "admin": self.admin,
+            "models": self.models,
+            "max_concurrency": self.max_concurrency,
+            "weight": self.weight,
+        }
+        if self.request_bucket is not None:
+            result["rpm"] = self.request_bucket.capacity
+            result["rpm_remaining"] = math.floor(self.request_bucket.available())
+        if self.token_bucket is not None:
+            result["tpm"] = self.token_bucket.capacity
+            result["tpm_remaining"] = math.floor(self.token_bucket.available())
+        return result
+
+
+class TenantRegistry:
+    """按 API 密钥摘要查找租户"""
+
+    def __init__(self):
+        """初始化租户注册表"""
+        self._tenants: Dict[str, Tenant] = {}
+        self._by_hash: Dict[bytes, Tenant] = {}
+
+    def configure(self, system_config: Optional[dict] = None) -> None:
+        """根据系统配置更新租户，已有租户的令牌桶状态保留
+
+        Args:
+            system_config: 系统配置，读取 api_key 和 tenants 字段
+        """
+        system_config = system_config or {}
+        configured = {ADMIN_TENANT: {"api_key": system_config.get("api_key")}}
+        for name, settings in (system_config.get("tenants") or {}).items():
+            if name == ADMIN_TENANT:
+                logger.warning(f"租户名称 {ADMIN_TENANT} 保留给管理员密钥，已忽略")
+                continue
+            configured[name] = settings or {}
+
+        tenants = {}
+        for name, settings in configured.items():
+            tenant = self._tenants.get(name)
+            if tenant is None:
+                tenant = Tenant(name, settings, admin=name == ADMIN_TENANT)
+            else:
+                tenant.configure(settings)
+            tenants[name] = tenant
+        self._tenants = tenants
+        self._by_hash = {tenant.key_hash: tenant for tenant in tenants.values() if tenant.key_hash}
+        logger.debug(f"已加载 {len(tenants) - 1} 个租户")
+
+    @property
+    def admin(self) -> Tenant:
+        """管理员租户"""
+        return self._tenants[ADMIN_TENANT]
+
+    @property
+    def admin_configured(self) -> bool:
+        """是否配置了管理员密钥"""
+        return ADMIN_TENANT in self._tenants and self.admin.key_hash is not None
+
+    def lookup(self, api_key: str) -> Optional[Tenant]:
+        """按 API 密钥查找租户，不存在时返回 None
+
+        以摘要为键查字典就是全部的验证: 比较的是摘要而不是明文，耗时不取决于密钥与已配置密钥的相同前缀。
+        """
+        return self._by_hash.get(hash_api_key(api_key))
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """返回所有租户的配额和剩余额度"""
+        return {name: tenant.stats() for name, tenant in self._tenants.items()}
+
+
+# 创建全局 TenantRegistry 实例
+tenants = TenantRegistry()
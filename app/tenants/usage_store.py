@@ -0,0 +1,188 @@
+"""租户用量记录，批量写入本地 SQLite 文件
+
+每个请求结束时只把一行用量追加到内存缓冲区，后台任务按 flush_interval 或缓冲区达到
+batch_size 时在工作线程中一次性写入，避免在事件循环中执行磁盘 IO。
+命中响应缓存的请求同样记录，cached 列为 1，token 数为缓存中保存的用量。
+"""
+
+import asyncio
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.utils.logger import logger
+
+_CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS usage (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    tenant TEXT NOT NULL,
+    model TEXT NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    reasoning_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    duration_seconds REAL NOT NULL,
+    cached INTEGER NOT NULL DEFAULT 0
+)
+"""
+_CREATE_INDEX = "CREATE INDEX IF NOT EXISTS usage_tenant_created_at ON usage (tenant, created_at)"
+_INSERT = (
+    "INSERT INTO usage (created_at, tenant, model, prompt_tokens, reasoning_tokens, "
+    "completion_tokens, duration_seconds, cached) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+UsageRow = Tuple[float, str, str, int, int, int, float, int]
+
+
+class UsageStore:
+    """租户用量的批量写入器"""
+
+    # 默认设置，可通过 model_configs.json 中 system.usage_db 覆盖
+    # path: SQLite 文件路径，相对路径相对于项目根目录，为空时不记录用量
+    # flush_interval: 写入间隔(秒)
+    # batch_size: 缓冲区达到该行数时立即写入
+    # max_buffer: 写入持续失败时缓冲区最多保留的行数，超出后丢弃最旧的记录
+    DEFAULT_SETTINGS = {
+        "path": "",
+        "flush_interval": 5,
+        "batch_size": 200,
+        "max_buffer": 10000,
+    }
+
+    def __init__(self):
+        """初始化用量记录器"""
+        self.settings = dict(self.DEFAULT_SETTINGS)
+        self._buffer: List[UsageRow] = []
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._flush_requested = asyncio.Event()
+        self._initialized_paths = set()
+        self.written = 0
+        self.dropped = 0
+
+    @property
+    def enabled(self) -> bool:
+        """是否记录用量"""
+        return bool(self.settings["path"])
+
+    @property
+    def path(self) -> str:
+        """SQLite 文件的绝对路径"""
+        path = self.settings["path"]
+        if os.path.isabs(path):
+            return path
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        return os.path.join(root, path)
+
+    def configure(self, system_config: Optional[dict] = None) -> None:
+        """根据系统配置更新设置
+
+        Args:
+            system_config: 系统配置，读取其中的 usage_db 字段
+        """
+        usage_config = (system_config or {}).get("usage_db", {}) or {}
+        for key, default in self.DEFAULT_SETTINGS.items():
+            value = usage_config.get(key)
+            self.settings[key] = default if value is None else value
+
+    def record(
+        self,
+        tenant: str,
+        model: str,
+        prompt_tokens: int,
+        reasoning_tokens: int,
+        completion_tokens: int,
+        duration_seconds: float,
+        cached: bool = False,
+    ) -> None:
+        """追加一行用量，不阻塞调用方，cached 表示响应来自响应缓存"""
+        if not self.enabled:
+            return
+        self._buffer.append((
+            time.time(),
+            tenant,
+            model,
+            prompt_tokens,
+            reasoning_tokens,
+            completion_tokens,
+            duration_seconds,
+            int(cached),
+        ))
+        overflow = len(self._buffer) - self.settings["max_buffer"]
+        if overflow > 0:
+            del self._buffer[:overflow]
+            self.dropped += overflow
+        if len(self._buffer) >= self.settings["batch_size"]:
+            self._flush_requested.set()
+
+    def start(self) -> None:
+        """启动后台写入任务，在应用启动时调用"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """停止后台任务并写入剩余记录，在应用退出时调用"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), self.settings["flush_interval"])
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        """在工作线程中写入缓冲区中的所有记录，失败时保留记录等待下次写入"""
+        async with self._lock:
+            if not self._buffer or not self.enabled:
+                return
+            rows, self._buffer = self._buffer, []
+            path = self.path
+            try:
+                await asyncio.to_thread(self._write, path, rows)
+            except Exception as e:
+                logger.error(f"写入用量记录失败: {e}")
+                self._buffer[:0] = rows
+                return
+            self.written += len(rows)
+
+    def _write(self, path: str, rows: List[UsageRow]) -> None:
+        """写入一批记录，在工作线程中执行"""
+        if path not in self._initialized_paths:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(path)
+        try:
+            if path not in self._initialized_paths:
+                connection.execute(_CREATE_TABLE)
+                connection.execute(_CREATE_INDEX)
+            with connection:
+                connection.executemany(_INSERT, rows)
+        finally:
+            connection.close()
+        self._initialized_paths.add(path)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回写入统计"""
+        return {
+            "enabled": self.enabled,
+            "path": self.path if self.enabled else None,
+            "buffered": len(self._buffer),
+            "written": self.written,
+            "dropped": self.dropped,
+        }
+
+
+# 创建全局 UsageStore 实例
+usage_store = UsageStore()
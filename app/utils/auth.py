@@ -1,55 +1,72 @@
-from fastapi import HTTPException, Header, Request
-from typing import Optional
-import os
-from dotenv import load_dotenv
+from fastapi import HTTPException, Header
+from typing import Dict, Optional
 from app.utils.logger import logger
-from app.manager.model_manager import model_manager
+from app.tenants import Tenant, tenants
+from app.utils.metrics import AUTH_REQUESTS
 
 
+# 验证失败的日志采样间隔: 每种失败只记录第 1 次和之后每第 N 次，完整次数见 AUTH_REQUESTS 指标
+FAILURE_LOG_INTERVAL = 100
+_failure_counts: Dict[str, int] = {}
 
-# 获取配置文件中的 API Key
-def get_api_key():
-    """从配置文件中获取 API Key"""
-    system_config = model_manager.config.get("system", {})
-    api_key = system_config.get("api_key")
-    
-    if api_key is None:
-        logger.error("API key not found in config")
-        raise HTTPException(
-            status_code=500,
-            detail="API key not configured"
-        )
-    # 打印API密钥的前4位用于调试
-    logger.info(f"Loaded API key from config: {api_key[:4] if len(api_key) >= 4 else api_key}")
-    
-    return api_key
+
+def _reject(status_code: int, detail: str, result: str, message: str, tenant: str = "") -> HTTPException:
+    """记录验证失败并返回对应的 HTTPException，日志按 FAILURE_LOG_INTERVAL 采样"""
+    AUTH_REQUESTS.inc(tenant=tenant, result=result)
+    count = _failure_counts.get(result, 0) + 1
+    _failure_counts[result] = count
+    if count % FAILURE_LOG_INTERVAL == 1:
+        logger.warning(f"{message}(累计 {count} 次)")
+    return HTTPException(status_code=status_code, detail=detail)
 
 
-async def verify_api_key(authorization: Optional[str] = Header(None)) -> None:
+async def verify_api_key(authorization: Optional[str] = Header(None)) -> Tenant:
     """验证API密钥
 
+    管理员密钥(system.api_key)和 system.tenants 中配置的租户密钥都可以通过验证。
+    密钥在配置变化时建立摘要索引，验证时只计算一次摘要并查表，不读取配置。
+
     Args:
         authorization (Optional[str], optional): Authorization header中的API密钥. Defaults to Header(None).
 
+    Returns:
+        Tenant: 密钥对应的租户
+
     Raises:
-        HTTPException: 当Authorization header缺失或API密钥无效时抛出401错误
+        HTTPException: 当Authorization header缺失或API密钥无效时抛出401错误，未配置管理员密钥时抛出500错误
     """
     if authorization is None:
-        logger.warning("请求缺少Authorization header")
+        raise _reject(401, "Missing Authorization header", "missing", "请求缺少Authorization header")
+
+    if not tenants.admin_configured:
+        logger.error("API key not found in config")
         raise HTTPException(
-            status_code=401,
-            detail="Missing Authorization header"
+            status_code=500,
+            detail="API key not configured"
         )
-    
-    # 获取最新的 API Key
-    current_api_key = get_api_key()
-    
+
     api_key = authorization.replace("Bearer ", "").strip()
-    if api_key != current_api_key:
-        logger.warning(f"无效的API密钥: {api_key}")
-        raise HTTPException(
-            status_code=401,
-            detail="Invalid API key"
-        )
-    
-    logger.info("API密钥验证通过")
+    tenant = tenants.lookup(api_key)
+    if tenant is None:
+        raise _reject(401, "Invalid API key", "invalid", "无效的API密钥")
+
+    AUTH_REQUESTS.inc(tenant=tenant.name, result="ok")
+    return tenant
+
+
+async def verify_admin_key(authorization: Optional[str] = Header(None)) -> Tenant:
+    """验证管理员密钥，配置和监控接口只允许管理员访问
+
+    Args:
+        authorization (Optional[str], optional): Authorization header中的API密钥. Defaults to Header(None).
+
+    Returns:
+        Tenant: 管理员租户
+
+    Raises:
+        HTTPException: 密钥无效时抛出401错误，租户密钥抛出403错误
+    """
+    tenant = await verify_api_key(authorization)
+    if not tenant.admin:
+        raise _reject(403, "Admin API key required", "forbidden", f"租户 {tenant.name} 尝试访问管理接口", tenant.name)
+    return tenant
@@ -0,0 +1,122 @@
+"""预序列化的 SSE chunk 编码器
+
+每个请求只渲染一次帧中不变的部分（id、object、created、model、choices 外壳），
+每个 token 只需对内容字符串做 JSON 转义并拼接，避免逐 token 构造字典和 json.dumps。
+安装了 orjson 时自动使用 orjson 进行字符串转义。
+"""
+
+import json
+from json.encoder import encode_basestring
+from typing import Any, Dict
+
+try:
+    import orjson
+except ImportError:  # orjson 为可选依赖
+    orjson = None
+
+
+DONE_FRAME = b"data: [DONE]\n\n"
+
+
+def _escape_python(text: str) -> bytes:
+    """使用标准库对字符串做 JSON 转义，返回带引号的 UTF-8 字节"""
+    try:
+        return encode_basestring(text).encode("utf-8")
+    except UnicodeEncodeError:
+        # 孤立的代理字符无法编码为 UTF-8，使用 ASCII 转义
+        return json.dumps(text).encode("utf-8")
+
+
+if orjson is not None:
+
+    def escape_json_string(text: str) -> bytes:
+        """对字符串做 JSON 转义，返回带引号的 UTF-8 字节"""
+        try:
+            return orjson.dumps(text)
+        except orjson.JSONEncodeError:
+            # orjson 不接受孤立的代理字符，回退到标准库
+            return json.dumps(text).encode("utf-8")
+
+else:
+    escape_json_string = _escape_python
+
+
+def _dumps(payload: Dict[str, Any]) -> bytes:
+    """序列化完整的字典，用于不常见的帧（错误、结束等）"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(payload)
+        except (orjson.JSONEncodeError, TypeError):
+            pass
+    return json.dumps(payload).encode("utf-8")
+
+
+class ChunkEncoder:
+    """按请求预渲染 chat.completion.chunk 帧
+
+    Args:
+        chat_id: 会话ID
+        created: 创建时间戳
+        reasoning_model: 推理内容帧中的模型名称
+        answer_model: 回答内容帧中的模型名称
+    """
+
+    def __init__(self, chat_id: str, created: int, reasoning_model: str, answer_model: str):
+        self.chat_id = chat_id
+        self.created = created
+        self.reasoning_model = reasoning_model
+        self.answer_model = answer_model
+
+        self._reasoning_head = reasoning_head = self._render_head(reasoning_model)
+        answer_head = self._render_head(answer_model)
+
+        self._reasoning_prefix = (
+            reasoning_head + b'"choices":[{"index":0,"delta":{"role":"assistant","reasoning_content":'
+        )
+        self._reasoning_suffix = b',"content":""}}]}\n\n'
+        self._answer_prefix = answer_head + b'"choices":[{"index":0,"delta":{"role":"assistant","content":'
+        self._answer_suffix = b"}}]}\n\n"
+        self._finish_frame = answer_head + b'"choices":[{"delta":{},"finish_reason":"stop","index":0}]}\n\n'
+        self._usage_prefix = answer_head + b'"choices":[],"usage":'
+
+    def _render_head(self, model: str) -> bytes:
+        """渲染帧头部: data: {"id":...,"object":...,"created":...,"model":...,"""
+        return (
+            b'data: {"id":'
+            + escape_json_string(self.chat_id)
+            + b',"object":"chat.completion.chunk","created":'
+            + str(self.created).encode("ascii")
+            + b',"model":'
+            + escape_json_string(model)
+            + b","
+        )
+
+    def reasoning(self, content: str) -> bytes:
+        """推理内容帧"""
+        return self._reasoning_prefix + escape_json_string(content) + self._reasoning_suffix
+
+    def answer(self, content: str) -> bytes:
+        """回答内容帧"""
+        return self._answer_prefix + escape_json_string(content) + self._answer_suffix
+
+    def finish(self) -> bytes:
+        """finish_reason=stop 的结束帧"""
+        return self._finish_frame
+
+    def usage(self, usage: Dict[str, Any]) -> bytes:
+        """stream_options.include_usage 要求的用量帧，choices 为空"""
+        return self._usage_prefix + _dumps(usage) + b"}\n\n"
+
+    def reasoning_truncated(self, reason: str) -> bytes:
+        """推理因预算耗尽被截断的标记帧，delta 为空"""
+        return (
+            self._reasoning_head
+            + b'"choices":[{"index":0,"delta":{}}],"reasoning_truncated":'
+            + escape_json_string(reason)
+            + b"}\n\n"
+        )
+
+    @staticmethod
+    def frame(payload: Dict[str, Any]) -> bytes:
+        """将任意字典编码为一个 SSE 帧"""
+        return b"data: " + _dumps(payload) + b"\n\n"
@@ -0,0 +1,442 @@
+"""进程内指标注册表，输出 Prometheus 文本格式
+
+指标只在内存中累加，只有访问 /metrics 时才会渲染文本，未抓取时几乎没有开销。
+"""
+
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Tuple
+
+
+class _Metric:
+    """指标基类，按标签值元组保存数值"""
+
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        """初始化指标并注册到全局注册表
+
+        Args:
+            name: 指标名称
+            documentation: 指标说明
+            labelnames: 标签名称列表
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        registry.register(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        """将标签字典转换为按 labelnames 排列的元组"""
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def get(self, **labels) -> float:
+        """读取指定标签的当前值"""
+        return self._values.get(self._key(labels), 0.0)
+
+    def sum(self, **labels) -> float:
+        """汇总所有匹配给定标签的值，未指定的标签不参与过滤"""
+        indexes = [(self.labelnames.index(name), str(value)) for name, value in labels.items()]
+        return sum(
+            value for key, value in list(self._values.items())
+            if all(key[index] == expected for index, expected in indexes)
+        )
+
+    def _format_labels(self, key: Tuple[str, ...], extra: str = "") -> str:
+        """渲染标签部分，例如 {model="a",stage="b"}"""
+        parts = [
+            f'{name}="{_escape_label(value)}"' for name, value in zip(self.labelnames, key)
+        ]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def render(self) -> List[str]:
+        """渲染为 Prometheus 文本格式的行"""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        for key, value in list(self._values.items()):
+            lines.append(f"{self.name}{self._format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+
+    metric_type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        """增加计数"""
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    """可增可减的瞬时值"""
+
+    metric_type = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        """设置当前值"""
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        """增加当前值"""
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        """减少当前值"""
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """分桶直方图"""
+
+    metric_type = "histogram"
+
+    # 默认分桶(秒)，覆盖从毫秒级首 token 到数分钟的推理过程
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ):
+        """初始化直方图
+
+        Args:
+            name: 指标名称
+            documentation: 指标说明
+            labelnames: 标签名称列表
+            buckets: 分桶上界
+        """
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        super().__init__(name, documentation, labelnames)
+
+    def observe(self, value: float, **labels) -> None:
+        """记录一次观测值"""
+        key = self._key(labels)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+        counts[bisect_left(self.buckets, value)] += 1
+        self._values[key] = self._values.get(key, 0.0) + value
+
+    def get(self, **labels) -> float:
+        """读取指定标签的观测次数"""
+        return float(sum(self._counts.get(self._key(labels), ())))
+
+    def render(self) -> List[str]:
+        """渲染为 Prometheus 文本格式的行，桶计数为累计值"""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.metric_type}",
+        ]
+        for key, counts in list(self._counts.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = self._format_labels(key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            cumulative += counts[-1]
+            inf_labels = self._format_labels(key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {_format_value(self._values.get(key, 0.0))}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> None:
+        """注册指标，同名指标重复注册时报错"""
+        if metric.name in self._metrics:
+            raise ValueError(f"指标 {metric.name} 已存在")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """渲染所有指标"""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label(value: str) -> str:
+    """转义标签值中的特殊字符"""
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    """整数值不输出小数部分"""
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+# 创建全局指标注册表
+registry = Registry()
+
+# 下游断开导致的上游取消
+CANCELLED_STREAMS = Counter(
+    "deepclaude_cancelled_upstream_streams_total",
+    "下游断开后被取消的上游流数量",
+    ("stage",),
+)
+TOKENS_SAVED = Counter(
+    "deepclaude_cancellation_tokens_saved_total",
+    "因下游断开提前取消上游流而节省的估算 token 数",
+    ("stage",),
+)
+
+# 流式输出队列的内存占用
+STREAM_BUFFERED_BYTES = Gauge(
+    "deepclaude_stream_buffered_bytes",
+    "所有流式请求输出队列中尚未发送给客户端的字节数",
+)
+ACTIVE_STREAMS = Gauge(
+    "deepclaude_active_streams",
+    "正在进行的流式请求数",
+)
+STREAM_PEAK_BUFFERED_BYTES = Histogram(
+    "deepclaude_stream_peak_buffered_bytes",
+    "单个流式请求输出队列的峰值缓冲字节数",
+    buckets=(1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216),
+)
+
+# 响应缓存
+RESPONSE_CACHE_REQUESTS = Counter(
+    "deepclaude_response_cache_requests_total",
+    "响应缓存查询次数，按结果(hit/miss/bypass)区分",
+    ("model", "result"),
+)
+RESPONSE_CACHE_EVICTIONS = Counter(
+    "deepclaude_response_cache_evictions_total",
+    "响应缓存淘汰次数，按原因(lru/ttl/memory)区分",
+    ("reason",),
+)
+RESPONSE_CACHE_ENTRIES = Gauge(
+    "deepclaude_response_cache_entries",
+    "响应缓存当前条目数",
+)
+RESPONSE_CACHE_BYTES = Gauge(
+    "deepclaude_response_cache_bytes",
+    "响应缓存当前占用的估算内存字节数",
+)
+
+# 相同请求合并
+SINGLE_FLIGHT_REQUESTS = Counter(
+    "deepclaude_single_flight_requests_total",
+    "参与请求合并的请求数，按角色(leader/follower)区分",
+    ("model", "role"),
+)
+SINGLE_FLIGHT_ACTIVE = Gauge(
+    "deepclaude_single_flight_active",
+    "正在进行的共享流式生成数",
+)
+
+# 推理阶段缓存
+REASONING_CACHE_REQUESTS = Counter(
+    "deepclaude_reasoning_cache_requests_total",
+    "推理阶段缓存查询次数，按推理模型和结果(hit/miss)区分",
+    ("model", "result"),
+)
+REASONING_CACHE_EVICTIONS = Counter(
+    "deepclaude_reasoning_cache_evictions_total",
+    "推理阶段缓存淘汰次数，按原因(lru/ttl/memory)区分",
+    ("reason",),
+)
+REASONING_CACHE_ENTRIES = Gauge(
+    "deepclaude_reasoning_cache_entries",
+    "推理阶段缓存当前条目数",
+)
+REASONING_CACHE_BYTES = Gauge(
+    "deepclaude_reasoning_cache_bytes",
+    "推理阶段缓存当前占用的估算内存字节数",
+)
+
+# 请求各阶段耗时，按组合模型、推理模型和目标模型区分
+PHASE_LABELS = ("composite", "reasoner", "target")
+# 排队和衔接间隔通常在毫秒级，使用更细的分桶
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+REQUEST_QUEUE_SECONDS = Histogram(
+    "deepclaude_request_queue_seconds",
+    "从收到请求到开始调用上游的等待时间(秒)",
+    PHASE_LABELS,
+    FAST_BUCKETS,
+)
+REASONER_TTFT_SECONDS = Histogram(
+    "deepclaude_reasoner_ttft_seconds",
+    "推理模型首个 token 延迟(秒)",
+    PHASE_LABELS,
+)
+REASONING_DURATION_SECONDS = Histogram(
+    "deepclaude_reasoning_duration_seconds",
+    "推理阶段总耗时(秒)",
+    PHASE_LABELS,
+)
+HANDOFF_GAP_SECONDS = Histogram(
+    "deepclaude_handoff_gap_seconds",
+    "推理结束到开始请求目标模型的间隔(秒)",
+    PHASE_LABELS,
+    FAST_BUCKETS,
+)
+TARGET_TTFT_SECONDS = Histogram(
+    "deepclaude_target_ttft_seconds",
+    "目标模型首个 token 延迟(秒)，从发起目标模型请求开始计算",
+    PHASE_LABELS,
+)
+STREAM_DURATION_SECONDS = Histogram(
+    "deepclaude_stream_duration_seconds",
+    "一次生成从开始调用上游到结束的总耗时(秒)",
+    PHASE_LABELS,
+)
+TOKENS_STREAMED = Counter(
+    "deepclaude_tokens_streamed_total",
+    "输出给客户端的 token 数，按组合模型和阶段(reasoner/target)区分",
+    ("composite", "stage"),
+)
+IN_FLIGHT_REQUESTS = Gauge(
+    "deepclaude_in_flight_requests",
+    "正在调用上游的请求数",
+    ("composite",),
+)
+
+# 准入控制
+ADMISSION_ACTIVE = Gauge(
+    "deepclaude_admission_active_requests",
+    "已准入正在处理的请求数，按范围(global 或组合模型名称)区分",
+    ("scope",),
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "deepclaude_admission_queue_depth",
+    "等待准入的请求数，按范围(global 或组合模型名称)区分",
+    ("scope",),
+)
+ADMISSION_REJECTED = Counter(
+    "deepclaude_admission_rejected_total",
+    "准入控制拒绝的请求数，按范围和原因(queue_full/queue_timeout)区分",
+    ("scope", "reason"),
+)
+
+# 多租户
+AUTH_REQUESTS = Counter(
+    "deepclaude_auth_requests_total",
+    "API 密钥验证次数，按结果(ok/missing/invalid/forbidden)区分",
+    ("tenant", "result"),
+)
+TENANT_REQUESTS = Counter(
+    "deepclaude_tenant_requests_total",
+    "各租户的请求数，按结果(accepted/rate_limited/token_limited/model_not_allowed)区分",
+    ("tenant", "result"),
+)
+TENANT_TOKENS = Counter(
+    "deepclaude_tenant_tokens_total",
+    "各租户消耗的 token 数，按类型(prompt/completion)区分",
+    ("tenant", "kind"),
+)
+
+# 上游请求
+UPSTREAM_ERRORS = Counter(
+    "deepclaude_upstream_errors_total",
+    "上游请求错误数，按上游主机和状态码(或 timeout/client_error/error)区分",
+    ("upstream", "status"),
+)
+UPSTREAM_RESPONSE_SECONDS = Histogram(
+    "deepclaude_upstream_response_seconds",
+    "发起上游请求到收到响应头的耗时(秒)",
+    ("upstream",),
+)
+UPSTREAM_KEY_PARKED = Counter(
+    "deepclaude_upstream_key_parked_total",
+    "上游 API 密钥因限流被暂停使用的次数，按上游主机、密钥序号和原因(429/requests/tokens)区分",
+    ("upstream", "key", "reason"),
+)
+UPSTREAM_KEY_REMAINING = Gauge(
+    "deepclaude_upstream_key_remaining",
+    "上游响应头报告的 API 密钥剩余配额，按上游主机、密钥序号和类型(requests/tokens)区分",
+    ("upstream", "key", "kind"),
+)
+
+# 上游熔断
+CIRCUIT_STATE = Gauge(
+    "deepclaude_circuit_state",
+    "上游熔断器状态(0 closed，1 half_open，2 open)，按上游主机和密钥序号区分",
+    ("upstream", "key"),
+)
+CIRCUIT_TRANSITIONS = Counter(
+    "deepclaude_circuit_transitions_total",
+    "上游熔断器状态切换次数，按切换后的状态区分",
+    ("upstream", "key", "state"),
+)
+CIRCUIT_REJECTED = Counter(
+    "deepclaude_circuit_rejected_total",
+    "熔断器打开或半开探测名额已满时被直接拒绝的请求数",
+    ("upstream", "key"),
+)
+
+# 推理预算
+REASONING_TRUNCATED = Counter(
+    "deepclaude_reasoning_truncated_total",
+    "推理阶段因预算耗尽被截断的次数，按组合模型和原因(time/tokens)区分",
+    ("composite", "reason"),
+)
+
+# 推理模型故障转移
+REASONER_FAILOVERS = Counter(
+    "deepclaude_reasoner_failovers_total",
+    "推理模型在输出推理内容之前失败并转移到下一个提供商的次数，"
+    "按失败的推理模型和原因(connect/timeout/first_token_timeout/状态码)区分",
+    ("reasoner", "reason"),
+)
+REASONER_SELECTED = Counter(
+    "deepclaude_reasoner_selected_total",
+    "故障转移池中最终输出推理内容的推理模型次数",
+    ("reasoner",),
+)
+REASONER_EXHAUSTED = Counter(
+    "deepclaude_reasoner_exhausted_total",
+    "故障转移池中所有推理模型都失败的次数",
+)
+REASONER_HEDGES = Counter(
+    "deepclaude_reasoner_hedges_total",
+    "推理模型对冲请求次数，按对冲的推理模型和结果(sent/won/rate_limited)区分",
+    ("reasoner", "result"),
+)
+
+# 目标模型负载均衡
+TARGET_SELECTED = Counter(
+    "deepclaude_target_selected_total",
+    "目标模型负载均衡选中各提供商的次数",
+    ("target",),
+)
+TARGET_EJECTIONS = Counter(
+    "deepclaude_target_ejections_total",
+    "目标模型提供商因连续失败或错误率过高被暂时摘除的次数",
+    ("target",),
+)
+TARGET_OUTSTANDING = Gauge(
+    "deepclaude_target_outstanding_requests",
+    "目标模型提供商正在处理的请求数",
+    ("target",),
+)
+TARGET_LATENCY_EWMA_SECONDS = Gauge(
+    "deepclaude_target_latency_ewma_seconds",
+    "目标模型提供商首 token 耗时的指数加权平均(秒)",
+    ("target",),
+)
+TARGET_HEALTHY = Gauge(
+    "deepclaude_target_healthy",
+    "目标模型提供商的健康状态(1 正常，0 已被摘除且尚未成功恢复)",
+    ("target",),
+)
@@ -0,0 +1,106 @@
+"""请求阶段计时
+
+每个请求持有一个 PhaseTimer，在推理、衔接、目标模型等阶段的边界打点并写入直方图。
+逐 token 的打点只检查一个布尔标记，只有每个阶段的第一个 token 才会记录。
+"""
+
+import time
+from typing import Callable, Optional
+
+from app.utils.metrics import (
+    HANDOFF_GAP_SECONDS,
+    IN_FLIGHT_REQUESTS,
+    REASONER_TTFT_SECONDS,
+    REASONING_DURATION_SECONDS,
+    REQUEST_QUEUE_SECONDS,
+    STREAM_DURATION_SECONDS,
+    TARGET_TTFT_SECONDS,
+    TOKENS_STREAMED,
+)
+
+
+class PhaseTimer:
+    """一次请求的阶段计时器
+
+    Args:
+        composite: 组合模型名称
+        reasoner: 推理模型名称
+        target: 目标模型名称
+        received_at: 收到请求的时间(time.perf_counter)，None 表示当前时间
+        on_finish: 生成结束时的回调，参数为 (推理 token 数, 回答 token 数, 总耗时秒数)
+    """
+
+    def __init__(
+        self,
+        composite: str = "",
+        reasoner: str = "",
+        target: str = "",
+        received_at: Optional[float] = None,
+        on_finish: Optional[Callable[[int, int, float], None]] = None,
+    ):
+        self.labels = {"composite": composite, "reasoner": reasoner, "target": target}
+        self.received_at = time.perf_counter() if received_at is None else received_at
+        self.started_at: Optional[float] = None
+        self._reasoner_started_at: Optional[float] = None
+        self._reasoning_ended_at: Optional[float] = None
+        self._target_started_at: Optional[float] = None
+        self._reasoner_first_token = False
+        self._target_first_token = False
+        self._finished = False
+        self._on_finish = on_finish
+
+    def start(self) -> None:
+        """开始调用上游，记录排队时间"""
+        self.started_at = time.perf_counter()
+        REQUEST_QUEUE_SECONDS.observe(self.started_at - self.received_at, **self.labels)
+        IN_FLIGHT_REQUESTS.inc(composite=self.labels["composite"])
+
+    def reasoner_request(self) -> None:
+        """开始请求推理模型"""
+        self._reasoner_started_at = time.perf_counter()
+
+    def reasoner_token(self) -> None:
+        """收到推理内容，只记录第一个"""
+        if self._reasoner_first_token or self._reasoner_started_at is None:
+            return
+        self._reasoner_first_token = True
+        REASONER_TTFT_SECONDS.observe(time.perf_counter() - self._reasoner_started_at, **self.labels)
+
+    def reasoning_end(self) -> None:
+        """推理阶段结束"""
+        self._reasoning_ended_at = time.perf_counter()
+        if self._reasoner_started_at is not None:
+            REASONING_DURATION_SECONDS.observe(
+                self._reasoning_ended_at - self._reasoner_started_at, **self.labels
+            )
+
+    def target_request(self) -> None:
+        """开始请求目标模型，记录与推理结束之间的间隔"""
+        self._target_started_at = time.perf_counter()
+        if self._reasoning_ended_at is not None:
+            HANDOFF_GAP_SECONDS.observe(
+                self._target_started_at - self._reasoning_ended_at, **self.labels
+            )
+
+    def target_token(self) -> None:
+        """收到回答内容，只记录第一个"""
+        if self._target_first_token or self._target_started_at is None:
+            return
+        self._target_first_token = True
+        TARGET_TTFT_SECONDS.observe(time.perf_counter() - self._target_started_at, **self.labels)
+
+    def finish(self, reasoning_tokens: int = 0, answer_tokens: int = 0) -> None:
+        """生成结束(包括出错和下游断开)，记录总耗时和输出 token 数，重复调用只记录一次"""
+        if self._finished or self.started_at is None:
+            return
+        self._finished = True
+        composite = self.labels["composite"]
+        duration = time.perf_counter() - self.started_at
+        STREAM_DURATION_SECONDS.observe(duration, **self.labels)
+        IN_FLIGHT_REQUESTS.dec(composite=composite)
+        if reasoning_tokens:
+            TOKENS_STREAMED.inc(reasoning_tokens, composite=composite, stage="reasoner")
+        if answer_tokens:
+            TOKENS_STREAMED.inc(answer_tokens, composite=composite, stage="target")
+        if self._on_finish is not None:
+            self._on_finish(reasoning_tokens, answer_tokens, duration)
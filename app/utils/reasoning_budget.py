@@ -0,0 +1,143 @@
+"""推理预算: 限制推理阶段的耗时和 token 数
+
+推理模型(如 DeepSeek-R1)一次推理可能持续数分钟。组合模型可以配置推理预算，
+未配置时使用 system.reasoning_budget:
+
+    "reasoning_budget": {"max_seconds": 30, "max_tokens": 4000}
+
+任一限制达到后立即停止推理流，把已经得到的部分推理交给目标模型继续回答，
+并在目标模型的提示词和响应中标记推理被截断。
+"""
+
+import asyncio
+from typing import AsyncGenerator, Optional, Tuple
+
+from app.utils.logger import logger
+from app.utils.metrics import REASONING_TRUNCATED
+from app.utils.token_counter import TokenCounter
+
+# 截断原因
+TRUNCATED_BY_TIME = "time"
+TRUNCATED_BY_TOKENS = "tokens"
+
+# 推理被截断时附加在推理内容之后的提示
+_TRUNCATION_NOTES = {
+    TRUNCATED_BY_TIME: "time limit",
+    TRUNCATED_BY_TOKENS: "length limit",
+}
+
+
+class ReasoningBudget:
+    """一次请求的推理预算
+
+    Args:
+        max_seconds: 推理阶段的最长耗时(秒)，None 表示不限制
+        max_tokens: 推理内容的最大 token 数，None 表示不限制
+        composite: 组合模型名称，用于指标标签
+    """
+
+    def __init__(
+        self,
+        max_seconds: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+        composite: str = "",
+    ):
+        self.max_seconds = max_seconds if max_seconds and max_seconds > 0 else None
+        self.max_tokens = max_tokens if max_tokens and max_tokens > 0 else None
+        self.composite = composite
+        # 截断原因，未截断时为 None
+        self.truncated: Optional[str] = None
+
+    @classmethod
+    def from_config(
+        cls, composite: str, composite_config: dict, system_config: Optional[dict] = None
+    ) -> "ReasoningBudget":
+        """根据组合模型配置创建预算，组合模型未配置时使用系统配置
+
+        Args:
+            composite: 组合模型名称
+            composite_config: 组合模型配置
+            system_config: 系统配置
+
+        Returns:
+            ReasoningBudget: 推理预算，两项限制都未配置时不生效
+        """
+        config = composite_config.get("reasoning_budget")
+        if config is None:
+            config = (system_config or {}).get("reasoning_budget") or {}
+        return cls(config.get("max_seconds"), config.get("max_tokens"), composite)
+
+    @property
+    def enabled(self) -> bool:
+        """是否配置了任一限制"""
+        return self.max_seconds is not None or self.max_tokens is not None
+
+    def describe(self) -> str:
+        """预算说明，用于响应头"""
+        parts = []
+        if self.max_seconds is not None:
+            parts.append(f"max_seconds={self.max_seconds:g}")
+        if self.max_tokens is not None:
+            parts.append(f"max_tokens={self.max_tokens}")
+        return "; ".join(parts)
+
+    def prompt_note(self) -> str:
+        """推理被截断时附加在推理内容之后的说明，未截断时返回空字符串"""
+        if self.truncated is None:
+            return ""
+        return (
+            f"\n\n[The reasoning above was cut off by a {_TRUNCATION_NOTES[self.truncated]} and is incomplete. "
+            "Use the parts that are useful and complete the answer with your own knowledge.]"
+        )
+
+    def _truncate(self, reason: str, counter: TokenCounter) -> None:
+        self.truncated = reason
+        REASONING_TRUNCATED.inc(composite=self.composite, reason=reason)
+        logger.warning(
+            f"推理阶段超出预算({self.describe()})，已在 {counter.count} tokens 处截断，"
+            f"使用部分推理继续请求目标模型"
+        )
+
+    async def limit(
+        self, stream: AsyncGenerator[Tuple[str, str], None], counter: TokenCounter
+    ) -> AsyncGenerator[Tuple[str, str], None]:
+        """按预算转发推理流，超出预算时停止读取并关闭上游流
+
+        Args:
+            stream: 推理模型输出的 (content_type, content) 流
+            counter: 推理内容的 token 计数器，由调用方在收到推理内容时更新
+
+        Yields:
+            Tuple[str, str]: 与 stream 相同的事件
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_seconds if self.max_seconds is not None else None
+        try:
+            if not self.enabled:
+                async for item in stream:
+                    yield item
+                return
+
+            while True:
+                try:
+                    async with asyncio.timeout_at(deadline) as timeout:
+                        item = await anext(stream)
+                except StopAsyncIteration:
+                    return
+                except TimeoutError:
+                    # 上游自身的超时同样是 TimeoutError，只处理预算到期的情况
+                    if not timeout.expired():
+                        raise
+                    self._truncate(TRUNCATED_BY_TIME, counter)
+                    return
+                yield item
+                # 调用方处理完本次推理内容后再检查 token 数
+                if (
+                    self.max_tokens is not None
+                    and item[0] == "reasoning"
+                    and counter.count >= self.max_tokens
+                ):
+                    self._truncate(TRUNCATED_BY_TOKENS, counter)
+                    return
+        finally:
+            await stream.aclose()
@@ -0,0 +1,168 @@
+"""按请求管理上游流式任务，下游断开时统一取消"""
+
+import asyncio
+from typing import Any, Coroutine, Dict, List, Optional, Set, Tuple
+
+from app.utils.logger import logger
+from app.utils.metrics import (
+    ACTIVE_STREAMS,
+    CANCELLED_STREAMS,
+    STREAM_BUFFERED_BYTES,
+    STREAM_PEAK_BUFFERED_BYTES,
+    TOKENS_SAVED,
+)
+from app.utils.token_counter import TokenCounter
+
+# 持有正在退出的任务的强引用，避免任务在取消过程中被垃圾回收
+_background_tasks: Set[asyncio.Task] = set()
+
+# 按 (上游模型, 阶段) 统计的完整输出 token 数的指数加权平均，用于估算取消节省的 token；
+# 按模型区分，输出较短的模型不会拉低推理较长的模型的估算
+_expected_tokens: Dict[Tuple[str, str], float] = {}
+_EWMA_ALPHA = 0.2
+
+# 输出队列默认容量(帧)，可通过 system.stream_queue_size 覆盖
+DEFAULT_QUEUE_SIZE = 64
+
+
+class OutputQueue(asyncio.Queue):
+    """有界的流式输出队列，统计当前请求缓冲的字节数
+
+    队列满时生产者的 put 会等待，慢速客户端因此会反压上游的读取循环，
+    而不是把整个上游流堆积在内存中。
+    """
+
+    def __init__(self, maxsize: Optional[int] = None):
+        """初始化输出队列
+
+        Args:
+            maxsize: 队列容量(帧)，None 使用默认值，小于等于 0 表示不限制
+        """
+        super().__init__(DEFAULT_QUEUE_SIZE if maxsize is None else maxsize)
+        self.buffered_bytes = 0
+        self.peak_bytes = 0
+        self._closed = False
+        ACTIVE_STREAMS.inc()
+
+    @classmethod
+    def from_config(cls, system_config: dict) -> "OutputQueue":
+        """根据系统配置创建输出队列"""
+        return cls(system_config.get("stream_queue_size", DEFAULT_QUEUE_SIZE))
+
+    def _put(self, item):
+        if item:
+            size = len(item)
+            self.buffered_bytes += size
+            STREAM_BUFFERED_BYTES.inc(size)
+            if self.buffered_bytes > self.peak_bytes:
+                self.peak_bytes = self.buffered_bytes
+        super()._put(item)
+
+    def _get(self):
+        item = super()._get()
+        if item:
+            size = len(item)
+            self.buffered_bytes -= size
+            STREAM_BUFFERED_BYTES.dec(size)
+        return item
+
+    def close(self) -> None:
+        """请求结束时调用，释放统计中剩余的字节并记录峰值"""
+        if self._closed:
+            return
+        self._closed = True
+        STREAM_BUFFERED_BYTES.dec(self.buffered_bytes)
+        self.buffered_bytes = 0
+        ACTIVE_STREAMS.dec()
+        STREAM_PEAK_BUFFERED_BYTES.observe(self.peak_bytes)
+
+
+class StreamRecorder:
+    """记录一次生成的推理内容、回答内容和 token 用量
+
+    推理和回答都成功结束时 completed 为 True；推理被预算截断时 reasoning_truncated 为截断原因。
+    调用方只应缓存 cacheable 的结果。
+    """
+
+    def __init__(self):
+        """初始化记录器"""
+        self.reasoning_parts: List[str] = []
+        self.content_parts: List[str] = []
+        self.usage: Dict[str, Any] = {}
+        self.completed = False
+        self.reasoning_truncated: Optional[str] = None
+
+    @property
+    def cacheable(self) -> bool:
+        """结果完整且推理未被截断，可以写入缓存"""
+        return self.completed and self.reasoning_truncated is None
+
+
+class StreamTaskGroup:
+    """一个流式请求拥有的上游任务集合
+
+    每个阶段（如 reasoner、target）对应一个任务。请求正常结束或下游断开时调用
+    cancel()，未完成的任务会被立即取消，其上游 HTTP 响应随之关闭。
+    阶段已输出的 token 数直接读取该阶段的 TokenCounter。
+    """
+
+    def __init__(self):
+        """初始化任务集合"""
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._counters: Dict[str, Tuple[str, TokenCounter]] = {}
+        self._completed: Set[str] = set()
+
+    def create_task(
+        self, stage: str, coro: Coroutine, model: str = "", counter: Optional[TokenCounter] = None
+    ) -> asyncio.Task:
+        """为指定阶段创建任务
+
+        Args:
+            stage: 阶段名称
+            coro: 任务协程
+            model: 该阶段请求的上游模型，平均输出长度按模型分别统计
+            counter: 该阶段输出的 token 计数器，None 时不估算节省的 token
+
+        Returns:
+            asyncio.Task: 创建的任务
+        """
+        task = asyncio.create_task(coro)
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+        self._tasks[stage] = task
+        if counter is not None:
+            self._counters[stage] = (model, counter)
+        return task
+
+    def complete(self, stage: str) -> None:
+        """标记阶段完整结束，并更新该模型该阶段的平均输出长度"""
+        self._completed.add(stage)
+        if stage not in self._counters:
+            return
+        model, counter = self._counters[stage]
+        tokens = counter.count
+        previous = _expected_tokens.get((model, stage))
+        if previous is None:
+            _expected_tokens[(model, stage)] = float(tokens)
+        else:
+            _expected_tokens[(model, stage)] = previous + _EWMA_ALPHA * (tokens - previous)
+
+    def cancel(self) -> None:
+        """取消所有未完成的任务
+
+        该方法是同步的，可以在已被取消的生成器 finally 中安全调用；
+        任务的清理（关闭上游响应）在后台完成。
+        """
+        for stage, task in self._tasks.items():
+            if task.done():
+                continue
+            task.cancel()
+            if stage in self._completed:
+                continue
+            CANCELLED_STREAMS.inc(stage=stage)
+            if stage not in self._counters:
+                continue
+            model, counter = self._counters[stage]
+            saved = max(_expected_tokens.get((model, stage), 0.0) - counter.count, 0.0)
+            TOKENS_SAVED.inc(saved, stage=stage)
+            logger.info(f"下游连接已断开，取消 {stage} 上游流，估算节省 {saved:.0f} tokens")
@@ -0,0 +1,197 @@
+"""token 计数
+
+- 编码器按 tiktoken 编码名称缓存，每个进程只加载一次，首次加载在工作线程中进行
+- TokenCounter 支持按流式分片增量计数，分片边界处的文本会暂缓提交，保证与整体编码结果一致
+- 较长的文本在工作线程中编码，避免阻塞事件循环
+- 编码文件无法加载时(例如离线部署)退化为按字符估算
+"""
+
+import asyncio
+from typing import Any, Dict, Iterable, Optional
+
+import tiktoken
+
+from app.utils.logger import logger
+
+# 非 OpenAI 模型(Claude、DeepSeek、Gemini 等)统一按 gpt-4o 的编码估算
+DEFAULT_ENCODING = "o200k_base"
+
+# 超过该长度(字符)的文本在工作线程中编码
+THREAD_THRESHOLD = 8192
+
+
+# 已加载的编码器，值为 None 表示加载失败
+_encodings: Dict[str, Optional[tiktoken.Encoding]] = {}
+
+
+def _load_encoding(name: str) -> Optional[tiktoken.Encoding]:
+    """加载并缓存编码器，加载失败时缓存 None，避免每个请求重复下载"""
+    if name in _encodings:
+        return _encodings[name]
+    try:
+        encoding = tiktoken.get_encoding(name)
+    except Exception as e:
+        logger.warning(f"加载 tiktoken 编码 {name} 失败，token 数将按字符估算: {e}")
+        encoding = None
+    _encodings[name] = encoding
+    return encoding
+
+
+def encoding_name_for_model(model: str) -> str:
+    """获取模型对应的编码名称，未知模型使用 DEFAULT_ENCODING"""
+    try:
+        return tiktoken.encoding_name_for_model(model)
+    except KeyError:
+        return DEFAULT_ENCODING
+
+
+def get_encoding(model: str = "gpt-4o") -> Optional[tiktoken.Encoding]:
+    """获取模型对应的编码器(同步，首次调用可能需要读取或下载编码文件)"""
+    return _load_encoding(encoding_name_for_model(model))
+
+
+async def get_encoding_async(model: str = "gpt-4o") -> Optional[tiktoken.Encoding]:
+    """获取模型对应的编码器，首次加载在工作线程中进行"""
+    name = encoding_name_for_model(model)
+    if name in _encodings:
+        return _encodings[name]
+    return await asyncio.to_thread(_load_encoding, name)
+
+
+def estimate_tokens(text: str) -> int:
+    """无编码器时的估算：ASCII 约 4 个字符一个 token，其他字符各算一个 token"""
+    ascii_chars = sum(1 for char in text if char < "\x80")
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def _encode_length(encoding: Optional[tiktoken.Encoding], text: str) -> int:
+    if not text:
+        return 0
+    if encoding is None:
+        return estimate_tokens(text)
+    # 模型输出中可能包含 <|endoftext|> 等特殊标记文本，按普通文本计数
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    """同步计算文本的 token 数"""
+    return _encode_length(get_encoding(model), text)
+
+
+async def count_tokens_async(text: str, model: str = "gpt-4o") -> int:
+    """计算文本的 token 数，长文本在工作线程中编码"""
+    encoding = await get_encoding_async(model)
+    if len(text) > THREAD_THRESHOLD:
+        return await asyncio.to_thread(_encode_length, encoding, text)
+    return _encode_length(encoding, text)
+
+
+def messages_text(messages: Iterable[Dict[str, Any]]) -> str:
+    """拼接消息内容用于计数，非字符串内容(如多模态)只计算其中的文本部分"""
+    parts = []
+    for message in messages:
+        content = message.get("content", "")
+        if isinstance(content, list):
+            content = "".join(
+                item.get("text", "") for item in content if isinstance(item, dict)
+            )
+        parts.append(content or "")
+    return "\n".join(parts)
+
+
+def build_usage(prompt_tokens: int, completion_tokens: int, reasoning_tokens: int = 0) -> Dict[str, Any]:
+    """构造 OpenAI 格式的 usage
+
+    Args:
+        prompt_tokens: 目标模型的输入 token 数(包含注入的推理内容)
+        completion_tokens: 目标模型输出的回答 token 数
+        reasoning_tokens: 推理模型输出的推理 token 数
+
+    Returns:
+        Dict[str, Any]: usage 字典
+    """
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "reasoning_tokens": reasoning_tokens,
+    }
+
+
+def resolve_usage(
+    upstream: Dict[str, int], prompt_tokens: int, completion_tokens: int, reasoning_tokens: int
+) -> Dict[str, Any]:
+    """优先使用上游报告的用量，缺失的部分使用本地计数
+
+    Args:
+        upstream: 上游报告的用量，可能只包含部分字段
+        prompt_tokens: 本地计算的目标模型输入 token 数
+        completion_tokens: 本地计算的回答 token 数
+        reasoning_tokens: 本地计算的推理 token 数
+
+    Returns:
+        Dict[str, Any]: usage 字典
+    """
+    return build_usage(
+        upstream.get("prompt_tokens", prompt_tokens),
+        upstream.get("completion_tokens", completion_tokens),
+        upstream.get("reasoning_tokens", reasoning_tokens),
+    )
+
+
+class TokenCounter:
+    """流式输出的增量 token 计数器
+
+    tiktoken 先按空白等规则切分文本再做 BPE，新到达的文本只可能改变最后一个片段的编码结果。
+    因此每次只提交最后一个“非空白字符后紧跟空白”位置之前的文本，剩余部分暂缓到下一个分片。
+    没有空白的长文本(如中文)超过 MAX_PENDING_CHARS 后保留末尾少量字符并强制提交，
+    误差最多为每次提交一个 token。
+
+    Args:
+        encoding: 编码器，为 None 时按字符估算
+    """
+
+    # 暂缓文本的最大长度(字符)
+    MAX_PENDING_CHARS = 256
+    # 强制提交时保留的末尾字符数
+    FORCED_TAIL_CHARS = 16
+
+    def __init__(self, encoding: Optional[tiktoken.Encoding] = None):
+        self._encoding = encoding
+        self._pending = ""
+        self._committed = 0
+
+    @classmethod
+    async def create(cls, model: str = "gpt-4o") -> "TokenCounter":
+        """创建计数器，编码器首次加载在工作线程中进行"""
+        return cls(await get_encoding_async(model))
+
+    def add(self, text: str) -> None:
+        """追加一个输出分片"""
+        if not text:
+            return
+        pending = self._pending + text
+        boundary = self._last_boundary(pending)
+        if boundary <= 0:
+            if len(pending) <= self.MAX_PENDING_CHARS:
+                self._pending = pending
+                return
+            boundary = len(pending) - self.FORCED_TAIL_CHARS
+        self._committed += _encode_length(self._encoding, pending[:boundary])
+        self._pending = pending[boundary:]
+
+    @property
+    def count(self) -> int:
+        """当前累计的 token 数"""
+        return self._committed + _encode_length(self._encoding, self._pending)
+
+    @staticmethod
+    def _last_boundary(text: str) -> int:
+        """查找最后一个非空白字符之后紧跟空白字符的位置，找不到时返回 0"""
+        index = len(text) - 1
+        while index > 0:
+            if text[index].isspace() and not text[index - 1].isspace():
+                return index
+            index -= 1
+        return 0
+
@@ -0,0 +1,72 @@
+"""API 密钥验证的微基准
+
+运行方式（在项目根目录）:
+    python -m benchmarks.bench_auth
+
+在内存中配置不同数量的租户，测量 verify_api_key 对有效租户密钥、管理员密钥、无效密钥和
+缺少 Authorization header 的单次耗时。密钥索引按摘要查表，耗时应与租户数量无关；
+与正确密钥前缀相同的无效密钥和完全随机的无效密钥耗时也应相同。
+"""
+
+import asyncio
+import logging
+import secrets
+import time
+
+from fastapi import HTTPException
+
+from app.tenants import tenants
+from app.utils.auth import verify_api_key
+from app.utils.logger import logger
+
+ADMIN_KEY = "bench-admin-" + secrets.token_hex(16)
+
+
+def build_system_config(tenant_count: int) -> dict:
+    """生成包含 tenant_count 个租户的系统配置"""
+    return {
+        "api_key": ADMIN_KEY,
+        "tenants": {
+            f"tenant-{i}": {"api_key": f"bench-tenant-{i}-" + secrets.token_hex(16), "rpm": 0}
+            for i in range(tenant_count)
+        },
+    }
+
+
+async def measure(authorization, iterations: int) -> float:
+    """返回单次验证的平均耗时(微秒)"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        try:
+            await verify_api_key(authorization)
+        except HTTPException:
+            pass
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+async def benchmark(iterations: int = 100_000) -> None:
+    """测量不同租户数量下各种密钥的验证耗时"""
+    for tenant_count in (1, 100, 10_000):
+        system_config = build_system_config(tenant_count)
+        start = time.perf_counter()
+        tenants.configure(system_config)
+        rebuild_ms = (time.perf_counter() - start) * 1000
+
+        tenant_key = system_config["tenants"][f"tenant-{tenant_count - 1}"]["api_key"]
+        scenarios = {
+            "租户密钥": f"Bearer {tenant_key}",
+            "管理员密钥": f"Bearer {ADMIN_KEY}",
+            "无效密钥(相同前缀)": f"Bearer {tenant_key[:-1]}x",
+            "无效密钥(随机)": f"Bearer {secrets.token_hex(len(tenant_key) // 2)}",
+            "缺少 header": None,
+        }
+        print(f"[bench] {tenant_count} 个租户，重建索引 {rebuild_ms:.1f}ms")
+        for name, authorization in scenarios.items():
+            elapsed_us = await measure(authorization, iterations)
+            print(f"[bench]   {name:<12} {elapsed_us:.2f}us/次")
+
+
+if __name__ == "__main__":
+    # 无效密钥的采样日志不计入耗时
+    logger.setLevel(logging.ERROR)
+    asyncio.run(benchmark())
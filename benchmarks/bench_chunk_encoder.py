@@ -0,0 +1,62 @@
+"""SSE chunk 编码基准: 逐 token 构造字典 + json.dumps 与预渲染模板的对比
+
+运行方式（在项目根目录）:
+    python -m benchmarks.bench_chunk_encoder
+"""
+
+import json
+import time
+
+from app.utils import chunk_encoder
+from app.utils.chunk_encoder import ChunkEncoder
+
+CHAT_ID = "chatcmpl-19a2b3c4d5e"
+CREATED = 1740268800
+REASONER = "deepseek-reasoner"
+TARGET = "claude-3-7-sonnet-20250219"
+TOKENS = ["The", " answer", " is", " 42", "。", "嗯", "，", "\n", ' "quoted"', " token"] * 20_000
+
+
+def legacy_frame(content: str) -> bytes:
+    """原有实现: 每个 token 构造完整字典并序列化"""
+    response = {
+        "id": CHAT_ID,
+        "object": "chat.completion.chunk",
+        "created": CREATED,
+        "model": TARGET,
+        "choices": [
+            {
+                "index": 0,
+                "delta": {"role": "assistant", "content": content},
+            }
+        ],
+    }
+    return f"data: {json.dumps(response)}\n\n".encode("utf-8")
+
+
+def run(name: str, encode) -> float:
+    """编码全部 token 并返回每秒帧数"""
+    start = time.perf_counter()
+    for token in TOKENS:
+        encode(token)
+    rate = len(TOKENS) / (time.perf_counter() - start)
+    print(f"{name:<28} {rate:>14,.0f} frames/s")
+    return rate
+
+
+def main() -> None:
+    encoder = ChunkEncoder(CHAT_ID, CREATED, REASONER, TARGET)
+
+    # 先校验两种实现输出的 JSON 语义一致
+    for token in set(TOKENS):
+        assert json.loads(encoder.answer(token)[6:]) == json.loads(legacy_frame(token)[6:])
+
+    baseline = run("dict + json.dumps", legacy_frame)
+    backend = "orjson" if chunk_encoder.orjson is not None else "stdlib"
+    fast = run(f"ChunkEncoder ({backend})", encoder.answer)
+    python = run("ChunkEncoder (stdlib)", lambda t: encoder._answer_prefix + chunk_encoder._escape_python(t) + encoder._answer_suffix)
+    print(f"加速比: {fast / baseline:.1f}x (标准库后端 {python / baseline:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
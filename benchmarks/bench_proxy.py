@@ -0,0 +1,377 @@
+"""端到端基准: 测量代理自身带来的开销
+
+模拟上游和 app.main:app 各自运行在独立进程中，本进程按指定并发发送流式请求，统计:
+- 代理增加的首 token 延迟: 经代理的首 token 延迟减去直连模拟上游的首 token 延迟
+- 每秒帧数: 客户端收到的 SSE 帧总数 / 总耗时
+- 每 token CPU: 服务进程消耗的 CPU 时间 / 输出的 token 总数
+- 服务进程 RSS: 运行期间的起始值和峰值
+
+结果写入 JSON，便于跨版本对比。
+
+运行方式（在项目根目录）:
+    python -m benchmarks.bench_proxy --concurrency 50 --requests 500 --output results.json
+    python -m benchmarks.bench_proxy --composite deepclaude --token-rate 200 --first-token-latency 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+from benchmarks import mock_upstream
+
+API_KEY = "bench-key"
+
+# 组合模型名称 -> (目标模型配置名, 说明)
+COMPOSITES = {
+    "deepclaude": "bench-anthropic",
+    "openai": "bench-openai",
+}
+
+
+def free_port() -> int:
+    """获取一个空闲端口"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def build_config(upstream_url: str, log_level: str) -> Dict[str, Any]:
+    """生成指向模拟上游的模型配置，关闭缓存和请求合并，保证每个请求都真实经过上游"""
+    return {
+        "reasoner_models": {
+            "bench-reasoner": {
+                "model_id": "bench-reasoner",
+                "api_key": "mock",
+                "api_base_url": upstream_url,
+                "api_request_address": "deepseek/v1/chat/completions",
+                "is_origin_reasoning": True,
+                "is_valid": True,
+                "proxy_open": False,
+            }
+        },
+        "target_models": {
+            "bench-anthropic": {
+                "model_id": "bench-claude",
+                "api_key": "mock",
+                "api_base_url": upstream_url,
+                "api_request_address": "anthropic/v1/messages",
+                "model_format": "anthropic",
+                "is_valid": True,
+                "proxy_open": False,
+            },
+            "bench-openai": {
+                "model_id": "bench-openai",
+                "api_key": "mock",
+                "api_base_url": upstream_url,
+                "api_request_address": "openai/v1/chat/completions",
+                "model_format": "openai",
+                "is_valid": True,
+                "proxy_open": False,
+            },
+        },
+        "proxy": {"proxy_open": False, "proxy_address": ""},
+        "system": {
+            "allow_origins": ["*"],
+            "log_level": log_level,
+            "api_key": API_KEY,
+            "single_flight": False,
+            "reasoning_cache": {"enabled": False},
+        },
+        "composite_models": {
+            name: {
+                "model_id": name,
+                "reasoner_models": "bench-reasoner",
+                "target_models": target,
+                "is_valid": True,
+                "response_cache": False,
+            }
+            for name, target in COMPOSITES.items()
+        },
+    }
+
+
+class ProcessSampler:
+    """通过 /proc 采样子进程的 CPU 时间和 RSS，非 Linux 平台返回 None"""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.clock_ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+        self.page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+    def cpu_seconds(self) -> Optional[float]:
+        """用户态加内核态 CPU 时间(秒)"""
+        try:
+            with open(f"/proc/{self.pid}/stat") as f:
+                # 进程名可能包含空格，从右括号之后开始切分
+                fields = f.read().rsplit(")", 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / self.clock_ticks
+        except (OSError, IndexError, ValueError):
+            return None
+
+    def rss_bytes(self) -> Optional[int]:
+        """常驻内存(字节)"""
+        try:
+            with open(f"/proc/{self.pid}/statm") as f:
+                return int(f.read().split()[1]) * self.page_size
+        except (OSError, IndexError, ValueError):
+            return None
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """计算分位数(最近秩)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarize(values: List[float]) -> Dict[str, Optional[float]]:
+    """以毫秒为单位汇总延迟"""
+    return {
+        name: None if value is None else round(value * 1000, 3)
+        for name, value in (
+            ("p50_ms", percentile(values, 0.5)),
+            ("p95_ms", percentile(values, 0.95)),
+            ("p99_ms", percentile(values, 0.99)),
+            ("mean_ms", sum(values) / len(values) if values else None),
+        )
+    }
+
+
+def has_token(line: bytes) -> bool:
+    """判断 SSE 帧是否携带了推理或回答内容，角色帧等不计入首 token"""
+    try:
+        choices = json.loads(line[5:]).get("choices") or [{}]
+    except ValueError:
+        return False
+    delta = choices[0].get("delta") or {}
+    return bool(delta.get("reasoning_content") or delta.get("content"))
+
+
+async def stream_once(
+    session: aiohttp.ClientSession, url: str, payload: dict, headers: dict
+) -> Dict[str, Any]:
+    """发送一次流式请求，记录首 token 延迟、帧数和总耗时"""
+    started = time.perf_counter()
+    ttft = None
+    frames = 0
+    try:
+        async with session.post(url, json=payload, headers=headers) as response:
+            if response.status != 200:
+                await response.read()
+                return {"ok": False, "status": response.status}
+            async for line in response.content:
+                if not line.startswith(b"data:"):
+                    continue
+                if ttft is None and has_token(line):
+                    ttft = time.perf_counter() - started
+                frames += 1
+    except aiohttp.ClientError as e:
+        return {"ok": False, "status": type(e).__name__}
+    return {"ok": True, "ttft": ttft, "frames": frames, "duration": time.perf_counter() - started}
+
+
+async def run_load(
+    url: str,
+    make_payload,
+    headers: dict,
+    concurrency: int,
+    total: int,
+    sampler: Optional[ProcessSampler] = None,
+) -> Dict[str, Any]:
+    """以固定并发发送 total 个请求
+
+    Args:
+        url: 请求地址
+        make_payload: 根据请求序号生成请求体的函数
+        headers: 请求头
+        concurrency: 并发数
+        total: 请求总数
+        sampler: 被测进程采样器，None 表示不采样
+
+    Returns:
+        Dict[str, Any]: 原始结果和采样数据
+    """
+    indexes = iter(range(total))
+    results: List[Dict[str, Any]] = []
+    rss_samples: List[int] = []
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=300)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+
+        async def worker():
+            for index in indexes:
+                results.append(await stream_once(session, url, make_payload(index), headers))
+
+        async def sample():
+            while True:
+                rss = sampler.rss_bytes()
+                if rss is not None:
+                    rss_samples.append(rss)
+                await asyncio.sleep(0.2)
+
+        sampling = asyncio.create_task(sample()) if sampler else None
+        cpu_before = sampler.cpu_seconds() if sampler else None
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        cpu_after = sampler.cpu_seconds() if sampler else None
+        if sampling:
+            sampling.cancel()
+
+    cpu = None if cpu_before is None or cpu_after is None else cpu_after - cpu_before
+    return {"results": results, "elapsed": elapsed, "cpu_seconds": cpu, "rss_samples": rss_samples}
+
+
+def report(load: Dict[str, Any], tokens_per_request: int) -> Dict[str, Any]:
+    """把一次压测的原始数据汇总为报告"""
+    ok = [result for result in load["results"] if result["ok"]]
+    errors: Dict[str, int] = {}
+    for result in load["results"]:
+        if not result["ok"]:
+            errors[str(result["status"])] = errors.get(str(result["status"]), 0) + 1
+    frames = sum(result["frames"] for result in ok)
+    tokens = tokens_per_request * len(ok)
+    elapsed = load["elapsed"]
+    summary = {
+        "requests": len(load["results"]),
+        "succeeded": len(ok),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(len(ok) / elapsed, 2) if elapsed else None,
+        "frames": frames,
+        "frames_per_s": round(frames / elapsed, 1) if elapsed else None,
+        "ttft": summarize([result["ttft"] for result in ok if result["ttft"] is not None]),
+        "duration": summarize([result["duration"] for result in ok]),
+    }
+    if load["cpu_seconds"] is not None:
+        summary["cpu_seconds"] = round(load["cpu_seconds"], 3)
+        summary["cpu_us_per_token"] = round(load["cpu_seconds"] / tokens * 1e6, 3) if tokens else None
+    if load["rss_samples"]:
+        summary["rss_start_mb"] = round(load["rss_samples"][0] / 2**20, 1)
+        summary["rss_peak_mb"] = round(max(load["rss_samples"]) / 2**20, 1)
+    return summary
+
+
+def git_revision() -> Optional[str]:
+    """当前代码版本，便于对比不同版本的结果"""
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def start_app(config: Dict[str, Any], port: int):
+    """在子进程中启动 app.main:app"""
+    config_file = tempfile.NamedTemporaryFile("w", suffix=".json", delete=False, encoding="utf-8")
+    with config_file:
+        json.dump(config, config_file)
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "benchmarks.serve_app", "--config", config_file.name, "--port", str(port),
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    await mock_upstream.wait_for_port(port, timeout=30)
+    return process, config_file.name
+
+
+async def main(args: argparse.Namespace) -> Dict[str, Any]:
+    upstream_url, upstream = await mock_upstream.start_subprocess(
+        mock_upstream.upstream_argv(args), free_port()
+    )
+    app_port = free_port()
+    app, config_path = await start_app(build_config(upstream_url, args.log_level), app_port)
+    sampler = ProcessSampler(app.pid)
+    composites = list(COMPOSITES) if args.composite == "all" else [args.composite]
+
+    def prompt(index: int) -> List[Dict[str, str]]:
+        # 每个请求内容不同，避免被任何缓存或合并机制命中
+        return [{"role": "user", "content": f"benchmark request {index}"}]
+
+    try:
+        # 基线: 直连模拟上游的推理接口
+        baseline = await run_load(
+            f"{upstream_url}/deepseek/v1/chat/completions",
+            lambda index: {"model": "bench-reasoner", "messages": prompt(index), "stream": True},
+            {},
+            args.concurrency,
+            args.requests,
+        )
+        baseline_report = report(baseline, args.reasoning_tokens)
+
+        # 预热: 建立连接池、加载编码器等一次性开销不计入结果
+        await run_load(
+            f"http://127.0.0.1:{app_port}/v1/chat/completions",
+            lambda index: {"model": composites[0], "messages": prompt(-index - 1), "stream": True},
+            {"Authorization": f"Bearer {API_KEY}"},
+            min(args.concurrency, 4),
+            min(args.requests, 4),
+        )
+
+        scenarios = {}
+        for composite in composites:
+            load = await run_load(
+                f"http://127.0.0.1:{app_port}/v1/chat/completions",
+                lambda index, composite=composite: {
+                    "model": composite,
+                    "messages": prompt(index),
+                    "stream": True,
+                },
+                {"Authorization": f"Bearer {API_KEY}"},
+                args.concurrency,
+                args.requests,
+                sampler,
+            )
+            scenario = report(load, args.reasoning_tokens + args.answer_tokens)
+            scenario["proxy_added_ttft"] = {
+                key: None
+                if scenario["ttft"][key] is None or baseline_report["ttft"][key] is None
+                else round(scenario["ttft"][key] - baseline_report["ttft"][key], 3)
+                for key in ("p50_ms", "p95_ms", "p99_ms", "mean_ms")
+            }
+            scenarios[composite] = scenario
+    finally:
+        for process in (app, upstream):
+            process.terminate()
+            await process.wait()
+        os.unlink(config_path)
+
+    result = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "params": vars(args),
+        "baseline": baseline_report,
+        "scenarios": scenarios,
+    }
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="端到端代理开销基准")
+    parser.add_argument("--composite", choices=[*COMPOSITES, "all"], default="all")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=200, help="每个场景的请求总数")
+    parser.add_argument("--log-level", default="INFO", help="被测服务的日志级别")
+    parser.add_argument("--output", help="结果 JSON 文件路径")
+    mock_upstream.add_arguments(parser)
+    args = parser.parse_args()
+
+    result = asyncio.run(main(args))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,110 @@
+"""SSE 解码器的正确性校验和微基准
+
+运行方式（在项目根目录）:
+    python -m benchmarks.bench_sse_parser
+
+1. 模糊校验: 将录制的 DeepSeek/Anthropic/OpenAI 兼容流在每一个字节位置切分，
+   确认解析结果与整体解析一致，包括 CRLF 被截断、多字节 UTF-8 字符被截断等情况。
+2. 微基准: 以不同分块大小输入大流量数据，输出每秒解析的事件数。
+"""
+
+import json
+import random
+import time
+
+from app.clients.sse_parser import SSEDecoder, SSEEvent
+
+# 录制的上游流片段
+DEEPSEEK_STREAM = (
+    b'data: {"choices":[{"delta":{"reasoning_content":"\xe5\x97\xaf\xef\xbc\x8c\xe7\x94\xa8\xe6\x88\xb7"}}]}\n\n'
+    b'data: {"choices":[{"delta":{"reasoning_content":" asks"}}]}\n\n'
+    b': keep-alive\n\n'
+    b'data: {"choices":[{"delta":{"content":"ok","reasoning_content":null}}]}\n\n'
+    b"data: [DONE]\n\n"
+)
+ANTHROPIC_STREAM = (
+    b"event: message_start\r\n"
+    b'data: {"type":"message_start","message":{"usage":{"input_tokens":12}}}\r\n\r\n'
+    b"event: content_block_delta\r\n"
+    b'data: {"type":"content_block_delta","delta":{"type":"text_delta","text":"Hello"}}\r\n\r\n'
+    b"event: ping\r\n"
+    b'data: {"type": "ping"}\r\n\r\n'
+    b"event: message_stop\r\n"
+    b'data: {"type":"message_stop"}\r\n\r\n'
+)
+OPENAI_STREAM = (
+    b'id: 1\ndata: {"choices":[{"delta":{"content":"multi"}}]}\n\n'
+    b'data: {"choices":[{"delta":\ndata: {"content":"line"}}]}\n\n'
+    b'data:{"choices":[{"delta":{},"finish_reason":"stop"}]}\r\r'
+    b"data: [DONE]"
+)
+
+
+def decode_all(chunks) -> list:
+    """按给定分块解析整个流"""
+    decoder = SSEDecoder()
+    events = []
+    for chunk in chunks:
+        events.extend(decoder.feed(chunk))
+    events.extend(decoder.flush())
+    return events
+
+
+def fuzz_check() -> None:
+    """在每个字节位置切分录制流，校验解析结果不变"""
+    for name, stream in (
+        ("deepseek", DEEPSEEK_STREAM),
+        ("anthropic", ANTHROPIC_STREAM),
+        ("openai", OPENAI_STREAM),
+    ):
+        expected = decode_all([stream])
+        assert expected, f"{name}: 没有解析出事件"
+        # 单点切分
+        for offset in range(len(stream) + 1):
+            got = decode_all([stream[:offset], stream[offset:]])
+            assert got == expected, f"{name}: 在偏移 {offset} 处切分后结果不一致"
+        # 逐字节输入
+        assert decode_all([stream[i:i + 1] for i in range(len(stream))]) == expected
+        # 随机多点切分
+        rng = random.Random(0)
+        for _ in range(500):
+            cuts = sorted(rng.sample(range(1, len(stream)), 5))
+            parts = [stream[a:b] for a, b in zip([0] + cuts, cuts + [len(stream)])]
+            assert decode_all(parts) == expected, f"{name}: 随机切分 {cuts} 结果不一致"
+        print(f"[fuzz] {name}: {len(expected)} 个事件，{len(stream) + 1} 个切分点全部通过")
+
+    # 多行 data 字段与 event 字段
+    events = decode_all([OPENAI_STREAM])
+    assert events[0] == SSEEvent("message", '{"choices":[{"delta":{"content":"multi"}}]}', "1")
+    assert json.loads(events[1].data)["choices"][0]["delta"]["content"] == "line"
+    assert decode_all([ANTHROPIC_STREAM])[1].event == "content_block_delta"
+
+
+def benchmark(total_events: int = 200_000) -> None:
+    """测量不同分块大小下的解析吞吐量"""
+    frame = b'data: {"choices":[{"index":0,"delta":{"reasoning_content":"token"}}]}\n\n'
+    payload = frame * total_events
+    for chunk_size in (64, 1024, 16384):
+        chunks = [payload[i:i + chunk_size] for i in range(0, len(payload), chunk_size)]
+        decoder = SSEDecoder()
+        count = 0
+        start = time.perf_counter()
+        for chunk in chunks:
+            count += len(decoder.feed(chunk))
+        count += len(decoder.flush())
+        elapsed = time.perf_counter() - start
+        assert count == total_events
+        print(f"[bench] 分块 {chunk_size:>5} 字节: {count / elapsed:,.0f} events/s")
+
+    # 单个超长 data 行被拆成大量小块时，耗时应与长度成线性关系
+    for size in (100_000, 400_000):
+        line = b"data: " + b"x" * size + b"\n\n"
+        chunks = [line[i:i + 16] for i in range(0, len(line), 16)]
+        start = time.perf_counter()
+        decode_all(chunks)
+        print(f"[bench] {size:>7} 字节单行 16 字节分块: {time.perf_counter() - start:.3f}s")
+
+
+if __name__ == "__main__":
+    fuzz_check()
+    benchmark()
@@ -0,0 +1,131 @@
+"""慢速客户端负载测试: 验证有界输出队列下内存保持平稳
+
+运行方式（在项目根目录）:
+    python -m benchmarks.load_slow_reader --concurrency 200 --queue-size 64
+    python -m benchmarks.load_slow_reader --concurrency 200 --queue-size 0   # 不限制队列，对比内存增长
+
+模拟上游在独立进程中尽快输出大量 token，客户端每读取一帧休眠一段时间。
+测试期间定期采样本进程 RSS 和所有请求缓冲的字节数。
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import socket
+import time
+
+from app.clients import session_pool
+from app.utils.logger import logger
+from app.openai_composite import OpenAICompatibleComposite
+from app.utils.metrics import STREAM_BUFFERED_BYTES
+from benchmarks import mock_upstream
+
+
+
+def rss_bytes() -> int:
+    """读取当前进程的常驻内存"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # 非 Linux 平台退化为峰值 RSS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def free_port() -> int:
+    """获取一个空闲端口"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def start_mock_upstream(args: argparse.Namespace):
+    """在子进程中启动模拟上游，等待端口可用"""
+    return await mock_upstream.start_subprocess(
+        [
+            "--reasoning-tokens", str(args.tokens),
+            "--answer-tokens", str(args.tokens),
+            "--token-text", "x" * args.token_size,
+        ],
+        free_port(),
+    )
+
+
+async def slow_reader(composite: OpenAICompatibleComposite, delay: float, duration: float) -> int:
+    """以固定间隔读取流式输出，到达时长后断开"""
+    frames = 0
+    deadline = time.monotonic() + duration
+    stream = composite.chat_completions_with_stream(
+        [{"role": "user", "content": "hi"}], (0.5, 0.9, 0.0, 0.0), "mock-reasoner", "mock-target"
+    )
+    try:
+        async for _ in stream:
+            frames += 1
+            if time.monotonic() > deadline:
+                break
+            await asyncio.sleep(delay)
+    finally:
+        await stream.aclose()
+    return frames
+
+
+async def main(args: argparse.Namespace) -> None:
+    logger.setLevel(logging.WARNING)
+    base_url, upstream = await start_mock_upstream(args)
+    composite = OpenAICompatibleComposite(
+        "mock-key",
+        "mock-key",
+        f"{base_url}/deepseek/v1/chat/completions",
+        f"{base_url}/openai/v1/chat/completions",
+        system_config={"stream_queue_size": args.queue_size},
+    )
+
+    samples = []
+    readers = [
+        asyncio.create_task(slow_reader(composite, args.read_delay, args.duration))
+        for _ in range(args.concurrency)
+    ]
+    start = time.monotonic()
+    while not all(reader.done() for reader in readers):
+        samples.append({
+            "t": round(time.monotonic() - start, 2),
+            "rss_mb": round(rss_bytes() / 2**20, 1),
+            "buffered_mb": round(STREAM_BUFFERED_BYTES.get() / 2**20, 2),
+        })
+        print(f"t={samples[-1]['t']:>6}s rss={samples[-1]['rss_mb']:>8} MB buffered={samples[-1]['buffered_mb']:>8} MB")
+        await asyncio.sleep(args.sample_interval)
+
+    frames = sum(reader.result() for reader in readers)
+    await session_pool.close()
+    upstream.terminate()
+    await upstream.wait()
+
+    first, last = samples[1] if len(samples) > 1 else samples[0], samples[-1]
+    result = {
+        "queue_size": args.queue_size,
+        "concurrency": args.concurrency,
+        "frames_read": frames,
+        "rss_growth_mb": round(last["rss_mb"] - first["rss_mb"], 1),
+        "peak_buffered_mb": max(sample["buffered_mb"] for sample in samples),
+        "samples": samples,
+    }
+    print(json.dumps({k: v for k, v in result.items() if k != "samples"}, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="慢速客户端负载测试")
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--queue-size", type=int, default=64, help="输出队列容量，0 表示不限制")
+    parser.add_argument("--tokens", type=int, default=20000, help="推理和回答各自的 token 数")
+    parser.add_argument("--token-size", type=int, default=32, help="每个 token 的字节数")
+    parser.add_argument("--read-delay", type=float, default=0.01, help="客户端每帧的读取间隔(秒)")
+    parser.add_argument("--duration", type=float, default=10.0, help="每个客户端的读取时长(秒)")
+    parser.add_argument("--sample-interval", type=float, default=1.0)
+    parser.add_argument("--output", help="结果 JSON 文件路径")
+    asyncio.run(main(parser.parse_args()))
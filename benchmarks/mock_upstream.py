@@ -0,0 +1,264 @@
+"""本地模拟上游，用于基准测试和负载测试
+
+提供三种 SSE 流式接口，输出的 token 数量、速率、首 token 延迟和分帧方式都可以配置:
+- /deepseek/v1/chat/completions: DeepSeek 风格，先输出 reasoning_content 再输出 content
+- /anthropic/v1/messages: Anthropic 风格，content_block_delta 事件
+- /openai/v1/chat/completions: OpenAI 兼容风格
+
+独立运行:
+    python -m benchmarks.mock_upstream --port 18080 --reasoning-tokens 500 --token-rate 100
+"""
+
+import asyncio
+import json
+import sys
+from typing import Iterator, List, Optional, Tuple
+
+from aiohttp import web
+
+
+class MockUpstream:
+    """模拟上游服务
+
+    Args:
+        reasoning_tokens: 推理阶段输出的 token 数
+        answer_tokens: 回答阶段输出的 token 数
+        token_interval: 相邻 token 的间隔(秒)，0 表示尽快输出
+        token_text: 每个 token 的文本
+        first_token_latency: 发送响应头后到第一个 token 的延迟(秒)
+        tokens_per_frame: 每个 SSE 帧包含的 token 数
+        frames_per_write: 每次写入 socket 的帧数，大于 1 时多个帧合并在一次写入中
+    """
+
+    def __init__(
+        self,
+        reasoning_tokens: int = 200,
+        answer_tokens: int = 200,
+        token_interval: float = 0.0,
+        token_text: str = "token ",
+        first_token_latency: float = 0.0,
+        tokens_per_frame: int = 1,
+        frames_per_write: int = 1,
+    ):
+        self.reasoning_tokens = reasoning_tokens
+        self.answer_tokens = answer_tokens
+        self.token_interval = token_interval
+        self.token_text = token_text
+        self.first_token_latency = first_token_latency
+        self.tokens_per_frame = max(1, tokens_per_frame)
+        self.frames_per_write = max(1, frames_per_write)
+        self._runner: Optional[web.AppRunner] = None
+        self.base_url = ""
+
+    def make_app(self) -> web.Application:
+        """创建 aiohttp 应用"""
+        app = web.Application()
+        app.router.add_post("/deepseek/v1/chat/completions", self.deepseek)
+        app.router.add_post("/anthropic/v1/messages", self.anthropic)
+        app.router.add_post("/openai/v1/chat/completions", self.openai)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """启动服务，返回基础地址"""
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}"
+        return self.base_url
+
+    async def stop(self) -> None:
+        """停止服务"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def _chunks(self, tokens: int) -> Iterator[Tuple[str, int]]:
+        """按 tokens_per_frame 切分输出，返回 (文本, token 数)"""
+        remaining = tokens
+        while remaining > 0:
+            count = min(self.tokens_per_frame, remaining)
+            remaining -= count
+            yield self.token_text * count, count
+
+    async def _stream(self, request: web.Request, frames: Iterator[Tuple[bytes, int]]) -> web.StreamResponse:
+        """按配置的速率写出 SSE 帧
+
+        Args:
+            request: 请求
+            frames: (帧, 该帧包含的 token 数)，token 数决定写出后的等待时间
+        """
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        try:
+            if self.first_token_latency:
+                await asyncio.sleep(self.first_token_latency)
+            pending: List[bytes] = []
+            for frame, tokens in frames:
+                pending.append(frame)
+                if len(pending) < self.frames_per_write:
+                    continue
+                await response.write(b"".join(pending))
+                pending.clear()
+                if self.token_interval and tokens:
+                    await asyncio.sleep(self.token_interval * tokens * self.frames_per_write)
+            if pending:
+                await response.write(b"".join(pending))
+        except (ConnectionResetError, asyncio.CancelledError):
+            return response
+        return response
+
+    @staticmethod
+    def _openai_frame(delta: dict, finish_reason: Optional[str] = None) -> bytes:
+        payload = {"choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+        return f"data: {json.dumps(payload)}\n\n".encode("utf-8")
+
+    async def deepseek(self, request: web.Request) -> web.StreamResponse:
+        """DeepSeek 风格: 先输出 reasoning_content，再输出 content"""
+        await request.read()
+
+        def frames():
+            for text, count in self._chunks(self.reasoning_tokens):
+                yield self._openai_frame({"reasoning_content": text, "content": None}), count
+            yield self._openai_frame({"reasoning_content": None, "content": self.token_text}), 1
+            yield b"data: [DONE]\n\n", 0
+
+        return await self._stream(request, frames())
+
+    @staticmethod
+    def _anthropic_frame(event: str, payload: dict) -> bytes:
+        return f"event: {event}\ndata: {json.dumps(payload)}\n\n".encode("utf-8")
+
+    async def anthropic(self, request: web.Request) -> web.StreamResponse:
+        """Anthropic 风格: message_start、content_block_delta、message_delta、message_stop"""
+        await request.read()
+
+        def frames():
+            yield self._anthropic_frame("message_start", {
+                "type": "message_start",
+                "message": {
+                    "id": "msg_mock",
+                    "type": "message",
+                    "role": "assistant",
+                    "content": [],
+                    "usage": {"input_tokens": 0, "output_tokens": 1},
+                },
+            }), 0
+            yield self._anthropic_frame("content_block_start", {
+                "type": "content_block_start",
+                "index": 0,
+                "content_block": {"type": "text", "text": ""},
+            }), 0
+            for text, count in self._chunks(self.answer_tokens):
+                yield self._anthropic_frame("content_block_delta", {
+                    "type": "content_block_delta",
+                    "index": 0,
+                    "delta": {"type": "text_delta", "text": text},
+                }), count
+            yield self._anthropic_frame("content_block_stop", {"type": "content_block_stop", "index": 0}), 0
+            yield self._anthropic_frame("message_delta", {
+                "type": "message_delta",
+                "delta": {"stop_reason": "end_turn"},
+                "usage": {"output_tokens": self.answer_tokens},
+            }), 0
+            yield self._anthropic_frame("message_stop", {"type": "message_stop"}), 0
+
+        return await self._stream(request, frames())
+
+    async def openai(self, request: web.Request) -> web.StreamResponse:
+        """OpenAI 兼容风格的回答流，请求 include_usage 时在结束 chunk 之后输出用量 chunk"""
+        body = await request.json()
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+        def frames():
+            for text, count in self._chunks(self.answer_tokens):
+                yield self._openai_frame({"content": text}), count
+            yield self._openai_frame({}, "stop"), 0
+            if include_usage:
+                usage = {"prompt_tokens": 0, "completion_tokens": self.answer_tokens}
+                yield f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode("utf-8"), 0
+            yield b"data: [DONE]\n\n", 0
+
+        return await self._stream(request, frames())
+
+
+def add_arguments(parser) -> None:
+    """添加模拟上游的命令行参数，供独立运行和基准脚本共用"""
+    parser.add_argument("--reasoning-tokens", type=int, default=200)
+    parser.add_argument("--answer-tokens", type=int, default=200)
+    parser.add_argument("--token-rate", type=float, default=0.0, help="每秒输出的 token 数，0 表示尽快输出")
+    parser.add_argument("--token-text", default="token ")
+    parser.add_argument("--first-token-latency", type=float, default=0.0, help="首 token 延迟(秒)")
+    parser.add_argument("--tokens-per-frame", type=int, default=1, help="每个 SSE 帧包含的 token 数")
+    parser.add_argument("--frames-per-write", type=int, default=1, help="每次写入合并的帧数")
+
+
+def upstream_argv(args) -> List[str]:
+    """将解析后的参数还原为命令行，用于在子进程中启动模拟上游"""
+    return [
+        "--reasoning-tokens", str(args.reasoning_tokens),
+        "--answer-tokens", str(args.answer_tokens),
+        "--token-rate", str(args.token_rate),
+        "--token-text", args.token_text,
+        "--first-token-latency", str(args.first_token_latency),
+        "--tokens-per-frame", str(args.tokens_per_frame),
+        "--frames-per-write", str(args.frames_per_write),
+    ]
+
+
+async def start_subprocess(argv: List[str], port: int) -> Tuple[str, asyncio.subprocess.Process]:
+    """在子进程中启动模拟上游并等待端口可用，避免与被测进程争用 CPU 和事件循环
+
+    Args:
+        argv: 模拟上游的命令行参数(不含 --port)
+        port: 监听端口
+
+    Returns:
+        Tuple[str, asyncio.subprocess.Process]: (基础地址, 子进程)
+    """
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "benchmarks.mock_upstream", "--port", str(port), *argv
+    )
+    await wait_for_port(port)
+    return f"http://127.0.0.1:{port}", process
+
+
+async def wait_for_port(port: int, host: str = "127.0.0.1", timeout: float = 10.0) -> None:
+    """等待端口开始监听"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if loop.time() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+def main() -> None:
+    """以独立进程运行模拟上游，避免与被测进程争用事件循环"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="本地模拟上游")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    upstream = MockUpstream(
+        reasoning_tokens=args.reasoning_tokens,
+        answer_tokens=args.answer_tokens,
+        token_interval=1.0 / args.token_rate if args.token_rate > 0 else 0.0,
+        token_text=args.token_text,
+        first_token_latency=args.first_token_latency,
+        tokens_per_frame=args.tokens_per_frame,
+        frames_per_write=args.frames_per_write,
+    )
+    web.run_app(upstream.make_app(), host=args.host, port=args.port, access_log=None, print=None)
+
+
+if __name__ == "__main__":
+    main()
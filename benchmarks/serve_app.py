@@ -0,0 +1,38 @@
+"""以指定配置启动 app.main:app，供基准脚本在独立进程中使用
+
+配置只加载到内存，不会写入 app/model_manager/model_configs.json。
+
+运行方式（在项目根目录）:
+    python -m benchmarks.serve_app --config bench_config.json --port 18000
+"""
+
+import argparse
+import json
+
+import uvicorn
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="以指定配置启动 DeepClaude")
+    parser.add_argument("--config", required=True, help="模型配置 JSON 文件路径")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18000)
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = json.load(f)
+
+    from app.manager import model_manager
+
+    # 直接替换内存中的配置，update_config 会写回配置文件；
+    # 同时关闭配置文件监视，避免 model_configs.json 的修改覆盖基准配置
+    config.setdefault("system", {})["config_watch"] = {"enabled": False}
+    model_manager._apply_config(config)
+
+    from app.main import app
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()